@@ -0,0 +1,61 @@
+"""Cache de archivos por campo preparados en memoria.
+
+Cada entrada guarda el objeto ya procesado (limite, guias, datos) junto con
+el mtime del archivo; el mtime se vuelve a mirar como mucho cada
+`check_interval` segundos, asi el camino de /api/pos no hace un stat por fix.
+"""
+import time
+from pathlib import Path
+from typing import Callable, Dict, Generic, Optional, TypeVar
+
+CHECK_INTERVAL = 2.0     # seg. entre chequeos de mtime
+
+T = TypeVar('T')
+
+
+class _Entry:
+    __slots__ = ('value', 'mtime', 'checked')
+
+    def __init__(self, value, mtime: Optional[int], checked: float):
+        self.value = value
+        self.mtime = mtime
+        self.checked = checked
+
+
+class CampoFileCache(Generic[T]):
+    """`load(path)` por campo para `<root>/<campo>/<filename>`; None si el archivo no existe."""
+
+    def __init__(self, root: Path, filename: str, load: Callable[[Path], Optional[T]],
+                 check_interval: float = CHECK_INTERVAL):
+        self.root = root
+        self.filename = filename
+        self.load = load
+        self.check_interval = check_interval
+        self.entries: Dict[str, _Entry] = {}
+
+    def path(self, campo: str) -> Optional[Path]:
+        path = (self.root / campo).resolve()
+        try:
+            path.relative_to(self.root)
+        except ValueError:
+            return None
+        return path / self.filename
+
+    def invalidate(self, campo: str) -> None:
+        self.entries.pop(campo, None)
+
+    def get(self, campo: str) -> Optional[T]:
+        now = time.monotonic()
+        entry = self.entries.get(campo)
+        if entry is not None and now - entry.checked < self.check_interval:
+            return entry.value
+        path = self.path(campo)
+        try:
+            mtime = path.stat().st_mtime_ns if path is not None else None
+        except OSError:
+            mtime = None
+        if entry is not None and entry.mtime == mtime:
+            entry.checked = now
+            return entry.value
+        self.entries[campo] = entry = _Entry(self.load(path) if mtime is not None else None, mtime, now)
+        return entry.value
@@ -0,0 +1,199 @@
+"""Cobertura de labor sobre una grilla local.
+
+La franja trabajada (recorrido + ancho de maquinaria) se rasteriza en celdas
+de pocos decimetros en un plano local en metros; de la grilla salen el area
+cubierta sin contar solapes y el poligono GeoJSON del borde.
+"""
+import math
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from .geodesia import LocalPlane
+
+MIN_CELL_M = 0.25
+MAX_CELLS = 40_000_000   # tope de memoria de la grilla (bytes)
+
+
+def decimate_by_distance(x: np.ndarray, y: np.ndarray, step: float) -> np.ndarray:
+    """Indices a conservar para tener ~1 punto cada `step` metros de recorrido (siempre primero y ultimo)."""
+    n = len(x)
+    if n <= 2 or step <= 0:
+        return np.arange(n)
+    seg = np.hypot(np.diff(x), np.diff(y))
+    dist = np.concatenate(([0.0], np.cumsum(seg)))
+    bucket = np.floor(dist / step).astype(np.int64)
+    keep = np.flatnonzero(np.diff(bucket, prepend=-1) != 0)
+    if keep[-1] != n - 1:
+        keep = np.append(keep, n - 1)
+    return keep
+
+
+def cell_size_for(width: float) -> float:
+    return max(MIN_CELL_M, width / 16.0)
+
+
+class CoverageGrid:
+    """Grilla booleana de celdas trabajadas en un plano local."""
+
+    def __init__(self, x0: float, y0: float, nx: int, ny: int, cell: float):
+        if nx * ny > MAX_CELLS:
+            raise ValueError("recorrido demasiado extenso para la resolucion de cobertura")
+        self.x0, self.y0, self.cell = x0, y0, cell
+        self.mask = np.zeros((ny, nx), dtype=bool)
+
+    @classmethod
+    def for_extent(cls, xmin: float, ymin: float, xmax: float, ymax: float, cell: float, margin: float = 0.0):
+        x0 = math.floor((xmin - margin) / cell) * cell
+        y0 = math.floor((ymin - margin) / cell) * cell
+        nx = int(math.ceil((xmax + margin - x0) / cell)) + 1
+        ny = int(math.ceil((ymax + margin - y0) / cell)) + 1
+        return cls(x0, y0, nx, ny, cell)
+
+    def paint_swath(self, x: np.ndarray, y: np.ndarray, width: float) -> None:
+        """Marca las celdas cuyo centro queda a menos de width/2 de algun segmento."""
+        r = width / 2.0
+        c = self.cell
+        ny, nx = self.mask.shape
+        if len(x) == 1:
+            x = np.append(x, x)
+            y = np.append(y, y)
+        for ax, ay, bx, by in zip(x[:-1], y[:-1], x[1:], y[1:]):
+            i0 = max(0, int((min(ax, bx) - r - self.x0) / c))
+            i1 = min(nx, int((max(ax, bx) + r - self.x0) / c) + 1)
+            j0 = max(0, int((min(ay, by) - r - self.y0) / c))
+            j1 = min(ny, int((max(ay, by) + r - self.y0) / c) + 1)
+            if i0 >= i1 or j0 >= j1:
+                continue
+            px = self.x0 + (np.arange(i0, i1) + 0.5) * c
+            py = self.y0 + (np.arange(j0, j1) + 0.5) * c
+            dx, dy = bx - ax, by - ay
+            ll = dx * dx + dy * dy
+            qx = px[None, :] - ax
+            qy = py[:, None] - ay
+            t = np.clip((qx * dx + qy * dy) / ll, 0.0, 1.0) if ll > 0 else 0.0
+            d2 = (qx - t * dx) ** 2 + (qy - t * dy) ** 2
+            self.mask[j0:j1, i0:i1] |= d2 <= r * r
+
+    def area_m2(self) -> float:
+        return float(np.count_nonzero(self.mask)) * self.cell * self.cell
+
+    def rings(self) -> List[List[Tuple[float, float]]]:
+        """Contornos de las celdas marcadas como anillos cerrados en metros.
+
+        Exteriores en sentido antihorario y huecos en horario; los vertices
+        colineales se eliminan.
+        """
+        m = np.pad(self.mask, 1)
+        # Aristas dirigidas dejando la region a la izquierda, en coordenadas de esquina de celda
+        edges: Dict[Tuple[int, int], List[Tuple[int, int]]] = {}
+
+        def add(starts, dxy):
+            for j, i in zip(*starts):
+                a = (int(i), int(j))
+                edges.setdefault(a, []).append((a[0] + dxy[0], a[1] + dxy[1]))
+
+        inside = m[1:-1, 1:-1]
+        # borde inferior (vecino de abajo vacio): de izquierda a derecha
+        jj, ii = np.nonzero(inside & ~m[:-2, 1:-1])
+        add((jj, ii), (1, 0))
+        # borde superior: de derecha a izquierda
+        jj, ii = np.nonzero(inside & ~m[2:, 1:-1])
+        add((jj + 1, ii + 1), (-1, 0))
+        # borde derecho: de abajo hacia arriba
+        jj, ii = np.nonzero(inside & ~m[1:-1, 2:])
+        add((jj, ii + 1), (0, 1))
+        # borde izquierdo: de arriba hacia abajo
+        jj, ii = np.nonzero(inside & ~m[1:-1, :-2])
+        add((jj + 1, ii), (0, -1))
+
+        rings = []
+        while edges:
+            start = next(iter(edges))
+            ring = [start]
+            cur = start
+            prev_dir = None
+            while True:
+                outs = edges.get(cur)
+                if not outs:
+                    break
+                if len(outs) > 1 and prev_dir is not None:
+                    # vertice compartido en diagonal: girar a la izquierda primero
+                    left = (-prev_dir[1], prev_dir[0])
+                    nxt = next((o for o in outs if (o[0] - cur[0], o[1] - cur[1]) == left), outs[0])
+                else:
+                    nxt = outs[0]
+                outs.remove(nxt)
+                if not outs:
+                    del edges[cur]
+                prev_dir = (nxt[0] - cur[0], nxt[1] - cur[1])
+                cur = nxt
+                if cur == start:
+                    break
+                ring.append(cur)
+            rings.append(_drop_collinear(ring))
+        c = self.cell
+        return [[(self.x0 + i * c, self.y0 + j * c) for i, j in ring] for ring in rings if len(ring) >= 3]
+
+    def to_geojson(self, plane: LocalPlane) -> dict | None:
+        """Geometria GeoJSON (Polygon o MultiPolygon) de la cobertura."""
+        outers, holes = [], []
+        for ring in self.rings():
+            (outers if _signed_area(ring) > 0 else holes).append(ring)
+        if not outers:
+            return None
+        polys = [[o] for o in outers]
+        for h in holes:
+            hx, hy = h[0]
+            for poly in polys:
+                if _point_in_ring(hx + 1e-9, hy + 1e-9, poly[0]):
+                    poly.append(h)
+                    break
+
+        def to_ll(ring):
+            xs, ys = zip(*(ring + [ring[0]]))
+            lon, lat = plane.to_lonlat(xs, ys)
+            return [[round(float(a), 9), round(float(b), 9)] for a, b in zip(lon, lat)]
+
+        coords = [[to_ll(r) for r in poly] for poly in polys]
+        if len(coords) == 1:
+            return {'type': 'Polygon', 'coordinates': coords[0]}
+        return {'type': 'MultiPolygon', 'coordinates': coords}
+
+
+def _drop_collinear(ring):
+    out = []
+    n = len(ring)
+    for k in range(n):
+        ax, ay = ring[k - 1]
+        bx, by = ring[k]
+        cx, cy = ring[(k + 1) % n]
+        if (bx - ax) * (cy - by) - (by - ay) * (cx - bx) != 0:
+            out.append(ring[k])
+    return out
+
+
+def _signed_area(ring) -> float:
+    xs = np.array([p[0] for p in ring])
+    ys = np.array([p[1] for p in ring])
+    return 0.5 * float(np.dot(xs, np.roll(ys, -1)) - np.dot(np.roll(xs, -1), ys))
+
+
+def _point_in_ring(x: float, y: float, ring) -> bool:
+    inside = False
+    n = len(ring)
+    for k in range(n):
+        ax, ay = ring[k]
+        bx, by = ring[(k + 1) % n]
+        if (ay > y) != (by > y) and x < ax + (y - ay) * (bx - ax) / (by - ay):
+            inside = not inside
+    return inside
+
+
+def swath_coverage(lon: np.ndarray, lat: np.ndarray, width: float, plane: LocalPlane | None = None):
+    """Cobertura de una pasada: (grilla, plano) para un recorrido lon/lat y ancho en metros."""
+    plane = plane or LocalPlane.around(lon, lat)
+    x, y = plane.to_xy(lon, lat)
+    grid = CoverageGrid.for_extent(x.min(), y.min(), x.max(), y.max(), cell_size_for(width), margin=width)
+    grid.paint_swath(x, y, width)
+    return grid, plane
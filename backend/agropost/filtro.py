@@ -0,0 +1,165 @@
+"""Filtro de fixes en la ingesta: rechazo de saltos y Kalman por vehiculo.
+
+Cada sesion tiene un filtro de velocidad constante en un plano local (metros
+Este/Norte alrededor del primer fix). Con ruido de medicion isotropo los dos
+ejes son independientes, asi que se resuelve como dos filtros de 2 estados
+con aritmetica escalar: O(1) por fix y sin matrices.
+
+La incertidumbre de cada fix sale de `h_acc` si el receptor la informa, o de
+la calidad del fix (RTK fijo, flotante, DGPS, autonomo) agravada por pocos
+satelites o PDOP alto, de modo que los Float pesan menos que los Fixed.
+"""
+import math
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from .geodesia import LocalPlane
+
+MAX_SPEED = 15.0          # m/s: saltos mas rapidos se rechazan (maquinaria agricola < 54 km/h)
+ACCEL_NOISE = 0.5         # m/s^2: maniobras admitidas por el modelo de velocidad constante
+MAX_GAP = 30.0            # seg. sin fixes tras los que se reinicia el filtro
+MAX_REJECTS = 5           # rechazos seguidos que se toman como reubicacion real
+# Desvio tipico (m) por calidad de fix cuando no hay h_acc
+SIGMA_POR_FIX = {4: 0.02, 5: 0.3, 2: 1.0, 1: 3.0}
+SIGMA_DEFAULT = 3.0
+
+
+def parse_ts(ts: Optional[str]) -> Optional[float]:
+    if not ts:
+        return None
+    try:
+        return datetime.fromisoformat(ts.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+def fix_sigma(fix: Optional[int], sats: Optional[int], pdop: Optional[float], h_acc: Optional[float]) -> float:
+    if h_acc is not None and h_acc > 0:
+        sigma = h_acc
+    else:
+        sigma = SIGMA_POR_FIX.get(fix, SIGMA_DEFAULT)
+    if sats is not None and sats < 6:
+        sigma *= 2.0
+    if pdop is not None and pdop > 3.0:
+        sigma *= pdop / 3.0
+    return max(sigma, 0.005)
+
+
+class _Axis:
+    """Kalman de posicion/velocidad en un eje: estado (p, v) y covarianza [[a, b], [b, c]]."""
+    __slots__ = ('p', 'v', 'a', 'b', 'c')
+
+    def __init__(self, p: float, var: float):
+        self.p, self.v = p, 0.0
+        self.a, self.b, self.c = var, 0.0, 4.0   # velocidad inicial desconocida (~2 m/s)
+
+    def predict(self, dt: float, q: float) -> None:
+        dt2 = dt * dt
+        self.p += self.v * dt
+        self.a += 2.0 * dt * self.b + dt2 * self.c + q * dt2 * dt2 / 4.0
+        self.b += dt * self.c + q * dt2 * dt / 2.0
+        self.c += q * dt2
+
+    def update(self, z: float, r: float) -> None:
+        s = self.a + r
+        k0, k1 = self.a / s, self.b / s
+        y = z - self.p
+        self.p += k0 * y
+        self.v += k1 * y
+        a, b = self.a, self.b
+        self.a = (1.0 - k0) * a
+        self.b = (1.0 - k0) * b
+        self.c -= k1 * b
+
+
+class FixFilter:
+    def __init__(self, lat: float, lon: float, t: float, sigma: float):
+        self.plane = LocalPlane(lat, lon)
+        self.t = t
+        self.e = _Axis(0.0, sigma * sigma)
+        self.n = _Axis(0.0, sigma * sigma)
+        self.rejects = 0
+
+    def _to_local(self, lat: float, lon: float) -> Tuple[float, float]:
+        return self.plane.xy(lon, lat)
+
+    def _to_geo(self, e: float, n: float) -> Tuple[float, float]:
+        lon, lat = self.plane.lonlat(e, n)
+        return lat, lon
+
+    def step(self, lat: float, lon: float, t: float, sigma: float, max_speed: float) -> Optional[str]:
+        """Incorpora un fix. Devuelve el motivo si se rechaza, None si se acepto."""
+        dt = t - self.t
+        if dt < 0:
+            self.rejects += 1
+            return 'desordenado'
+        ze, zn = self._to_local(lat, lon)
+        if dt > 0:
+            jump = math.hypot(ze - self.e.p, zn - self.n.p)
+            # Margen por la incertidumbre del fix y del estado: no rechazar ruido de un Float
+            slack = 3.0 * (sigma + math.sqrt(self.e.a + self.n.a))
+            if jump > max_speed * dt + slack:
+                self.rejects += 1
+                return 'velocidad'
+            q = ACCEL_NOISE * ACCEL_NOISE
+            self.e.predict(dt, q)
+            self.n.predict(dt, q)
+            self.t = t
+        r = sigma * sigma
+        self.e.update(ze, r)
+        self.n.update(zn, r)
+        self.rejects = 0
+        return None
+
+    def state(self) -> dict:
+        lat, lon = self._to_geo(self.e.p, self.n.p)
+        ve, vn = self.e.v, self.n.v
+        return {
+            'lat': lat,
+            'lon': lon,
+            'speed': math.hypot(ve, vn),
+            'heading': math.degrees(math.atan2(ve, vn)) % 360.0,
+            'sigma': math.sqrt(0.5 * (self.e.a + self.n.a)),
+        }
+
+
+class FilterBank:
+    """Un `FixFilter` por sesion; reinicia ante huecos largos o reubicaciones."""
+
+    def __init__(self, max_speed: float = MAX_SPEED):
+        self.max_speed = max_speed
+        self.filters: Dict[tuple, FixFilter] = {}
+        self.stats = {'aceptados': 0, 'rechazados': 0, 'reinicios': 0}
+
+    def process(self, key: tuple, msg: dict, t: float) -> Optional[str]:
+        """Filtra `msg` en el lugar (lat/lon suavizados, lat_raw/lon_raw con lo recibido).
+
+        Devuelve el motivo de rechazo, o None si el fix se acepta.
+        """
+        lat, lon = msg['lat'], msg['lon']
+        sigma = fix_sigma(msg.get('fix_quality'), msg.get('sats'), msg.get('pdop'), msg.get('h_acc'))
+        flt = self.filters.get(key)
+        if flt is not None and (t - flt.t > MAX_GAP or flt.rejects >= MAX_REJECTS):
+            flt = None
+            self.stats['reinicios'] += 1
+        if flt is None:
+            flt = self.filters[key] = FixFilter(lat, lon, t, sigma)
+        else:
+            reason = flt.step(lat, lon, t, sigma, self.max_speed)
+            if reason is not None:
+                self.stats['rechazados'] += 1
+                return reason
+        self.stats['aceptados'] += 1
+        st = flt.state()
+        msg['lat_raw'], msg['lon_raw'] = lat, lon
+        msg['lat'], msg['lon'] = st['lat'], st['lon']
+        if msg.get('speed') is None:
+            msg['speed'] = round(st['speed'], 3)
+        if msg.get('heading') is None and st['speed'] > 0.2:
+            msg['heading'] = round(st['heading'], 1)
+        msg['sigma'] = round(st['sigma'], 3)
+        msg['filtrado'] = True
+        return None
+
+    def forget(self, key: tuple) -> None:
+        self.filters.pop(key, None)
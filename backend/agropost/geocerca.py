@@ -0,0 +1,204 @@
+"""Geocerca de fixes contra el limite del campo (area.geojson).
+
+El limite se prepara una sola vez por campo: se proyecta al plano local y se
+cubre con una grilla cuyas celdas quedan clasificadas como dentro, fuera o
+borde. Las celdas de borde son las que tienen alguna arista a menos de
+`margen` (+ media diagonal) de su centro y guardan la lista de esas aristas.
+Un fix que cae en una celda interior o exterior se resuelve con un lookup;
+en una celda de borde se parte del estado conocido del centro de la celda y
+se cuentan los cruces del segmento centro -> fix con las aristas del balde,
+ademas de la distancia minima a ellas para marcar 'borde'. Huecos y
+MultiPolygon salen solos por paridad.
+"""
+import json
+import math
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .cache_campos import CHECK_INTERVAL, CampoFileCache
+from .geodesia import LocalPlane
+
+BORDE_M = 3.0            # franja alrededor del limite donde un fix se informa como 'borde'
+TARGET_CELLS = 16_384    # celdas de la grilla preparada (~128 x 128)
+LIMIT_ROLES = None   # en area.geojson todo poligono es limite, sea cual sea el role (la UI lo guarda como 'coverage')
+
+DENTRO, FUERA, BORDE = 'dentro', 'fuera', 'borde'
+_OUT, _IN, _EDGE = 0, 1, 2
+
+
+def boundary_polygons(fc: dict, roles=LIMIT_ROLES) -> List[List[List[Tuple[float, float]]]]:
+    """Poligonos (exterior + huecos, en lon/lat) de un FeatureCollection con role en `roles` (None = todos)."""
+    polys = []
+    for feat in fc.get('features') or []:
+        if not isinstance(feat, dict):
+            continue
+        props = feat.get('properties') if isinstance(feat.get('properties'), dict) else {}
+        if roles is not None and props.get('role') not in roles:
+            continue
+        geom = feat.get('geometry') or {}
+        if geom.get('type') == 'Polygon':
+            coords = [geom.get('coordinates') or []]
+        elif geom.get('type') == 'MultiPolygon':
+            coords = geom.get('coordinates') or []
+        else:
+            continue
+        for poly in coords:
+            rings = []
+            for ring in poly:
+                pts = [(float(p[0]), float(p[1])) for p in ring if len(p) >= 2]
+                if len(pts) >= 3:
+                    rings.append(pts)
+            if rings:
+                polys.append(rings)
+    return polys
+
+
+def boundary_rings(fc: dict) -> List[List[Tuple[float, float]]]:
+    """Anillos (exteriores y huecos) lon/lat de los poligonos de limite de un FeatureCollection."""
+    return [ring for poly in boundary_polygons(fc) for ring in poly]
+
+
+def ring_edges(plane: LocalPlane, rings) -> np.ndarray:
+    """Aristas (ax, ay, bx, by) en metros de anillos lon/lat, cerrandolos si hace falta y sin aristas nulas."""
+    segs = []
+    for r in rings:
+        x, y = plane.to_xy([p[0] for p in r], [p[1] for p in r])
+        if x[0] != x[-1] or y[0] != y[-1]:
+            x, y = np.append(x, x[0]), np.append(y, y[0])
+        segs.append(np.column_stack((x[:-1], y[:-1], x[1:], y[1:])))
+    edges = np.concatenate(segs)
+    return edges[(edges[:, 0] != edges[:, 2]) | (edges[:, 1] != edges[:, 3])]
+
+
+def scanline_inside(edges: np.ndarray, cx: np.ndarray, cy: np.ndarray) -> np.ndarray:
+    """Paridad de cruces por fila: True donde el punto (cx[i], cy[j]) esta dentro de los anillos."""
+    ax, ay, bx, by = edges.T
+    inside = np.zeros((len(cy), len(cx)), dtype=bool)
+    for j, y in enumerate(cy):
+        hit = (ay > y) != (by > y)
+        if not hit.any():
+            continue
+        a_x, a_y, b_x, b_y = ax[hit], ay[hit], bx[hit], by[hit]
+        xc = np.sort(a_x + (y - a_y) * (b_x - a_x) / (b_y - a_y))
+        inside[j] = np.searchsorted(xc, cx, side='right') % 2 == 1
+    return inside
+
+
+class PreparedArea:
+    """Limite de un campo listo para clasificar fixes en O(1) promedio."""
+
+    def __init__(self, rings: List[List[Tuple[float, float]]], margin: float = BORDE_M):
+        if not rings:
+            raise ValueError('limite vacio')
+        lon = np.concatenate([np.asarray(r, dtype=float)[:, 0] for r in rings])
+        lat = np.concatenate([np.asarray(r, dtype=float)[:, 1] for r in rings])
+        self.plane = LocalPlane.around(lon, lat)
+        self.margin = margin
+
+        self.edges = ring_edges(self.plane, rings)
+
+        xs = np.concatenate((self.edges[:, 0], self.edges[:, 2]))
+        ys = np.concatenate((self.edges[:, 1], self.edges[:, 3]))
+        pad = margin
+        xmin, xmax = xs.min() - pad, xs.max() + pad
+        ymin, ymax = ys.min() - pad, ys.max() + pad
+        cell = max(margin, math.sqrt((xmax - xmin) * (ymax - ymin) / TARGET_CELLS), 0.5)
+        self.cell = cell
+        self.x0, self.y0 = xmin - cell, ymin - cell
+        self.nx = int(math.ceil((xmax + cell - self.x0) / cell))
+        self.ny = int(math.ceil((ymax + cell - self.y0) / cell))
+
+        cx = self.x0 + (np.arange(self.nx) + 0.5) * cell
+        cy = self.y0 + (np.arange(self.ny) + 0.5) * cell
+        self.center_in = scanline_inside(self.edges, cx, cy)
+        self.kind = np.where(self.center_in, _IN, _OUT).astype(np.uint8)
+        self.buckets: Dict[int, np.ndarray] = {}
+        self._bucket_edges(cx, cy)
+
+    def _bucket_edges(self, cx: np.ndarray, cy: np.ndarray) -> None:
+        """Marca como borde las celdas cercanas a cada arista y arma los baldes de aristas."""
+        c = self.cell
+        reach = self.margin + c * math.sqrt(0.5)
+        per_cell: Dict[int, List[int]] = {}
+        for k, (ax, ay, bx, by) in enumerate(self.edges):
+            i0 = max(0, int((min(ax, bx) - reach - self.x0) / c))
+            i1 = min(self.nx, int((max(ax, bx) + reach - self.x0) / c) + 1)
+            j0 = max(0, int((min(ay, by) - reach - self.y0) / c))
+            j1 = min(self.ny, int((max(ay, by) + reach - self.y0) / c) + 1)
+            dx, dy = bx - ax, by - ay
+            ll = dx * dx + dy * dy
+            qx = cx[None, i0:i1] - ax
+            qy = cy[j0:j1, None] - ay
+            t = np.clip((qx * dx + qy * dy) / ll, 0.0, 1.0)
+            near = (qx - t * dx) ** 2 + (qy - t * dy) ** 2 <= reach * reach
+            for j, i in zip(*np.nonzero(near)):
+                per_cell.setdefault((j0 + int(j)) * self.nx + i0 + int(i), []).append(k)
+        flat = self.kind.reshape(-1)
+        for idx, ks in per_cell.items():
+            flat[idx] = _EDGE
+            self.buckets[idx] = np.array(ks, dtype=np.int64)
+
+    def classify_xy(self, x: float, y: float) -> Tuple[str, bool]:
+        """(estado, dentro) para un punto del plano local."""
+        i = int((x - self.x0) // self.cell)
+        j = int((y - self.y0) // self.cell)
+        if not (0 <= i < self.nx and 0 <= j < self.ny):
+            return FUERA, False
+        kind = self.kind[j, i]
+        if kind == _IN:
+            return DENTRO, True
+        if kind == _OUT:
+            return FUERA, False
+        seg = self.edges[self.buckets[j * self.nx + i]]
+        ax, ay, bx, by = seg[:, 0], seg[:, 1], seg[:, 2], seg[:, 3]
+        # Cruces del segmento centro -> punto con las aristas del balde (orientacion estricta)
+        px = self.x0 + (i + 0.5) * self.cell
+        py = self.y0 + (j + 0.5) * self.cell
+        d1 = (bx - ax) * (py - ay) - (by - ay) * (px - ax)
+        d2 = (bx - ax) * (y - ay) - (by - ay) * (x - ax)
+        d3 = (x - px) * (ay - py) - (y - py) * (ax - px)
+        d4 = (x - px) * (by - py) - (y - py) * (bx - px)
+        crossings = int(np.count_nonzero(((d1 > 0) != (d2 > 0)) & ((d3 > 0) != (d4 > 0))))
+        inside = bool(self.center_in[j, i]) != (crossings % 2 == 1)
+        dx, dy = bx - ax, by - ay
+        t = np.clip(((x - ax) * dx + (y - ay) * dy) / (dx * dx + dy * dy), 0.0, 1.0)
+        d2min = float(np.min((x - ax - t * dx) ** 2 + (y - ay - t * dy) ** 2))
+        if d2min <= self.margin * self.margin:
+            return BORDE, inside
+        return (DENTRO if inside else FUERA), inside
+
+    def classify(self, lon: float, lat: float) -> Tuple[str, bool]:
+        return self.classify_xy(*self.plane.xy(lon, lat))
+
+
+class GeofenceStore(CampoFileCache[PreparedArea]):
+    """Limites preparados por campo, recargados si cambia el mtime de area.geojson.
+
+    `margin_for(campo_dir)` da el ancho de la franja de borde (p.ej. medio
+    ancho de la maquinaria actual); None usa BORDE_M.
+    """
+
+    def __init__(self, root: Path, margin_for: Optional[Callable[[Path], Optional[float]]] = None,
+                 check_interval: float = CHECK_INTERVAL):
+        super().__init__(root, 'area.geojson', self._load, check_interval)
+        self.margin_for = margin_for
+
+    def _load(self, path: Path) -> Optional[PreparedArea]:
+        try:
+            fc = json.loads(path.read_text(encoding='utf-8-sig'))
+        except (OSError, ValueError):
+            return None
+        rings = boundary_rings(fc) if isinstance(fc, dict) else []
+        if not rings:
+            return None
+        margin = self.margin_for(path.parent) if self.margin_for is not None else None
+        return PreparedArea(rings, margin or BORDE_M)
+
+    def classify(self, campo: str, lon: float, lat: float) -> Optional[Tuple[str, bool]]:
+        """(estado, dentro), o None si el campo no tiene limite cargado."""
+        area = self.get(campo)
+        if area is None:
+            return None
+        return area.classify(lon, lat)
@@ -0,0 +1,166 @@
+"""Geodesia comun: plano local ENU sobre el elipsoide WGS84, distancias, rumbos y areas.
+
+`LocalPlane` es el plano tangente (Este, Norte) en un origen, via coordenadas
+ECEF: las distancias en el plano quedan a pocos mm de la geodesica en un
+campo de 10 km, donde la equirectangular `111_320 * cos(lat)` se desviaba
+metros (esfera y no elipsoide). La ida y vuelta lon/lat -> x/y -> lon/lat es
+exacta a menos de 1e-6 m. Se crea uno por campo o recorrido (`LocalPlane.around`) y
+se reutiliza; las transformaciones aceptan arrays de numpy y hay versiones
+escalares (`xy`, `lonlat`) con `math` para el camino por fix.
+
+`distance` y `bearing` usan la cuerda ECEF (llevada al arco con c^3/24R^2) y el
+acimut en el ENU del primer punto: coinciden con la geodesica a menos de 1 um a
+1 km, 0.1 mm a 20 km y 1e-6 grados, que sobra para la escala de un campo. `dist_m` es la version escalar y barata
+para distancias de pocos metros entre fixes.
+"""
+import math
+from typing import Tuple
+
+import numpy as np
+
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+WGS84_E2 = WGS84_F * (2 - WGS84_F)
+WGS84_EP2 = WGS84_E2 / (1 - WGS84_E2)
+
+
+def radii(lat):
+    """Radios de curvatura (meridiano M, primer vertical N) en metros a la latitud dada."""
+    s = np.sin(np.radians(lat))
+    w = 1.0 - WGS84_E2 * s * s
+    return WGS84_A * (1 - WGS84_E2) / w ** 1.5, WGS84_A / np.sqrt(w)
+
+
+def to_ecef(lon, lat, h=0.0):
+    lam, phi = np.radians(lon), np.radians(lat)
+    sp, cp = np.sin(phi), np.cos(phi)
+    n = WGS84_A / np.sqrt(1.0 - WGS84_E2 * sp * sp)
+    return (n + h) * cp * np.cos(lam), (n + h) * cp * np.sin(lam), (n * (1 - WGS84_E2) + h) * sp
+
+
+def from_ecef(x, y, z):
+    """(lon, lat, h) desde ECEF (Bowring, error sub-milimetrico cerca de la superficie)."""
+    p = np.hypot(x, y)
+    th = np.arctan2(z * WGS84_A, p * WGS84_B)
+    st, ct = np.sin(th), np.cos(th)
+    phi = np.arctan2(z + WGS84_EP2 * WGS84_B * st ** 3, p - WGS84_E2 * WGS84_A * ct ** 3)
+    sp = np.sin(phi)
+    n = WGS84_A / np.sqrt(1.0 - WGS84_E2 * sp * sp)
+    h = p / np.cos(phi) - n
+    return np.degrees(np.arctan2(y, x)), np.degrees(phi), h
+
+
+class LocalPlane:
+    """Plano tangente ENU en (lat0, lon0): x al Este, y al Norte, en metros."""
+
+    def __init__(self, lat0: float, lon0: float):
+        self.lat0 = float(lat0)
+        self.lon0 = float(lon0)
+        phi, lam = math.radians(self.lat0), math.radians(self.lon0)
+        self.sp, self.cp = math.sin(phi), math.cos(phi)
+        self.sl, self.cl = math.sin(lam), math.cos(lam)
+        self.x0, self.y0, self.z0 = (float(v) for v in to_ecef(self.lon0, self.lat0))
+        # el elipsoide cae bajo el plano ~ x^2/2N + y^2/2M: se usa en la inversa para volver a la superficie
+        m, n = radii(self.lat0)
+        self.cm, self.cn = 0.5 / float(m), 0.5 / float(n)
+
+    @classmethod
+    def around(cls, lon, lat) -> 'LocalPlane':
+        """Plano centrado en el promedio de los puntos (un campo, un recorrido)."""
+        return cls(float(np.mean(lat)), float(np.mean(lon)))
+
+    def to_enu(self, lon, lat, h=0.0):
+        x, y, z = to_ecef(np.asarray(lon, dtype=float), np.asarray(lat, dtype=float), h)
+        dx, dy, dz = x - self.x0, y - self.y0, z - self.z0
+        e = -self.sl * dx + self.cl * dy
+        t = self.cl * dx + self.sl * dy
+        n = -self.sp * t + self.cp * dz
+        u = self.cp * t + self.sp * dz
+        return e, n, u
+
+    def to_xy(self, lon, lat):
+        e, n, _ = self.to_enu(lon, lat)
+        return e, n
+
+    def to_lonlat(self, x, y):
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        u = -(self.cn * x * x + self.cm * y * y)
+        t = -self.sp * y + self.cp * u
+        dz = self.cp * y + self.sp * u
+        lon, lat, _ = from_ecef(self.x0 + self.cl * t - self.sl * x, self.y0 + self.sl * t + self.cl * x, self.z0 + dz)
+        return lon, lat
+
+    def xy(self, lon: float, lat: float) -> Tuple[float, float]:
+        """`to_xy` para un punto, sin numpy (camino por fix)."""
+        phi, lam = math.radians(lat), math.radians(lon)
+        sp, cp = math.sin(phi), math.cos(phi)
+        n = WGS84_A / math.sqrt(1.0 - WGS84_E2 * sp * sp)
+        dx = n * cp * math.cos(lam) - self.x0
+        dy = n * cp * math.sin(lam) - self.y0
+        dz = n * (1 - WGS84_E2) * sp - self.z0
+        return -self.sl * dx + self.cl * dy, -self.sp * (self.cl * dx + self.sl * dy) + self.cp * dz
+
+    def lonlat(self, x: float, y: float) -> Tuple[float, float]:
+        """`to_lonlat` para un punto, sin numpy."""
+        u = -(self.cn * x * x + self.cm * y * y)
+        t = -self.sp * y + self.cp * u
+        ex = self.x0 + self.cl * t - self.sl * x
+        ey = self.y0 + self.sl * t + self.cl * x
+        ez = self.z0 + self.cp * y + self.sp * u
+        p = math.hypot(ex, ey)
+        th = math.atan2(ez * WGS84_A, p * WGS84_B)
+        st, ct = math.sin(th), math.cos(th)
+        phi = math.atan2(ez + WGS84_EP2 * WGS84_B * st ** 3, p - WGS84_E2 * WGS84_A * ct ** 3)
+        return math.degrees(math.atan2(ey, ex)), math.degrees(phi)
+
+
+def distance(lon1, lat1, lon2, lat2):
+    """Distancia en metros entre pares de puntos (arrays o escalares)."""
+    x1, y1, z1 = to_ecef(lon1, lat1)
+    x2, y2, z2 = to_ecef(lon2, lat2)
+    c2 = (x2 - x1) ** 2 + (y2 - y1) ** 2 + (z2 - z1) ** 2
+    # cuerda -> arco sobre el radio medio de Gauss a la latitud media
+    m, n = radii(0.5 * (np.asarray(lat1, dtype=float) + np.asarray(lat2, dtype=float)))
+    return np.sqrt(c2) * (1.0 + c2 / (24.0 * m * n))
+
+
+def bearing(lon1, lat1, lon2, lat2):
+    """Rumbo inicial en grados (0 = Norte, sentido horario) del punto 1 al 2."""
+    x1, y1, z1 = to_ecef(lon1, lat1)
+    x2, y2, z2 = to_ecef(lon2, lat2)
+    dx, dy, dz = x2 - x1, y2 - y1, z2 - z1
+    phi, lam = np.radians(lat1), np.radians(lon1)
+    sl, cl, sp, cp = np.sin(lam), np.cos(lam), np.sin(phi), np.cos(phi)
+    e = -sl * dx + cl * dy
+    n = -sp * (cl * dx + sl * dy) + cp * dz
+    return np.degrees(np.arctan2(e, n)) % 360.0
+
+
+def shoelace(x, y) -> float:
+    """Area (positiva en sentido antihorario) de un anillo en metros."""
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    return 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y))
+
+
+def area(lon, lat, plane: LocalPlane = None) -> float:
+    """Area en m^2 de un anillo lon/lat (cerrado o no) proyectado al plano local."""
+    plane = plane or LocalPlane.around(lon, lat)
+    return abs(shoelace(*plane.to_xy(lon, lat)))
+
+
+def dist_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distancia escalar para puntos cercanos (radios de curvatura a la latitud media)."""
+    s = math.sin(math.radians(0.5 * (lat1 + lat2)))
+    w = 1.0 - WGS84_E2 * s * s
+    m = WGS84_A * (1 - WGS84_E2) / w ** 1.5
+    n = WGS84_A / math.sqrt(w)
+    dx = math.radians(lon2 - lon1) * n * math.sqrt(1.0 - s * s)
+    dy = math.radians(lat2 - lat1) * m
+    return math.hypot(dx, dy)
+
+
+def meters_to_deg(dx, dy, at_lat):
+    """Desplazamiento (Este, Norte) en metros -> (dlat, dlon) en grados a la latitud dada."""
+    m, n = radii(at_lat)
+    return np.degrees(dy / m), np.degrees(dx / (n * np.cos(np.radians(at_lat))))
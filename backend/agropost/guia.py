@@ -0,0 +1,182 @@
+"""Guiado por lineas AB o curvas de referencia del campo.
+
+Las guias viven en `guias.geojson` del campo: LineString con
+`properties.nombre` (2 puntos = linea AB, mas = curva) y la activa en
+`metadata.activa`. Para cada fix se busca el punto mas cercano de la
+referencia y de ahi salen el error lateral (xte, positivo a la derecha del
+sentido A -> B), la pasada (las paralelas estan separadas por el ancho de la
+maquinaria) y el error de rumbo contra la tangente, tomando el sentido de ida
+o vuelta mas cercano porque las pasadas se alternan.
+
+La busqueda usa un arbol de cajas sobre bloques de segmentos consecutivos
+(busqueda con poda por cota), O(log n) en curvas de miles de vertices. Los
+extremos se prolongan en linea recta para que las cabeceras sigan guiadas.
+"""
+import json
+import math
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .cache_campos import CampoFileCache
+from .geodesia import LocalPlane
+
+EXTENSION_M = 1000.0     # prolongacion recta de la referencia en cada extremo
+LEAF_SEGMENTS = 16       # segmentos por hoja del arbol
+
+
+class PolylineIndex:
+    """Segmentos de una polilinea en el plano local con un arbol de cajas implicito."""
+
+    def __init__(self, x: np.ndarray, y: np.ndarray):
+        keep = np.concatenate(([True], (np.diff(x) != 0) | (np.diff(y) != 0)))
+        x, y = np.asarray(x, dtype=float)[keep], np.asarray(y, dtype=float)[keep]
+        if len(x) < 2:
+            raise ValueError('la guia necesita al menos dos puntos distintos')
+        x, y = self._extend(x, y)
+        self.ax, self.ay = x[:-1].tolist(), y[:-1].tolist()
+        dx, dy = np.diff(x), np.diff(y)
+        self.dx, self.dy = dx.tolist(), dy.tolist()
+        self.ll = (dx * dx + dy * dy).tolist()
+        self.n = len(self.ax)
+
+        leaves = -(-self.n // LEAF_SEGMENTS)
+        size = 1
+        while size < leaves:
+            size *= 2
+        self.size = size
+        starts = np.arange(leaves) * LEAF_SEGMENTS
+        box = np.full((2 * size, 4), [np.inf, np.inf, -np.inf, -np.inf])
+        box[size:size + leaves, 0] = np.minimum.reduceat(np.minimum(x[:-1], x[1:]), starts)
+        box[size:size + leaves, 1] = np.minimum.reduceat(np.minimum(y[:-1], y[1:]), starts)
+        box[size:size + leaves, 2] = np.maximum.reduceat(np.maximum(x[:-1], x[1:]), starts)
+        box[size:size + leaves, 3] = np.maximum.reduceat(np.maximum(y[:-1], y[1:]), starts)
+        for k in range(size - 1, 0, -1):
+            l, r = box[2 * k], box[2 * k + 1]
+            box[k] = (min(l[0], r[0]), min(l[1], r[1]), max(l[2], r[2]), max(l[3], r[3]))
+        self.box = box.tolist()
+
+    @staticmethod
+    def _extend(x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        ux, uy = x[1] - x[0], y[1] - y[0]
+        k0 = EXTENSION_M / math.hypot(ux, uy)
+        vx, vy = x[-1] - x[-2], y[-1] - y[-2]
+        k1 = EXTENSION_M / math.hypot(vx, vy)
+        return (np.concatenate(([x[0] - ux * k0], x, [x[-1] + vx * k1])),
+                np.concatenate(([y[0] - uy * k0], y, [y[-1] + vy * k1])))
+
+    def nearest(self, x: float, y: float) -> Tuple[int, float, float]:
+        """(segmento, t en [0, 1], distancia^2) del punto de la polilinea mas cercano a (x, y)."""
+        box, size = self.box, self.size
+        ax, ay, sdx, sdy, sll = self.ax, self.ay, self.dx, self.dy, self.ll
+        best_k, best_t, best = 0, 0.0, math.inf
+        stack = [(0.0, 1)]
+        while stack:
+            lb, node = stack.pop()
+            if lb >= best:
+                continue
+            if node >= size:
+                k0 = (node - size) * LEAF_SEGMENTS
+                for k in range(k0, min(k0 + LEAF_SEGMENTS, self.n)):
+                    qx, qy = x - ax[k], y - ay[k]
+                    dx, dy = sdx[k], sdy[k]
+                    t = (qx * dx + qy * dy) / sll[k]
+                    t = 0.0 if t < 0.0 else (1.0 if t > 1.0 else t)
+                    ex, ey = qx - t * dx, qy - t * dy
+                    d2 = ex * ex + ey * ey
+                    if d2 < best:
+                        best_k, best_t, best = k, t, d2
+                continue
+            # cota por caja de cada hija; la mas cercana se visita primero (queda arriba de la pila)
+            kids = []
+            for child in (2 * node, 2 * node + 1):
+                x0, y0, x1, y1 = box[child]
+                ex = x0 - x if x < x0 else (x - x1 if x > x1 else 0.0)
+                ey = y0 - y if y < y0 else (y - y1 if y > y1 else 0.0)
+                d2 = ex * ex + ey * ey
+                if d2 < best:
+                    kids.append((d2, child))
+            if len(kids) == 2 and kids[0][0] < kids[1][0]:
+                kids.reverse()
+            stack += kids
+        return best_k, best_t, best
+
+
+class Guide:
+    """Guia activa de un campo: referencia indexada en su plano local."""
+
+    def __init__(self, nombre: str, coords: List[List[float]]):
+        lon = np.array([c[0] for c in coords], dtype=float)
+        lat = np.array([c[1] for c in coords], dtype=float)
+        self.nombre = nombre
+        self.plane = LocalPlane.around(lon, lat)
+        self.index = PolylineIndex(*self.plane.to_xy(lon, lat))
+
+    def track(self, lon: float, lat: float, ancho: Optional[float], heading: Optional[float]) -> dict:
+        """Error lateral, pasada y error de rumbo de un fix respecto de la guia."""
+        x, y = self.plane.xy(lon, lat)
+        idx = self.index
+        k, _, d2 = idx.nearest(x, y)
+        dx, dy = idx.dx[k], idx.dy[k]
+        cross = dx * (y - idx.ay[k]) - dy * (x - idx.ax[k])
+        xte = math.copysign(math.sqrt(d2), -cross)   # derecha del sentido A -> B positiva
+        out = {'nombre': self.nombre, 'xte': round(xte, 3), 'pasada': None, 'desvio': round(xte, 3),
+               'rumbo_error': None}
+        if ancho:
+            pasada = math.floor(xte / ancho + 0.5)
+            out['pasada'] = pasada
+            out['desvio'] = round(xte - pasada * ancho, 3)
+        if heading is not None:
+            err = (heading - math.degrees(math.atan2(dx, dy)) + 180.0) % 360.0 - 180.0
+            if abs(err) > 90.0:
+                err = (err + 360.0) % 360.0 - 180.0   # pasada de vuelta
+            out['rumbo_error'] = round(err, 1)
+        return out
+
+
+def parse_guides(fc: dict) -> List[Tuple[str, List[List[float]]]]:
+    """(nombre, coordenadas) de las guias validas de un FeatureCollection."""
+    out = []
+    for feat in fc.get('features') or []:
+        if not isinstance(feat, dict):
+            continue
+        geom = feat.get('geometry') or {}
+        props = feat.get('properties') if isinstance(feat.get('properties'), dict) else {}
+        nombre = props.get('nombre')
+        coords = geom.get('coordinates')
+        if geom.get('type') != 'LineString' or not isinstance(nombre, str) or not isinstance(coords, list):
+            continue
+        try:
+            coords = [[float(c[0]), float(c[1])] for c in coords]
+        except (TypeError, ValueError, IndexError):
+            continue
+        if len(coords) >= 2:
+            out.append((nombre, coords))
+    return out
+
+
+def _load_active(path: Path) -> Optional[Guide]:
+    try:
+        fc = json.loads(path.read_text(encoding='utf-8-sig'))
+    except (OSError, ValueError):
+        return None
+    if not isinstance(fc, dict):
+        return None
+    guides = parse_guides(fc)
+    if not guides:
+        return None
+    meta = fc.get('metadata') if isinstance(fc.get('metadata'), dict) else {}
+    activa = meta.get('activa')
+    nombre, coords = next((g for g in guides if g[0] == activa), guides[0])
+    try:
+        return Guide(nombre, coords)
+    except ValueError:
+        return None
+
+
+class GuideStore(CampoFileCache[Guide]):
+    """Guia activa por campo, recargada si cambia el mtime de guias.geojson."""
+
+    def __init__(self, root: Path):
+        super().__init__(root, 'guias.geojson', _load_active)
@@ -1,14 +1,27 @@
 from fastapi import FastAPI, WebSocket, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from starlette.staticfiles import StaticFiles
 from starlette.websockets import WebSocketDisconnect
 from datetime import datetime, timezone
 from pathlib import Path
-from pydantic import BaseModel
-from typing import Optional, Set
-import asyncio, os, json, re, shutil
+from pydantic import BaseModel, Field
+from typing import Iterable, Optional
+import asyncio, os, json, re, shutil, threading, time
+from collections import OrderedDict, deque
 from urllib.parse import quote
 
+from .filtro import MAX_SPEED, FilterBank, parse_ts
+from .cache_campos import CampoFileCache
+from .geocerca import BORDE, GeofenceStore, boundary_polygons
+from .guia import GuideStore, parse_guides
+from .metricas import BYTES_BUCKETS, REGISTRY, loop_lag_monitor
+from .perfil import RequestLog, RequestTimer, collapsed, sample_stacks
+from .plan import plan as plan_pasadas
+from .sesiones import (SessionKey, SessionStore, Subscriber, SubscriptionIndex, clean_name, parse_channels,
+                       session_key)
+from .ppk import PosImportError, ancho_en_datos, build_recorrido, maquinaria_ancho
+from .temporada import SeasonStore
+
 app = FastAPI()
 
 REPO_ROOT = Path(__file__).resolve().parents[2]
@@ -36,8 +49,124 @@ def api_version():
 
 
 # ---- In-memory state y endpoints de datos ----
-CLIENTS: Set[WebSocket] = set()
-LAST_POINT: Optional[dict] = None
+CLIENTS = SubscriptionIndex()   # clientes /ws indexados por canal
+# Filtro de ingesta por sesion: rechazo de saltos + Kalman (AGROPOST_FILTRO=0 lo desactiva)
+FILTER_ENABLED = os.environ.get("AGROPOST_FILTRO", "1") == "1"
+FILTERS = FilterBank(max_speed=float(os.environ.get("AGROPOST_VEL_MAX", MAX_SPEED)))
+SESSIONS = SessionStore(on_expire=FILTERS.forget)   # ultimo punto y buffer por (maquina, campo, recorrido)
+RAW_KEYS = ('lat_raw', 'lon_raw')
+
+
+def _margen_borde(campo_dir: Path) -> Optional[float]:
+    # Franja de borde = medio ancho de la maquinaria actual del campo
+    ancho = maquinaria_ancho(campo_dir, None)[1]
+    return ancho / 2.0 if ancho else None
+
+
+def _read_json(path: Path) -> Optional[dict]:
+    try:
+        data = json.loads(path.read_text(encoding='utf-8-sig'))
+    except (OSError, ValueError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+GEOFENCES = GeofenceStore(CAMPOS_ROOT, margin_for=_margen_borde)   # limite preparado por campo
+GUIDES = GuideStore(CAMPOS_ROOT)                                    # guia AB / curva activa por campo
+DATOS = CampoFileCache(CAMPOS_ROOT, 'datos.json', _read_json)
+TEMPORADA = SeasonStore()                                           # cobertura acumulada de los recorridos
+
+
+def _ancho_activo(campo: str, machine: Optional[str]) -> Optional[float]:
+    # La maquinaria con el nombre de la maquina que envia el fix, o la actual del campo
+    datos = DATOS.get(campo)
+    if datos is None:
+        return None
+    return (machine and ancho_en_datos(datos, machine)[1]) or ancho_en_datos(datos, None)[1]
+
+
+# ---- Metricas (ver /api/metrics) ----
+FIXES = REGISTRY.counter('agropost_fixes_total', 'Posiciones recibidas por /api/pos')
+FIXES_REJECTED = REGISTRY.counter('agropost_fixes_rechazados_total', 'Fixes descartados por el filtro de ingesta',
+                                  labelnames=('motivo',))
+_FIX_SAMPLES: deque = deque(maxlen=101)  # (t, fixes) cada 0.1 s: ventana de 10 s
+FIX_RATE = REGISTRY.gauge('agropost_fixes_per_second', 'Posiciones por segundo (ultimos 10 s)',
+                          fn=lambda: _fix_rate())
+WS_CLIENTS = REGISTRY.gauge('agropost_ws_clients', 'Clientes WebSocket conectados', fn=lambda: len(CLIENTS))
+SESSIONS_GAUGE = REGISTRY.gauge('agropost_sesiones', 'Sesiones de maquinas activas', fn=lambda: len(SESSIONS))
+BROADCAST_SECONDS = REGISTRY.histogram('agropost_broadcast_seconds', 'Envio de un mensaje a todos los clientes WS')
+WS_SEND_SECONDS = REGISTRY.histogram('agropost_ws_send_seconds', 'send_json a un cliente WS')
+WS_DROPPED = REGISTRY.counter('agropost_ws_dropped_total', 'Clientes WS descartados por error de envio')
+WS_DECIMATED = REGISTRY.counter('agropost_ws_decimated_total', 'Fixes retenidos por limites de tasa/distancia del cliente')
+SNAPSHOT_SECONDS = REGISTRY.histogram('agropost_snapshot_write_seconds', 'Serializacion y escritura de snapshots',
+                                      labelnames=('tipo',))
+SNAPSHOT_BYTES = REGISTRY.histogram('agropost_snapshot_bytes', 'Tamano de snapshots escritos', labelnames=('tipo',),
+                                    buckets=BYTES_BUCKETS)
+FS_LIST_SECONDS = REGISTRY.histogram('agropost_fs_list_seconds', 'Listado de recorridos en disco')
+LOOP_LAG = REGISTRY.histogram('agropost_event_loop_lag_seconds', 'Atraso del event loop')
+LOOP_LAG_LAST = REGISTRY.gauge('agropost_event_loop_lag_last_seconds', 'Ultimo atraso medido del event loop')
+HTTP_SECONDS = REGISTRY.histogram('agropost_http_seconds', 'Duracion de cada request HTTP por ruta',
+                                  labelnames=('metodo', 'ruta'))
+GEOFENCE_EVENTS = REGISTRY.counter('agropost_geocerca_eventos_total', 'Entradas y salidas de maquinas del campo',
+                                   labelnames=('evento',))
+
+# ---- Diagnostico: requests lentos, lag del loop y profiler ----
+SLOW_THRESHOLD = float(os.environ.get("AGROPOST_LENTO_MS", "100")) / 1000.0
+LAG_INTERVAL = 0.1   # resolucion del monitor de lag (seg.)
+PROFILER_ENABLED = os.environ.get("AGROPOST_PROFILER", "0") == "1"
+REQUESTS = RequestLog()
+PROFILE_LOCK = asyncio.Lock()
+
+app.add_middleware(RequestTimer, log=REQUESTS, histogram=HTTP_SECONDS, threshold=SLOW_THRESHOLD)
+
+
+def _fix_rate() -> float:
+    if len(_FIX_SAMPLES) < 2:
+        return 0.0
+    (t0, n0), (t1, n1) = _FIX_SAMPLES[0], _FIX_SAMPLES[-1]
+    return round((n1 - n0) / (t1 - t0), 2) if t1 > t0 else 0.0
+
+
+def _report_lag(lag: float):
+    # Requests activos durante el ultimo intervalo: candidatos a haber bloqueado el loop
+    since = time.perf_counter() - LAG_INTERVAL - lag
+    culpables = ', '.join(f"{m} {p} ({1000 * dt:.0f} ms)" for m, p, dt in REQUESTS.culprits(since)[:3])
+    print(f"[LAG] event loop bloqueado {1000 * lag:.0f} ms; requests: {culpables or 'ninguno (tarea de fondo o WS)'}")
+
+
+@app.on_event("startup")
+async def _start_monitors():
+    def sample(now: float):
+        _FIX_SAMPLES.append((now, FIXES.value))
+    app.state.lag_task = asyncio.create_task(loop_lag_monitor(
+        LOOP_LAG, LOOP_LAG_LAST, interval=LAG_INTERVAL, on_tick=sample,
+        threshold=SLOW_THRESHOLD, on_lag=_report_lag))
+
+
+@app.get("/api/metrics", include_in_schema=False)
+def api_metrics(formato: str = 'prometheus'):
+    if formato == 'json':
+        return REGISTRY.snapshot()
+    return PlainTextResponse(REGISTRY.render_text(), media_type='text/plain; version=0.0.4')
+
+
+@app.get("/api/debug/profile", include_in_schema=False)
+async def debug_profile(seconds: float = 10.0, hz: int = 100, hilos: str = 'loop'):
+    """Muestrea pilas durante `seconds` y devuelve el formato colapsado de flamegraph.pl.
+
+    `hilos=loop` muestrea solo el hilo del event loop; `hilos=todos` incluye el threadpool.
+    """
+    if not PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail='profiler desactivado (AGROPOST_PROFILER=1)')
+    if not 0 < seconds <= 60 or not 1 <= hz <= 1000 or hilos not in ('loop', 'todos'):
+        raise HTTPException(status_code=400, detail='parametros invalidos')
+    if PROFILE_LOCK.locked():
+        raise HTTPException(status_code=409, detail='ya hay un perfil en curso')
+    async with PROFILE_LOCK:
+        only = threading.get_ident() if hilos == 'loop' else None
+        # El muestreo corre en otro hilo: el loop sigue atendiendo mientras tanto
+        counts = await asyncio.to_thread(sample_stacks, seconds, hz, only)
+    return PlainTextResponse(collapsed(counts))
 
 
 class Position(BaseModel):
@@ -47,57 +176,166 @@ class Position(BaseModel):
     fix_quality: Optional[int] = None
     pdop: Optional[float] = None
     sats: Optional[int] = None
-
-
-async def _broadcast_json(data: dict) -> int:
-    delivered = 0
-    dead: Set[WebSocket] = set()
-    for ws in list(CLIENTS):
+    alt: Optional[float] = None       # altura sobre el nivel del mar (m)
+    h_acc: Optional[float] = None     # precision horizontal estimada por el receptor (m)
+    v_acc: Optional[float] = None     # precision vertical (m)
+    speed: Optional[float] = None     # velocidad sobre el suelo (m/s)
+    heading: Optional[float] = None   # rumbo de movimiento (grados desde el norte)
+    machine: Optional[str] = Field(None, max_length=64)     # identifica la sesion junto con campo y recorrido
+    campo: Optional[str] = Field(None, max_length=64)
+    recorrido: Optional[str] = Field(None, max_length=64)
+
+
+async def _send(sub: Subscriber, data: dict) -> bool:
+    """Envia a un cliente; si falla lo cierra y lo saca del indice."""
+    t0 = time.perf_counter()
+    try:
+        await sub.ws.send_json(data)
+    except Exception:
+        WS_DROPPED.inc()
+        CLIENTS.remove(sub)
         try:
-            await ws.send_json(data)
-            delivered += 1
+            await sub.ws.close(code=1011)
         except Exception:
-            dead.add(ws)
-            try:
-                await ws.close(code=1011)
-            except Exception:
-                pass
-    for ws in dead:
-        try:
-            CLIENTS.remove(ws)
-        except KeyError:
             pass
+        return False
+    WS_SEND_SECONDS.observe(time.perf_counter() - t0)
+    return True
+
+
+async def _broadcast_json(data: dict, targets: Optional[Iterable[Subscriber]] = None) -> int:
+    """Envia `data` a `targets` (por defecto a todos los clientes) y descarta los que fallan."""
+    delivered = 0
+    t_start = time.perf_counter()
+    for sub in list(CLIENTS.all if targets is None else targets):
+        delivered += await _send(sub, data)
+    BROADCAST_SECONDS.observe(time.perf_counter() - t_start)
+    return delivered
+
+
+def _public(msg: dict) -> dict:
+    """El fix sin la posicion cruda (`lat_raw`/`lon_raw`), para clientes sin `raw=1`."""
+    if 'lat_raw' not in msg:
+        return msg
+    return {k: v for k, v in msg.items() if k not in RAW_KEYS}
+
+
+async def _fanout_fix(msg: dict) -> int:
+    """Envia un fix a los suscriptores de su canal respetando los limites de cada uno."""
+    delivered = 0
+    t_start = time.perf_counter()
+    now = time.monotonic()
+    public = None
+    for sub in list(CLIENTS.targets(msg)):
+        out = msg
+        if not sub.raw and 'lat_raw' in msg:
+            if public is None:
+                public = _public(msg)
+            out = public
+        if sub.limited:
+            out = sub.offer(out, now)
+            if out is None:
+                WS_DECIMATED.inc()
+                _schedule_flush(sub, session_key(msg), now)
+                continue
+        delivered += await _send(sub, out)
+    BROADCAST_SECONDS.observe(time.perf_counter() - t_start)
     return delivered
 
 
+def _schedule_flush(sub: Subscriber, key: SessionKey, now: float) -> None:
+    delay = sub.flush_delay(key, now)
+    if delay is not None:
+        asyncio.get_running_loop().call_later(delay, lambda: asyncio.ensure_future(_flush(sub, key)))
+
+
+async def _flush(sub: Subscriber, key: SessionKey) -> None:
+    # Al vencer la ventana del cliente se manda el ultimo fix retenido
+    if sub not in CLIENTS.all:
+        return
+    out = sub.flush(key, time.monotonic())
+    if out is not None:
+        await _send(sub, out)
+
+
+def _limits(max_hz, min_dist, coalesce) -> dict:
+    try:
+        max_hz = float(max_hz) if max_hz is not None else None
+        min_dist = float(min_dist) if min_dist is not None else None
+    except (TypeError, ValueError):
+        raise ValueError('max_hz/min_dist invalidos')
+    if max_hz is not None and not 0 < max_hz <= 100:
+        raise ValueError('max_hz fuera de rango (0, 100]')
+    if min_dist is not None and not 0 <= min_dist <= 1000:
+        raise ValueError('min_dist fuera de rango [0, 1000]')
+    return {'max_hz': max_hz, 'min_dist': min_dist, 'coalesce': bool(coalesce)}
+
+
+async def _send_initial_state(sub: Subscriber) -> None:
+    # Ultimo punto de cada sesion a la que esta suscripto
+    for session in SESSIONS.find():
+        if session.last is not None and sub.wants(session.last):
+            await sub.ws.send_json(session.last if sub.raw else _public(session.last))
+    # y el ultimo estado del enlace de cada estacion
+    for reporte in list(ESTACIONES.values()):
+        await sub.ws.send_json({'type': 'estacion', **reporte})
+
+
 @app.websocket("/ws")
-async def ws_endpoint(ws: WebSocket):
+async def ws_endpoint(ws: WebSocket, machine: Optional[str] = None, campo: Optional[str] = None,
+                      max_hz: Optional[float] = None, min_dist: Optional[float] = None, coalesce: bool = False,
+                      raw: bool = False):
+    """Clientes de la UI. `?machine=a,b&campo=c` limita los fixes a esos canales (sin filtros: todos).
+
+    Las posiciones llegan filtradas; con `raw=1` se agregan `lat_raw`/`lon_raw` tal como se recibieron.
+
+    `max_hz` y `min_dist` (m) decimen el envio a este cliente; con `coalesce` los fixes
+    omitidos viajan en `intermedios` del siguiente. El cliente puede cambiar la
+    suscripcion enviando `{"machine": "...", "campo": "...", "max_hz": 1, "min_dist": 5}`.
+    """
+    try:
+        limits = _limits(max_hz, min_dist, coalesce)
+    except ValueError as e:
+        await ws.close(code=1008, reason=str(e))
+        return
     await ws.accept()
-    CLIENTS.add(ws)
-    # Enviar último punto si existe
-    if LAST_POINT is not None:
-        try:
-            await ws.send_json(LAST_POINT)
-        except Exception:
-            pass
+    sub = Subscriber(ws, parse_channels(machine, campo), raw=raw, **limits)
+    CLIENTS.add(sub)
     try:
+        await _send_initial_state(sub)
         while True:
-            await asyncio.sleep(3600)
+            # Leer mantiene detectada la desconexion (y el cierre ordenado del servidor)
+            text = await ws.receive_text()
+            try:
+                req = json.loads(text)
+            except ValueError:
+                continue
+            if not isinstance(req, dict):
+                continue
+            if 'max_hz' in req or 'min_dist' in req or 'coalesce' in req:
+                try:
+                    sub.set_limits(**_limits(req.get('max_hz'), req.get('min_dist'), req.get('coalesce')))
+                except ValueError as e:
+                    await ws.send_json({'type': 'error', 'detail': str(e)})
+                    continue
+            if 'machine' in req or 'campo' in req:
+                CLIENTS.update(sub, parse_channels(req.get('machine'), req.get('campo')))
+                await _send_initial_state(sub)
+            await ws.send_json({'type': 'suscripcion', 'canales': sorted(sub.channels),
+                                'max_hz': 1.0 / sub.min_interval if sub.min_interval else None,
+                                'min_dist': sub.min_dist or None, 'coalesce': sub.coalesce})
     except WebSocketDisconnect:
         pass
     except Exception as e:
         print("[/ws ERROR]", repr(e))
     finally:
-        try:
-            CLIENTS.remove(ws)
-        except KeyError:
-            pass
+        CLIENTS.remove(sub)
 
 
 @app.post("/api/pos")
 async def post_position(p: Position):
-    """Recibe posición por POST y la retransmite por WS a los clientes conectados."""
-    global LAST_POINT
+    """Recibe posición por POST y la retransmite por WS a los suscriptores de su maquina/campo."""
+    FIXES.inc()
     msg = {
         "ts": p.ts or (datetime.utcnow().isoformat() + "Z"),
         "lat": p.lat,
@@ -105,17 +343,134 @@ async def post_position(p: Position):
         "fix_quality": p.fix_quality,
         "pdop": p.pdop,
         "sats": p.sats,
+        "alt": p.alt,
+        "h_acc": p.h_acc,
+        "v_acc": p.v_acc,
+        "speed": p.speed,
+        "heading": p.heading,
+        "machine": clean_name(p.machine),
+        "campo": clean_name(p.campo),
+        "recorrido": clean_name(p.recorrido),
     }
-    LAST_POINT = msg
-    delivered = await _broadcast_json(msg)
+    if FILTER_ENABLED:
+        t = parse_ts(p.ts) or time.time()
+        motivo = FILTERS.process(session_key(msg), msg, t)
+        if motivo is not None:
+            FIXES_REJECTED.labels(motivo=motivo).inc()
+            return {"ok": True, "delivered": 0, "rechazado": motivo}
+    evento = None
+    if msg["campo"]:
+        tag = GEOFENCES.classify(msg["campo"], msg["lon"], msg["lat"])
+        if tag is not None:
+            msg["geocerca"], msg["en_campo"] = tag
+        guide = GUIDES.get(msg["campo"])
+        if guide is not None:
+            msg["guia"] = guide.track(msg["lon"], msg["lat"], _ancho_activo(msg["campo"], msg["machine"]),
+                                      msg.get("heading"))
+    session = SESSIONS.push(msg)
+    # La franja de borde hace de histeresis: el estado solo cambia al salir de ella
+    estado = msg.get("geocerca")
+    if estado is not None and estado != BORDE and estado != session.geocerca:
+        if session.geocerca is not None:
+            evento = 'entrada' if msg["en_campo"] else 'salida'
+        session.geocerca = estado
+    delivered = await _fanout_fix(msg)
+    if evento is not None:
+        GEOFENCE_EVENTS.labels(evento=evento).inc()
+        ev = {'type': 'geocerca', 'evento': evento, 'ts': msg['ts'], 'lat': msg['lat'], 'lon': msg['lon'],
+              'machine': msg['machine'], 'campo': msg['campo'], 'recorrido': msg['recorrido']}
+        await _broadcast_json(ev, CLIENTS.targets(ev))
     return {"ok": True, "delivered": delivered}
 
 
 @app.get("/api/last")
-async def get_last():
-    if LAST_POINT is None:
+async def get_last(machine: Optional[str] = None, campo: Optional[str] = None, raw: bool = False):
+    """Ultimo punto recibido (de la sesion mas reciente que coincida con los filtros).
+
+    Como en /ws, `lat_raw`/`lon_raw` solo se incluyen con `raw=1`.
+    """
+    found = SESSIONS.find(clean_name(machine), clean_name(campo))
+    if not found:
         return JSONResponse({"ok": False, "error": "no data"}, status_code=404)
-    return LAST_POINT
+    return found[0].last if raw else _public(found[0].last)
+
+
+@app.get("/api/sesiones")
+async def listar_sesiones():
+    return {"ok": True, "sesiones": SESSIONS.info()}
+
+
+@app.get("/api/sesiones/puntos")
+async def puntos_sesion(machine: Optional[str] = None, campo: Optional[str] = None,
+                        recorrido: Optional[str] = None, limite: int = 600):
+    """Buffer de fixes recientes de la sesion mas reciente que coincida (para redibujar la cola)."""
+    found = SESSIONS.find(clean_name(machine), clean_name(campo), clean_name(recorrido))
+    if not found:
+        raise HTTPException(status_code=404, detail='sesion no encontrada')
+    pts = list(found[0].buffer)
+    return {"ok": True, "machine": found[0].machine, "campo": found[0].campo,
+            "recorrido": found[0].recorrido, "puntos": pts[-limite:] if limite > 0 else []}
+
+
+# ---- Telemetria de estaciones (base / rover, ver receptores/telemetria.py) ----
+ESTACIONES: dict = {}
+ESTACION_RE = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+ESTACION_METRICA = REGISTRY.gauge('agropost_estacion', 'Metricas de enlace publicadas por base y rover',
+                                  labelnames=('estacion', 'metrica'))
+
+
+# Claves que emite LinkTelemetry.snapshot (aplanadas) mas las que la base fija
+# con telemetry.set(); cualquier otra clave del payload no crea series nuevas.
+_PCT = ('p10', 'p50', 'p90')
+ESTACION_METRICAS = frozenset(
+    ['ts', 'ventana_s', 'paquetes_s', 'bytes_s', 'perdida', 'fix_ratio', 'float_ratio',
+     'edad_correccion_s_p50', 'edad_correccion_s_max',
+     'totales_paquetes', 'totales_bytes', 'totales_perdidos',
+     'airtime_pct', 'capacidad_bps', 'rtcm_decimados', 'rtcm_vencidos', 'log_descartados']
+    + [f'{serie}_{p}' for serie in ('rssi', 'snr') for p in _PCT]
+    + [f'duraciones_s_{paso}_{p}' for paso in ('convbin_rover', 'convbin_base', 'rnx2rtkp')
+       for p in _PCT])
+
+
+def _numeric_items(data: dict, prefix: str = ''):
+    """Aplana los valores numericos del reporte (rssi.p50 -> rssi_p50).
+
+    Solo devuelve las metricas de ESTACION_METRICAS: el payload viene del cliente y
+    cada clave nueva seria una serie mas en el registro.
+    """
+    for key, value in data.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            yield from _numeric_items(value, name + '_')
+        elif (isinstance(value, (int, float)) and not isinstance(value, bool)
+              and name in ESTACION_METRICAS):
+            yield name, value
+
+
+@app.post('/api/metrics/estaciones')
+async def post_estacion_metrics(request: Request):
+    """Recibe el reporte periodico de una estacion y lo retransmite por WS (type=estacion)."""
+    try:
+        payload = await request.json()
+    except Exception:
+        raise HTTPException(status_code=400, detail='payload invalido')
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail='payload invalido')
+    estacion = payload.get('estacion')
+    if not isinstance(estacion, str) or not ESTACION_RE.match(estacion):
+        raise HTTPException(status_code=400, detail='estacion invalida')
+
+    payload['recibido'] = datetime.utcnow().isoformat() + 'Z'
+    ESTACIONES[estacion] = payload
+    for name, value in _numeric_items(payload):
+        ESTACION_METRICA.labels(estacion=estacion, metrica=name).set(value)
+    delivered = await _broadcast_json({'type': 'estacion', **payload})
+    return {'ok': True, 'delivered': delivered}
+
+
+@app.get('/api/metrics/estaciones')
+def get_estacion_metrics():
+    return {'ok': True, 'estaciones': ESTACIONES}
 
 
 # ---- Recorridos guardados por campo ----
@@ -201,6 +556,21 @@ def _recorrido_url(campo_id: str, filename: str) -> str:
     return '/' + '/'.join(parts)
 
 
+def _write_snapshot(path: Path, fc: dict, tipo: str, indent: Optional[int] = 2) -> None:
+    """Escribe un GeoJSON registrando duracion y tamano en las metricas.
+
+    Se escribe a un temporal y se renombra: un lector nunca ve el archivo a medias
+    y el mtime de la carpeta cambia (la temporada lo usa para notar reescrituras).
+    """
+    t0 = time.perf_counter()
+    data = json.dumps(fc, ensure_ascii=False, indent=indent).encode('utf-8')
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_bytes(data)
+    tmp.replace(path)
+    SNAPSHOT_SECONDS.labels(tipo=tipo).observe(time.perf_counter() - t0)
+    SNAPSHOT_BYTES.labels(tipo=tipo).observe(len(data))
+
+
 def _serialize_recorrido(campo_id: str, path: Path) -> dict:
     stat = path.stat()
     return {
@@ -215,11 +585,13 @@ def _serialize_recorrido(campo_id: str, path: Path) -> dict:
 async def listar_recorridos(campo_id: str):
     campo_dir = _resolve_campo_dir(campo_id)
     rec_dir = _ensure_recorridos_dir(campo_dir)
+    t0 = time.perf_counter()
     recorridos = [
         _serialize_recorrido(campo_id, f)
         for f in sorted(rec_dir.glob('*.geojson'), key=lambda p: p.name.lower())
         if f.is_file()
     ]
+    FS_LIST_SECONDS.observe(time.perf_counter() - t0)
     return {'ok': True, 'recorridos': recorridos}
 
 
@@ -298,8 +670,47 @@ async def guardar_recorrido_snapshot(campo_id: str, filename: str, request: Requ
 
 
     filepath.parent.mkdir(parents=True, exist_ok=True)
-    filepath.write_text(json.dumps(fc, ensure_ascii=False, indent=2), encoding='utf-8')
-    return {'ok': True}
+    _write_snapshot(filepath, fc, 'recorrido')
+    return {'ok': True, 'temporada': await _actualizar_temporada(campo_dir, safe_name)}
+
+
+@app.delete('/api/campos/{campo_id}/recorridos/{filename}')
+async def borrar_recorrido(campo_id: str, filename: str):
+    campo_dir = _resolve_campo_dir(campo_id)
+    rec_dir = _ensure_recorridos_dir(campo_dir)
+    safe_name = _normalize_rec_filename(filename)
+    filepath = (rec_dir / safe_name).resolve()
+    try:
+        filepath.relative_to(rec_dir)
+    except ValueError:
+        raise HTTPException(status_code=400, detail='nombre invalido')
+    if not filepath.is_file():
+        raise HTTPException(status_code=404, detail='recorrido no encontrado')
+    filepath.unlink()
+    return {'ok': True, 'temporada': await _actualizar_temporada(campo_dir, safe_name)}
+
+
+async def _actualizar_temporada(campo_dir: Path, filename: str) -> Optional[dict]:
+    # El recorrido ya quedo guardado/borrado: un error al acumular no debe romper la respuesta
+    try:
+        return await asyncio.to_thread(TEMPORADA.update, campo_dir, filename)
+    except (OSError, ValueError) as e:
+        print(f"[TEMPORADA] {campo_dir.name}/{filename}: {e}")
+        return None
+
+
+@app.get('/api/campos/{campo_id}/temporada')
+async def temporada_campo(campo_id: str, formato: str = 'resumen'):
+    """Cobertura acumulada de todos los recorridos: ha trabajadas, con solape y restantes.
+
+    `formato=geojson` devuelve ademas el poligono de la union (role 'coverage').
+    """
+    campo_dir = _resolve_campo_dir(campo_id)
+    if formato == 'geojson':
+        return await asyncio.to_thread(TEMPORADA.geojson, campo_dir)
+    if formato != 'resumen':
+        raise HTTPException(status_code=400, detail='formato debe ser resumen o geojson')
+    return {'ok': True, **await asyncio.to_thread(TEMPORADA.summary, campo_dir)}
 
 
 @app.put('/api/campos/{campo_id}/area')
@@ -366,9 +777,96 @@ async def guardar_area_snapshot(campo_id: str, request: Request):
         meta_out['rawLine'] = raw_line
 
     area_path.parent.mkdir(parents=True, exist_ok=True)
-    area_path.write_text(json.dumps(fc, ensure_ascii=False, indent=2), encoding='utf-8')
+    _write_snapshot(area_path, fc, 'area')
+    GEOFENCES.invalidate(campo_id)
     return {'ok': True}
 
+
+@app.get('/api/campos/{campo_id}/guias')
+def listar_guias(campo_id: str):
+    """Lineas AB / curvas de guiado del campo y cual esta activa."""
+    path = _resolve_campo_dir(campo_id) / 'guias.geojson'
+    fc = _read_json(path) if path.exists() else None
+    return fc or {'type': 'FeatureCollection', 'features': [], 'metadata': {'activa': None}}
+
+
+@app.put('/api/campos/{campo_id}/guias')
+async def guardar_guias(campo_id: str, request: Request):
+    """Reemplaza las guias del campo (LineString con properties.nombre; metadata.activa)."""
+    campo_dir = _resolve_campo_dir(campo_id)
+    try:
+        payload = await request.json()
+    except Exception:
+        raise HTTPException(status_code=400, detail='payload invalido')
+    if not isinstance(payload, dict) or not isinstance(payload.get('features'), list):
+        raise HTTPException(status_code=400, detail='se espera un FeatureCollection')
+
+    guias = parse_guides(payload)
+    if len(guias) != len(payload['features']):
+        raise HTTPException(status_code=400, detail='cada guia debe ser un LineString con nombre y 2+ puntos')
+    nombres = [n for n, _ in guias]
+    if len(set(nombres)) != len(nombres):
+        raise HTTPException(status_code=400, detail='nombres de guia repetidos')
+    meta = payload.get('metadata') if isinstance(payload.get('metadata'), dict) else {}
+    activa = meta.get('activa') or (nombres[0] if nombres else None)
+    if activa is not None and activa not in nombres:
+        raise HTTPException(status_code=400, detail='guia activa inexistente')
+
+    fc = {
+        'type': 'FeatureCollection',
+        'features': [{'type': 'Feature', 'properties': {'nombre': n},
+                      'geometry': {'type': 'LineString', 'coordinates': c}} for n, c in guias],
+        'metadata': {'activa': activa, 'updatedAt': datetime.now(timezone.utc).isoformat()},
+    }
+    _write_snapshot(campo_dir / 'guias.geojson', fc, 'guias')
+    GUIDES.invalidate(campo_id)
+    return {'ok': True, 'activa': activa, 'guias': len(guias)}
+
+
+PLANS: OrderedDict = OrderedDict()   # (campo, version del area, ancho, angulo, cabecera) -> plan
+PLAN_CACHE_SIZE = 32
+
+
+@app.get('/api/campos/{campo_id}/plan')
+async def planificar_campo(campo_id: str, machine: Optional[str] = None, angle: Optional[float] = None,
+                           cabecera: Optional[float] = None):
+    """Pasadas paralelas recortadas al limite del campo con giros en cabecera.
+
+    Sin `angle` se elige el rumbo con menos pasadas. La ruta es un LineString que
+    se puede reproducir con `sender.py geojson <url>`.
+    """
+    campo_dir = _resolve_campo_dir(campo_id)
+    area_path = campo_dir / 'area.geojson'
+    try:
+        version = area_path.stat().st_mtime_ns
+    except OSError:
+        raise HTTPException(status_code=404, detail='el campo no tiene area')
+    datos = _read_json(campo_dir / 'datos.json') or {}
+    maq, ancho = ancho_en_datos(datos, clean_name(machine))
+    if not ancho:
+        raise HTTPException(status_code=400, detail=f'maquinaria sin ancho: {maq or "ninguna"}')
+    if angle is not None and not 0 <= angle < 360:
+        raise HTTPException(status_code=400, detail='angle fuera de rango [0, 360)')
+    cabecera = ancho if cabecera is None else cabecera
+    if not 0 <= cabecera <= 100:
+        raise HTTPException(status_code=400, detail='cabecera fuera de rango [0, 100]')
+
+    key = (campo_id, version, ancho, None if angle is None else angle % 180.0, cabecera)
+    fc = PLANS.get(key)
+    if fc is None:
+        polys = boundary_polygons(_read_json(area_path) or {})
+        if not polys:
+            raise HTTPException(status_code=404, detail='el area no tiene poligono de limite')
+        fc = await asyncio.to_thread(plan_pasadas, polys, ancho, angle, cabecera)
+        fc['metadata']['maquinaria'] = maq
+        PLANS[key] = fc
+        while len(PLANS) > PLAN_CACHE_SIZE:
+            PLANS.popitem(last=False)
+    else:
+        PLANS.move_to_end(key)
+    return fc
+
+
 @app.post('/api/campos/{campo_id}/recorridos')
 async def crear_recorrido(campo_id: str, data: RecorridoCreate):
     campo_dir = _resolve_campo_dir(campo_id)
@@ -388,6 +886,41 @@ async def crear_recorrido(campo_id: str, data: RecorridoCreate):
     info['nombre'] = data.nombre.strip()
     return {'ok': True, 'recorrido': info}
 
+@app.post('/api/campos/{campo_id}/recorridos/importar-pos')
+async def importar_recorrido_pos(campo_id: str, request: Request, nombre: str, max_q: int = 2,
+                                 paso: float = 1.0, maquinaria: Optional[str] = None, sobrescribir: bool = False):
+    """Importa un .pos de RTKLIB (body crudo) como recorrido con linea y cobertura.
+
+    Si ya hay un recorrido con ese nombre responde 409, salvo con `sobrescribir=1`.
+    """
+    campo_dir = _resolve_campo_dir(campo_id)
+    rec_dir = _ensure_recorridos_dir(campo_dir)
+    filename = f"{_slugify_filename(nombre)}.geojson"
+    filepath = (rec_dir / filename).resolve()
+    try:
+        filepath.relative_to(rec_dir)
+    except ValueError:
+        raise HTTPException(status_code=400, detail='nombre invalido')
+    if filepath.exists() and not sobrescribir:
+        raise HTTPException(status_code=409, detail='el recorrido ya existe')
+    if max_q not in (1, 2):
+        raise HTTPException(status_code=400, detail='max_q debe ser 1 (Fix) o 2 (Fix+Float)')
+
+    data = await request.body()
+    if not data:
+        raise HTTPException(status_code=400, detail='sin datos para importar')
+    maq, ancho = maquinaria_ancho(campo_dir, maquinaria)
+    try:
+        fc = await asyncio.to_thread(build_recorrido, data, ancho, max_q, paso, maq)
+    except PosImportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    _write_snapshot(filepath, fc, 'ppk', indent=None)
+    info = _serialize_recorrido(campo_id, filepath)
+    info['nombre'] = nombre.strip()
+    return {'ok': True, 'recorrido': info, 'ppk': fc['metadata']['ppk'], 'areaHa': fc['metadata']['areaHa'],
+            'temporada': await _actualizar_temporada(campo_dir, filename)}
+
 class CampoCreate(BaseModel):
     nombre: str
 
@@ -430,6 +963,10 @@ async def crear_campo(data: CampoCreate):
 async def borrar_campo(campo_id: str):
     campo_dir = _resolve_campo_dir(campo_id)
     shutil.rmtree(campo_dir)
+    GEOFENCES.invalidate(campo_id)
+    GUIDES.invalidate(campo_id)
+    DATOS.invalidate(campo_id)
+    TEMPORADA.invalidate(campo_id)
 
     campos = [c for c in _load_campos_index() if c != campo_id]
     _save_campos_index(campos)
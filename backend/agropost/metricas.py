@@ -0,0 +1,216 @@
+"""Metricas en memoria con formato de exposicion de Prometheus.
+
+Contadores, gauges e histogramas de buckets fijos pensados para el camino
+caliente: se actualizan desde el event loop (un solo hilo), sin locks, con
+una suma y un bisect por observacion. `/api/metrics` los publica en texto
+para Prometheus o en JSON para la UI.
+"""
+import asyncio
+import math
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Buckets en segundos: de 100 us a 5 s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+BYTES_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _fmt(v: float) -> str:
+    if v == math.inf:
+        return '+Inf'
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+def _labels_text(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, registry: Optional['Registry'], name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._children: Dict[LabelKey, '_Metric'] = {}
+        if registry is not None:   # las series con labels no se registran
+            registry.register(self)
+
+    def labels(self, **labels):
+        key = tuple((k, str(labels[k])) for k in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            child = self._new_child()
+            self._children[key] = child
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _series(self):
+        if self.labelnames:
+            return list(self._children.items())
+        return [((), self)]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, registry, name, help, labelnames=()):
+        self.value = 0.0
+        super().__init__(registry, name, help, labelnames)
+
+    def _new_child(self):
+        return Counter(None, self.name, self.help)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def render(self) -> List[str]:
+        return [f'{self.name}{_labels_text(k)} {_fmt(m.value)}' for k, m in self._series()]
+
+    def snapshot(self):
+        if self.labelnames:
+            return {','.join(v for _, v in k): m.value for k, m in self._series()}
+        return self.value
+
+
+class Gauge(_Metric):
+    """Valor instantaneo; con `fn` se calcula al exportar (p.ej. clientes conectados)."""
+    kind = 'gauge'
+
+    def __init__(self, registry, name, help, labelnames=(), fn: Optional[Callable[[], float]] = None):
+        self.value = 0.0
+        self.fn = fn
+        super().__init__(registry, name, help, labelnames)
+
+    def _new_child(self):
+        return Gauge(None, self.name, self.help)
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def get(self) -> float:
+        return self.fn() if self.fn else self.value
+
+    def render(self) -> List[str]:
+        return [f'{self.name}{_labels_text(k)} {_fmt(m.get())}' for k, m in self._series()]
+
+    def snapshot(self):
+        if self.labelnames:
+            return {','.join(v for _, v in k): m.get() for k, m in self._series()}
+        return self.get()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        super().__init__(registry, name, help, labelnames)
+
+    def _new_child(self):
+        return Histogram(None, self.name, self.help, buckets=self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Cuantil aproximado (limite superior del bucket que lo contiene)."""
+        if not self.count:
+            return None
+        target = q * self.count
+        acc = 0
+        for edge, n in zip(self.buckets + (math.inf,), self.counts):
+            acc += n
+            if acc >= target:
+                return edge if edge != math.inf else self.buckets[-1]
+        return self.buckets[-1]
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, m in self._series():
+            acc = 0
+            for edge, n in zip(m.buckets + (math.inf,), m.counts):
+                acc += n
+                lines.append(f'{self.name}_bucket{_labels_text(key, ("le", _fmt(edge)))} {acc}')
+            lines.append(f'{self.name}_sum{_labels_text(key)} {_fmt(m.sum)}')
+            lines.append(f'{self.name}_count{_labels_text(key)} {m.count}')
+        return lines
+
+    def _summary(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+        }
+
+    def snapshot(self):
+        if self.labelnames:
+            return {','.join(v for _, v in k): m._summary() for k, m in self._series()}
+        return self._summary()
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> None:
+        self.metrics.append(metric)
+
+    def counter(self, name: str, help: str, labelnames=()) -> Counter:
+        return Counter(self, name, help, tuple(labelnames))
+
+    def gauge(self, name: str, help: str, labelnames=(), fn=None) -> Gauge:
+        return Gauge(self, name, help, tuple(labelnames), fn=fn)
+
+    def histogram(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return Histogram(self, name, help, tuple(labelnames), buckets=buckets)
+
+    def render_text(self) -> str:
+        out = []
+        for m in self.metrics:
+            out.append(f'# HELP {m.name} {m.help}')
+            out.append(f'# TYPE {m.name} {m.kind}')
+            out.extend(m.render())
+        return '\n'.join(out) + '\n'
+
+    def snapshot(self) -> dict:
+        return {m.name: m.snapshot() for m in self.metrics}
+
+
+REGISTRY = Registry()
+
+
+async def loop_lag_monitor(hist: Histogram, gauge: Gauge, interval: float = 0.5,
+                           on_tick: Optional[Callable[[float], None]] = None,
+                           threshold: Optional[float] = None, on_lag: Optional[Callable[[float], None]] = None):
+    """Mide cuanto se atrasa un sleep de `interval`: es el tiempo que el loop estuvo bloqueado.
+
+    Si el atraso supera `threshold` se llama a `on_lag(atraso)`.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        t0 = loop.time()
+        await asyncio.sleep(interval)
+        now = loop.time()
+        lag = max(0.0, now - t0 - interval)
+        hist.observe(lag)
+        gauge.set(lag)
+        if on_tick is not None:
+            on_tick(now)
+        if on_lag is not None and threshold is not None and lag > threshold:
+            on_lag(lag)
@@ -0,0 +1,92 @@
+"""Diagnostico de rendimiento: tiempos por request y profiler por muestreo.
+
+`RequestTimer` es un middleware ASGI (sin BaseHTTPMiddleware, que agrega una
+tarea por request en el camino de /api/pos) que mide cada handler por ruta y
+deja registro de los requests en curso y recientes, para que el monitor de
+lag pueda decir quien bloqueo el event loop. `sample_stacks` muestrea las
+pilas de los hilos y `collapsed` las devuelve en el formato de flamegraph.pl
+/ speedscope (`marco;marco;marco cuenta`).
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Optional
+
+
+class RequestLog:
+    """Requests en curso y terminados hace poco (metodo, ruta, inicio, fin)."""
+
+    def __init__(self, maxlen: int = 64):
+        self.inflight = {}
+        self.recent = deque(maxlen=maxlen)
+
+    def culprits(self, since: float):
+        """Requests que estuvieron activos desde `since` (reloj perf_counter), el mas largo primero."""
+        now = time.perf_counter()
+        found = [(m, p, now - t0) for m, p, t0 in self.inflight.values()]
+        found += [(m, p, t1 - t0) for m, p, t0, t1 in self.recent if t1 >= since]
+        return sorted(found, key=lambda r: -r[2])
+
+
+class RequestTimer:
+    def __init__(self, app, log: RequestLog, histogram, threshold: float):
+        self.app = app
+        self.log = log
+        self.histogram = histogram
+        self.threshold = threshold
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        key = id(scope)
+        method, path = scope['method'], scope['path']
+        t0 = time.perf_counter()
+        self.log.inflight[key] = (method, path, t0)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            t1 = time.perf_counter()
+            self.log.inflight.pop(key, None)
+            self.log.recent.append((method, path, t0, t1))
+            # Plantilla de la ruta (no el path concreto) para acotar las series
+            route = getattr(scope.get('route'), 'path', None) or 'otra'
+            self.histogram.labels(metodo=method, ruta=route).observe(t1 - t0)
+            if t1 - t0 > self.threshold:
+                print(f"[LENTO] {method} {path} {1000 * (t1 - t0):.1f} ms")
+
+
+def _frame_name(code) -> str:
+    # flamegraph.pl separa la cuenta por el ultimo espacio: sin espacios en los marcos
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}".replace(' ', '_')
+
+
+def sample_stacks(seconds: float, hz: int = 100, only_thread: Optional[int] = None) -> Counter:
+    """Cuenta pilas de llamadas muestreando `sys._current_frames()` a `hz` durante `seconds`.
+
+    Con `only_thread` se muestrea solo ese hilo (p.ej. el del event loop).
+    """
+    me = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    counts = Counter()
+    period = 1.0 / hz
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        for tid, frame in sys._current_frames().items():
+            if tid == me or (only_thread is not None and tid != only_thread):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if tid not in names:
+                names.update((t.ident, t.name) for t in threading.enumerate())
+            stack.append(names.get(tid, f"hilo-{tid}"))
+            counts[';'.join(reversed(stack))] += 1
+        time.sleep(period)
+    return counts
+
+
+def collapsed(counts: Counter) -> str:
+    return ''.join(f"{stack} {n}\n" for stack, n in counts.most_common())
@@ -0,0 +1,257 @@
+"""Planificacion de pasadas paralelas (boustrophedon) sobre el limite del campo.
+
+El poligono se lleva a un sistema (u, v) con u a lo largo de las pasadas y v
+perpendicular. Cada pasada es una recta v = cte y su recorte contra el
+poligono son los pares de cruces ordenados de esa recta con las aristas,
+calculados para todas las pasadas a la vez con numpy. Los tramos de pasadas
+consecutivas que se solapan uno a uno forman celdas que se recorren en zigzag
+con giros en U en la cabecera; las celdas se encadenan por cercania.
+
+El angulo que minimiza la cantidad de tramos (y por lo tanto de giros) se
+busca contando cruces por fila con dos `searchsorted` sobre los extremos de
+las aristas ordenados: O(n log n) por angulo, sin recortar.
+"""
+import math
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .geocerca import ring_edges
+from .geodesia import LocalPlane, area as ring_area
+
+ANGLE_STEP = 1.0          # grados entre angulos probados al optimizar
+ARC_POINTS = 9            # puntos del semicirculo de cada giro en U
+CANDIDATES = 6            # angulos con menos cruces que se recortan para elegir el rumbo
+
+
+def _rotate(edges: np.ndarray, angle: float) -> np.ndarray:
+    """Aristas en (u, v): u a lo largo del rumbo `angle` (grados desde el Norte), v a su derecha."""
+    s, c = math.sin(math.radians(angle)), math.cos(math.radians(angle))
+    x, y = edges[:, 0::2], edges[:, 1::2]
+    u, v = x * s + y * c, x * c - y * s
+    return np.column_stack((u[:, 0], v[:, 0], u[:, 1], v[:, 1]))
+
+
+def _rows(vmin: float, vmax: float, width: float) -> np.ndarray:
+    m = max(1, int(math.ceil((vmax - vmin) / width - 1e-9)))
+    return vmin + width * (np.arange(m) + 0.5)
+
+
+def count_segments(edges_uv: np.ndarray, width: float) -> int:
+    """Tramos de pasada (sin recortar) para aristas ya rotadas: cruces / 2."""
+    lo = np.sort(np.minimum(edges_uv[:, 1], edges_uv[:, 3]))
+    hi = np.sort(np.maximum(edges_uv[:, 1], edges_uv[:, 3]))
+    rows = _rows(lo[0], hi[-1], width)
+    # aristas con lo <= v < hi cruzan la fila (mismo criterio semiabierto que el recorte)
+    crossings = np.searchsorted(lo, rows, side='right') - np.searchsorted(hi, rows, side='right')
+    return int(crossings.sum()) // 2
+
+
+def clip_rows(edges_uv: np.ndarray, width: float) -> List[Tuple[int, float, float]]:
+    """(fila, u0, u1) de cada tramo de pasada dentro del poligono.
+
+    Cada arista genera directamente las filas que cruza (lo <= v < hi), asi el
+    costo es O(aristas + cruces) y no filas x aristas.
+    """
+    ua, va, ub, vb = edges_uv.T
+    lo, hi = np.minimum(va, vb), np.maximum(va, vb)
+    v0 = lo.min()
+    k_lo = np.ceil((lo - v0) / width - 0.5).astype(np.int64)
+    k_hi = np.ceil((hi - v0) / width - 0.5).astype(np.int64)
+    n = np.maximum(k_hi - k_lo, 0)
+    if not n.any():
+        return []
+    e = np.repeat(np.arange(len(ua)), n)
+    start = np.repeat(np.cumsum(n) - n, n)
+    k = np.repeat(k_lo, n) + (np.arange(len(e)) - start)
+    v = v0 + width * (k + 0.5)
+    u = ua[e] + (v - va[e]) * (ub[e] - ua[e]) / (vb[e] - va[e])
+    order = np.lexsort((u, k))
+    k, u = k[order], u[order]
+    out = []
+    rows, first, counts = np.unique(k, return_index=True, return_counts=True)
+    for row, i0, c in zip(rows.tolist(), first.tolist(), counts.tolist()):
+        xs = u[i0:i0 + c - c % 2].tolist()
+        out.extend((row, a, b) for a, b in zip(xs[0::2], xs[1::2]))
+    return out
+
+
+def _trimmed(segments, headland: float):
+    return [(k, a + headland, b - headland) for k, a, b in segments if b - a > 2 * headland]
+
+
+def _longest_edge_angle(edges: np.ndarray) -> float:
+    dx, dy = edges[:, 2] - edges[:, 0], edges[:, 3] - edges[:, 1]
+    k = int(np.argmax(dx * dx + dy * dy))
+    return math.degrees(math.atan2(dx[k], dy[k])) % 180.0
+
+
+def best_angle(edges: np.ndarray, width: float, headland: float = 0.0, step: float = ANGLE_STEP,
+               candidates: int = CANDIDATES) -> float:
+    """Rumbo con menos tramos de pasada.
+
+    Primero se cuentan cruces para todos los angulos (barato) y despues se
+    recortan solo los mejores candidatos para contar los tramos que sobreviven a
+    la cabecera: los bordes dentados agregan tramos cortos que no son pasadas.
+    A igual cantidad gana el angulo mas parecido al de la arista mas larga.
+    """
+    angles = np.arange(0.0, 180.0, step)
+    counts = np.array([count_segments(_rotate(edges, a), width) for a in angles])
+    ref = _longest_edge_angle(edges)
+    best = None
+    for a in angles[np.argsort(counts, kind='stable')[:candidates]]:
+        n = len(_trimmed(clip_rows(_rotate(edges, a), width), headland))
+        diff = abs((a - ref + 90.0) % 180.0 - 90.0)
+        if best is None or (n, diff) < best[:2]:
+            best = (n, diff, float(a))
+    return best[2]
+
+
+def _cells(segments: List[Tuple[int, float, float]]) -> List[List[Tuple[int, float, float]]]:
+    """Agrupa tramos de filas consecutivas que se solapan uno a uno (descomposicion boustrophedon)."""
+    by_row = {}
+    for seg in segments:
+        by_row.setdefault(seg[0], []).append(seg)
+    cells: List[List[Tuple[int, float, float]]] = []
+    open_cells = {}   # tramo de la fila anterior -> indice de su celda
+    prev: List[Tuple[int, float, float]] = []
+    for k in sorted(by_row):
+        cur = by_row[k]
+        links = {}
+        if prev and prev[0][0] == k - 1:
+            for a in prev:
+                for b in cur:
+                    if a[1] < b[2] and b[1] < a[2]:
+                        links.setdefault(a, []).append(b)
+                        links.setdefault(b, []).append(a)
+        nxt = {}
+        for b in cur:
+            ab = links.get(b, [])
+            if len(ab) == 1 and len(links.get(ab[0], [])) == 1:
+                idx = open_cells[ab[0]]
+                cells[idx].append(b)
+            else:
+                idx = len(cells)
+                cells.append([b])
+            nxt[b] = idx
+        open_cells, prev = nxt, cur
+    return cells
+
+
+def _u_turn(u0: float, v0: float, u1: float, v1: float, side: float) -> List[Tuple[float, float]]:
+    """Giro en U de (u0, v0) a (u1, v1): semicirculo hacia afuera segun `side` (+1 / -1).
+
+    Si las pasadas terminan a distinta altura la base del semicirculo se inclina
+    entre ambos extremos, asi no hay tramos de empalme fuera del campo ni marcha atras.
+    """
+    r = (v1 - v0) / 2.0
+    th = np.linspace(-math.pi / 2, math.pi / 2, ARC_POINTS)
+    base = u0 + (u1 - u0) * (th + math.pi / 2) / math.pi
+    return list(zip((base + side * abs(r) * np.cos(th)).tolist(), (v0 + r + r * np.sin(th)).tolist()))
+
+
+def _traverse(cell, rows: np.ndarray, start_first_row: bool, start_low: bool):
+    """Puntos (u, v) de una celda en zigzag y cantidad de giros."""
+    seq = cell if start_first_row else cell[::-1]
+    pts: List[Tuple[float, float]] = []
+    forward = start_low
+    for i, (k, u0, u1) in enumerate(seq):
+        v = float(rows[k])
+        a, b = (u0, u1) if forward else (u1, u0)
+        if i:
+            # giro en U en la cabecera del lado donde termino la pasada anterior
+            pu, pv = pts[-1]
+            pts.extend(_u_turn(pu, pv, a, v, -1.0 if forward else 1.0)[1:-1])
+        pts.append((a, v))
+        pts.append((b, v))
+        forward = not forward
+    return pts, max(0, len(seq) - 1)
+
+
+def plan(polygons, width: float, angle: Optional[float] = None, headland: float = 0.0) -> dict:
+    """FeatureCollection con la ruta planificada (LineString) y sus estadisticas en metadata.
+
+    `polygons` son los poligonos del limite (exterior + huecos en lon/lat), como
+    los devuelve `geocerca.boundary_polygons`.
+    """
+    t0 = time.perf_counter()
+    if width <= 0:
+        raise ValueError('ancho invalido')
+    rings = [ring for poly in polygons for ring in poly]
+    if not rings:
+        raise ValueError('el campo no tiene limite')
+    lon = np.concatenate([np.asarray(r, dtype=float)[:, 0] for r in rings])
+    lat = np.concatenate([np.asarray(r, dtype=float)[:, 1] for r in rings])
+    plane = LocalPlane.around(lon, lat)
+    edges = ring_edges(plane, rings)
+    optimized = angle is None
+    if optimized:
+        angle = best_angle(edges, width, headland)
+    angle = float(angle) % 180.0
+
+    euv = _rotate(edges, angle)
+    rows = _rows(min(euv[:, 1].min(), euv[:, 3].min()), max(euv[:, 1].max(), euv[:, 3].max()), width)
+    segments = _trimmed(clip_rows(euv, width), headland)
+
+    # Celdas encadenadas por cercania: se entra por la esquina libre mas proxima
+    cells = _cells(segments)
+    path: List[Tuple[float, float]] = []
+    turns = transits = 0
+    pending = list(range(len(cells)))
+    while pending:
+        best = None
+        for ci in pending:
+            cell = cells[ci]
+            for first in (True, False):
+                k, u0, u1 = cell[0] if first else cell[-1]
+                for low in (True, False):
+                    if not path:
+                        d = 0.0
+                    else:
+                        d = math.hypot((u0 if low else u1) - path[-1][0], float(rows[k]) - path[-1][1])
+                    if best is None or d < best[0]:
+                        best = (d, ci, first, low)
+            if not path:
+                break
+        _, ci, first, low = best
+        pts, n = _traverse(cells[ci], rows, first, low)
+        if path:
+            transits += 1
+        path.extend(pts)
+        turns += n
+        pending.remove(ci)
+
+    s, c = math.sin(math.radians(angle)), math.cos(math.radians(angle))
+    coords = []
+    if path:
+        uv = np.asarray(path)
+        x = uv[:, 0] * s + uv[:, 1] * c
+        y = uv[:, 0] * c - uv[:, 1] * s
+        ln, lt = plane.to_lonlat(x, y)
+        coords = np.round(np.column_stack((ln, lt)), 8).tolist()
+        length = float(np.hypot(np.diff(x), np.diff(y)).sum())
+    else:
+        length = 0.0
+    worked = sum(b - a for _, a, b in segments)
+
+    def _area(ring) -> float:
+        return ring_area([p[0] for p in ring], [p[1] for p in ring], plane)
+
+    area = sum(_area(poly[0]) - sum(_area(h) for h in poly[1:]) for poly in polygons)
+    meta = {
+        'angulo': round(angle, 2),
+        'angulo_optimizado': optimized,
+        'ancho': width,
+        'cabecera': headland,
+        'pasadas': len(segments),
+        'giros': turns,
+        'traslados': transits,
+        'longitud_m': round(length, 1),
+        'trabajo_m': round(worked, 1),
+        'areaHa': round(area / 10_000.0, 3),
+        'tiempo_ms': round(1000 * (time.perf_counter() - t0), 1),
+    }
+    feature = {'type': 'Feature', 'properties': {'role': 'plan'},
+               'geometry': {'type': 'LineString', 'coordinates': coords}}
+    return {'type': 'FeatureCollection', 'features': [feature] if coords else [], 'metadata': meta}
@@ -0,0 +1,153 @@
+"""Importacion de soluciones PPK (.pos de RTKLIB) como recorridos de un campo.
+
+Uso por linea de comandos (desde backend/):
+    python -m agropost.ppk campo1 solucion.pos --nombre cosecha-lote3 --max-q 2 --paso 1
+"""
+import argparse
+import io
+import json
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+from .cobertura import decimate_by_distance, swath_coverage
+from .geodesia import LocalPlane
+
+Q_FIX = 1
+Q_FLOAT = 2
+DEFAULT_STEP_M = 1.0
+
+
+class PosImportError(ValueError):
+    pass
+
+
+def parse_pos(data: bytes) -> np.ndarray:
+    """Columnas lat, lon, Q de un .pos en formato lat/lon/altura (cualquier formato de tiempo)."""
+    try:
+        arr = np.loadtxt(io.StringIO(data.decode('utf-8', errors='ignore')), comments='%', usecols=(2, 3, 5), ndmin=2)
+    except ValueError as e:
+        raise PosImportError(f'.pos invalido: {e}') from e
+    return arr
+
+
+def build_recorrido(data: bytes, ancho: float | None, max_q: int = Q_FLOAT, step_m: float = DEFAULT_STEP_M,
+                    maquinaria: str | None = None) -> dict:
+    """FeatureCollection de recorrido (linea + cobertura) a partir del contenido de un .pos."""
+    arr = parse_pos(data)
+    total = len(arr)
+    q = arr[:, 2].astype(int)
+    arr = arr[(q >= Q_FIX) & (q <= max_q)]
+    if len(arr) < 2:
+        raise PosImportError('sin epocas con la calidad pedida')
+
+    lat, lon = arr[:, 0], arr[:, 1]
+    plane = LocalPlane.around(lon, lat)
+    x, y = plane.to_xy(lon, lat)
+    keep = decimate_by_distance(x, y, step_m)
+    lat, lon = lat[keep], lon[keep]
+    line = [[round(float(a), 9), round(float(b), 9)] for a, b in zip(lon, lat)]
+
+    features = []
+    area_ha = None
+    if ancho and ancho > 0:
+        try:
+            grid, _ = swath_coverage(lon, lat, ancho, plane)
+        except ValueError as e:
+            raise PosImportError(str(e)) from e
+        geom = grid.to_geojson(plane)
+        area_ha = round(grid.area_m2() / 10000, 3)
+        if geom:
+            features.append({'type': 'Feature', 'properties': {'role': 'coverage'}, 'geometry': geom})
+    features.append({
+        'type': 'Feature',
+        'properties': {'role': 'line'},
+        'geometry': {'type': 'LineString', 'coordinates': line},
+    })
+
+    fix_count = int(np.count_nonzero(arr[:, 2] == Q_FIX))
+    return {
+        'type': 'FeatureCollection',
+        'features': features,
+        'metadata': {
+            'fuente': 'ppk',
+            'rawLine': line,
+            'areaHa': area_ha,
+            'maquinaria': maquinaria,
+            'maquinariaAncho': ancho,
+            'ppk': {
+                'epocas': total,
+                'usadas': int(len(arr)),
+                'puntos': len(line),
+                'fix_ratio': round(fix_count / len(arr), 4),
+                'max_q': max_q,
+                'paso_m': step_m,
+            },
+            'updatedAt': datetime.now(timezone.utc).isoformat(),
+        },
+    }
+
+
+def maquinaria_ancho(campo_dir: Path, nombre: str | None):
+    """(nombre, ancho) de la maquinaria pedida o de la actual del campo."""
+    try:
+        datos = json.loads((campo_dir / 'datos.json').read_text(encoding='utf-8'))
+    except (OSError, json.JSONDecodeError):
+        return nombre, None
+    return ancho_en_datos(datos, nombre)
+
+
+def ancho_en_datos(datos: dict, nombre: str | None):
+    """Como `maquinaria_ancho` pero sobre un datos.json ya leido."""
+    nombre = nombre or datos.get('maquinaria_actual')
+    for m in datos.get('maquinarias') or []:
+        if isinstance(m, dict) and m.get('nombre') == nombre:
+            try:
+                ancho = float(m.get('ancho'))
+            except (TypeError, ValueError):
+                return nombre, None
+            return nombre, ancho if ancho > 0 else None
+    return nombre, None
+
+
+def main():
+    from .main import CAMPOS_ROOT, _slugify_filename
+
+    p = argparse.ArgumentParser(description='Importa un .pos de RTKLIB como recorrido de un campo')
+    p.add_argument('campo', help='id del campo (carpeta en campos guardados)')
+    p.add_argument('pos', help='archivo .pos')
+    p.add_argument('--nombre', help='nombre del recorrido (por defecto el del archivo)')
+    p.add_argument('--max-q', type=int, default=Q_FLOAT, help='1=solo Fix, 2=Fix+Float')
+    p.add_argument('--paso', type=float, default=DEFAULT_STEP_M, help='metros minimos entre puntos')
+    p.add_argument('--maquinaria', help='maquinaria para el ancho de labor (por defecto la actual)')
+    p.add_argument('--ancho', type=float, help='ancho de labor en metros (ignora la maquinaria)')
+    p.add_argument('--sobrescribir', action='store_true', help='reemplazar el recorrido si ya existe')
+    args = p.parse_args()
+
+    campo_dir = CAMPOS_ROOT / args.campo
+    if not campo_dir.is_dir():
+        sys.exit(f'campo no encontrado: {campo_dir}')
+    slug = _slugify_filename(args.nombre or Path(args.pos).stem)
+    out = campo_dir / 'recorridos' / f'{slug}.geojson'
+    if out.exists() and not args.sobrescribir:
+        sys.exit(f'el recorrido ya existe: {out} (usar --sobrescribir)')
+    nombre, ancho = maquinaria_ancho(campo_dir, args.maquinaria)
+    if args.ancho:
+        ancho = args.ancho
+    try:
+        fc = build_recorrido(Path(args.pos).read_bytes(), ancho, args.max_q, args.paso, nombre)
+    except PosImportError as e:
+        sys.exit(str(e))
+    out.parent.mkdir(parents=True, exist_ok=True)
+    # Temporal + replace como main._write_snapshot: cambia el mtime de recorridos/ y la temporada lo nota
+    tmp = out.with_name(out.name + '.tmp')
+    tmp.write_text(json.dumps(fc, ensure_ascii=False), encoding='utf-8')
+    tmp.replace(out)
+    meta = fc['metadata']
+    print(f"{out}: {meta['ppk']['puntos']} puntos de {meta['ppk']['epocas']} epocas, area={meta['areaHa']} ha")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+"""Sesiones por maquina y suscripciones de clientes WebSocket por canal.
+
+Cada fix pertenece a una sesion (maquina, campo, recorrido) con su ultimo
+punto y un buffer de los recientes, en lugar de un unico LAST_POINT global.
+Los clientes /ws se suscriben a canales `machine:<nombre>` y/o `campo:<id>`;
+sin canales reciben todo. El indice canal -> suscriptores hace que el
+fan-out de un fix recorra solo a los interesados.
+
+Cada suscriptor puede ademas limitar la tasa (`max_hz`) y la distancia minima
+entre puntos (`min_dist`): el envio se decima por cliente y por sesion,
+quedando pendiente el ultimo fix omitido para mandarlo al vencer la ventana.
+"""
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from .geodesia import dist_m
+
+SESSION_BUFFER = 600        # fixes recientes por sesion (1 min a 10 Hz)
+SESSION_TTL = 3600.0        # seg. sin fixes antes de olvidar la sesion
+MAX_NAME = 64
+MAX_SILENCE = 5.0           # seg. maximos sin enviar a un cliente con min_dist aunque no se mueva
+
+SessionKey = Tuple[Optional[str], Optional[str], Optional[str]]
+
+
+def clean_name(value) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value[:MAX_NAME] or None
+
+
+class Session:
+    __slots__ = ('machine', 'campo', 'recorrido', 'last', 'buffer', 'fixes', 'updated', 'geocerca')
+
+    def __init__(self, machine: Optional[str], campo: Optional[str], recorrido: Optional[str], buffer: int):
+        self.machine = machine
+        self.campo = campo
+        self.recorrido = recorrido
+        self.last: Optional[dict] = None
+        self.buffer: deque = deque(maxlen=buffer)
+        self.fixes = 0
+        self.updated = 0.0
+        self.geocerca: Optional[str] = None   # 'dentro' / 'fuera' fuera de la franja de borde
+
+    def push(self, msg: dict, now: float) -> None:
+        self.last = msg
+        self.buffer.append(msg)
+        self.fixes += 1
+        self.updated = now
+
+    def info(self, now: float) -> dict:
+        return {
+            'machine': self.machine,
+            'campo': self.campo,
+            'recorrido': self.recorrido,
+            'fixes': self.fixes,
+            'inactiva_s': round(now - self.updated, 1),
+            'geocerca': self.geocerca,
+            'last': self.last,
+        }
+
+
+class SessionStore:
+    def __init__(self, buffer: int = SESSION_BUFFER, ttl: float = SESSION_TTL,
+                 on_expire: Optional[Callable[[SessionKey], None]] = None):
+        self.buffer = buffer
+        self.ttl = ttl
+        self.on_expire = on_expire
+        self.sessions: Dict[SessionKey, Session] = {}
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def push(self, msg: dict) -> Session:
+        now = time.monotonic()
+        key = session_key(msg)
+        session = self.sessions.get(key)
+        if session is None:
+            self._expire(now)   # solo al crear sesiones: el camino normal es un lookup
+            session = self.sessions[key] = Session(*key, buffer=self.buffer)
+        session.push(msg, now)
+        return session
+
+    def _expire(self, now: float) -> None:
+        old = [k for k, s in self.sessions.items() if now - s.updated > self.ttl]
+        for k in old:
+            del self.sessions[k]
+            if self.on_expire is not None:
+                self.on_expire(k)
+
+    def find(self, machine: Optional[str] = None, campo: Optional[str] = None,
+             recorrido: Optional[str] = None) -> List[Session]:
+        """Sesiones que coinciden con los filtros dados, la mas reciente primero."""
+        found = [
+            s for s in self.sessions.values()
+            if (machine is None or s.machine == machine)
+            and (campo is None or s.campo == campo)
+            and (recorrido is None or s.recorrido == recorrido)
+        ]
+        found.sort(key=lambda s: -s.updated)
+        return found
+
+    def info(self) -> List[dict]:
+        now = time.monotonic()
+        return [s.info(now) for s in self.find()]
+
+
+def parse_channels(machine: Optional[str] = None, campo: Optional[str] = None) -> frozenset:
+    """`machine=a,b&campo=c` -> {'machine:a', 'machine:b', 'campo:c'}."""
+    channels = set()
+    for kind, value in (('machine', machine), ('campo', campo)):
+        for name in (value or '').split(','):
+            name = clean_name(name)
+            if name:
+                channels.add(f'{kind}:{name}')
+    return frozenset(channels)
+
+
+def channels_of(msg: dict) -> Tuple[str, ...]:
+    out = []
+    if msg.get('machine'):
+        out.append(f"machine:{msg['machine']}")
+    if msg.get('campo'):
+        out.append(f"campo:{msg['campo']}")
+    return tuple(out)
+
+
+def session_key(msg: dict) -> SessionKey:
+    return msg.get('machine'), msg.get('campo'), msg.get('recorrido')
+
+
+class _Decimation:
+    __slots__ = ('last_t', 'last_lat', 'last_lon', 'pending', 'skipped', 'between', 'timer')
+
+    def __init__(self):
+        self.last_t: Optional[float] = None
+        self.last_lat = self.last_lon = 0.0
+        self.pending: Optional[dict] = None
+        self.skipped = 0
+        self.between: List[List[float]] = []
+        self.timer = False
+
+
+class Subscriber:
+    """Cliente /ws con sus canales (vacio = todos los fixes) y limites de envio."""
+    __slots__ = ('ws', 'channels', 'raw', 'min_interval', 'min_dist', 'coalesce', 'state')
+
+    def __init__(self, ws, channels: frozenset = frozenset(), max_hz: Optional[float] = None,
+                 min_dist: Optional[float] = None, coalesce: bool = False, raw: bool = False):
+        self.ws = ws
+        self.channels = channels
+        self.raw = raw   # recibir tambien la posicion sin filtrar (lat_raw/lon_raw)
+        self.state: Dict[SessionKey, _Decimation] = {}
+        self.set_limits(max_hz, min_dist, coalesce)
+
+    def set_limits(self, max_hz: Optional[float] = None, min_dist: Optional[float] = None,
+                   coalesce: bool = False) -> None:
+        self.min_interval = 1.0 / max_hz if max_hz else 0.0
+        self.min_dist = min_dist or 0.0
+        self.coalesce = coalesce
+        self.state.clear()
+
+    @property
+    def limited(self) -> bool:
+        return self.min_interval > 0.0 or self.min_dist > 0.0
+
+    def wants(self, msg: dict) -> bool:
+        return not self.channels or any(ch in self.channels for ch in channels_of(msg))
+
+    def _blocked(self, st: _Decimation, msg: dict, now: float, rate: bool = True) -> Optional[str]:
+        dt = now - st.last_t
+        if rate and dt < self.min_interval:
+            return 'tasa'
+        if (self.min_dist > 0.0 and dt < MAX_SILENCE
+                and dist_m(st.last_lat, st.last_lon, msg['lat'], msg['lon']) < self.min_dist):
+            return 'distancia'
+        return None
+
+    def offer(self, msg: dict, now: float) -> Optional[dict]:
+        """Mensaje a enviar ahora para `msg`, o None si queda retenido por los limites."""
+        key = session_key(msg)
+        st = self.state.get(key)
+        if st is None:
+            st = self.state[key] = _Decimation()
+        if st.last_t is not None:
+            why = self._blocked(st, msg, now)
+            if why is not None:
+                if self.coalesce and st.pending is not None:
+                    st.between.append([st.pending['lon'], st.pending['lat']])
+                # Solo lo demorado por tasa se manda al vencer la ventana (el ultimo gana)
+                st.pending = msg if why == 'tasa' else None
+                st.skipped += 1
+                return None
+        return self._emit(st, msg, now)
+
+    def flush_delay(self, key: SessionKey, now: float) -> Optional[float]:
+        """Segundos hasta poder mandar el pendiente de la sesion (None si no hace falta timer)."""
+        st = self.state.get(key)
+        if st is None or st.pending is None or st.timer or st.last_t is None:
+            return None
+        st.timer = True
+        return max(0.0, self.min_interval - (now - st.last_t))
+
+    def flush(self, key: SessionKey, now: float) -> Optional[dict]:
+        st = self.state.get(key)
+        if st is None:
+            return None
+        st.timer = False
+        msg, st.pending = st.pending, None
+        if msg is None or self._blocked(st, msg, now, rate=False) is not None:
+            return None
+        return self._emit(st, msg, now)
+
+    def _emit(self, st: _Decimation, msg: dict, now: float) -> dict:
+        if self.coalesce and st.pending is not None and st.pending is not msg:
+            # El retenido por tasa queda reemplazado por `msg`: va al trazo como los demas omitidos
+            st.between.append([st.pending['lon'], st.pending['lat']])
+        out = msg
+        if st.skipped:
+            out = dict(msg, omitidos=st.skipped)
+            if st.between:
+                out['intermedios'] = st.between
+                st.between = []
+        st.last_t = now
+        st.last_lat, st.last_lon = msg['lat'], msg['lon']
+        st.pending = None
+        st.skipped = 0
+        return out
+
+
+class SubscriptionIndex:
+    def __init__(self):
+        self.all: Set[Subscriber] = set()
+        self.unfiltered: Set[Subscriber] = set()
+        self.by_channel: Dict[str, Set[Subscriber]] = {}
+
+    def __len__(self):
+        return len(self.all)
+
+    def add(self, sub: Subscriber) -> None:
+        self.all.add(sub)
+        self._index(sub)
+
+    def remove(self, sub: Subscriber) -> None:
+        self.all.discard(sub)
+        self._unindex(sub)
+
+    def update(self, sub: Subscriber, channels: frozenset) -> None:
+        self._unindex(sub)
+        sub.channels = channels
+        if sub in self.all:
+            self._index(sub)
+
+    def _index(self, sub: Subscriber) -> None:
+        if not sub.channels:
+            self.unfiltered.add(sub)
+        for ch in sub.channels:
+            self.by_channel.setdefault(ch, set()).add(sub)
+
+    def _unindex(self, sub: Subscriber) -> None:
+        self.unfiltered.discard(sub)
+        for ch in sub.channels:
+            subs = self.by_channel.get(ch)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self.by_channel[ch]
+
+    def targets(self, msg: dict) -> Iterable[Subscriber]:
+        """Suscriptores interesados en `msg`: sin filtro + los de sus canales."""
+        chans = [self.by_channel[ch] for ch in channels_of(msg) if ch in self.by_channel]
+        if not chans:
+            return self.unfiltered
+        out = set(self.unfiltered)
+        for subs in chans:
+            out |= subs
+        return out
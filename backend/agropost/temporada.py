@@ -0,0 +1,317 @@
+"""Cobertura de temporada por campo: union de las coberturas de todos sus recorridos.
+
+Cada campo tiene una grilla de conteo (cuantos recorridos trabajaron cada
+celda) en el plano local del limite. Los poligonos 'coverage' de cada recorrido
+se rasterizan por paridad sobre los centros de celda y se guarda su ventana
+(indice de la primera celda + mascara) para poder restarlos cuando el recorrido
+se reemplaza o se borra: guardar o borrar un recorrido cuesta lo que su ventana,
+no lo que el campo. Los totales (trabajada, solape, fuera del limite) se ajustan
+con cada cambio, asi que el resumen sale en O(1) aunque haya cientos de recorridos.
+
+El estado se persiste en `temporada.npz` del campo y se concilia con el
+directorio de recorridos (mtime de cada archivo) solo cuando cambia el mtime
+del directorio o del area; si cambia el limite se rehace completo.
+"""
+import io
+import json
+import math
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from .cobertura import CoverageGrid
+from .geocerca import boundary_polygons, ring_edges, scanline_inside
+from .geodesia import LocalPlane
+
+STATE_FILE = 'temporada.npz'
+TARGET_CELLS = 4_000_000      # celdas del bbox del limite (~1 m en 400 ha)
+MIN_CELL_M = 0.5
+DEFAULT_CELL_M = 1.0          # campos sin limite
+MAX_GRID_CELLS = 20_000_000   # tope de la grilla de conteo (uint16: 40 MB)
+GROW_PAD = 256                # celdas extra al agrandar la grilla por trabajo fuera de ella
+
+Window = Tuple[int, int, np.ndarray]   # (i0, j0, mascara) en indices absolutos de celda
+
+
+def _mtime(path: Path) -> Optional[int]:
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def _read_fc(path: Path) -> dict:
+    try:
+        fc = json.loads(path.read_text(encoding='utf-8-sig'))
+    except (OSError, ValueError):
+        return {}
+    return fc if isinstance(fc, dict) else {}
+
+
+def coverage_rings(fc: dict) -> List[List[Tuple[float, float]]]:
+    """Anillos lon/lat de los poligonos 'coverage' de un recorrido."""
+    return [ring for poly in boundary_polygons(fc, roles=('coverage',)) for ring in poly]
+
+
+class SeasonCoverage:
+    """Grilla de conteo de un campo y aporte de cada recorrido."""
+
+    def __init__(self, limit_rings: List[List[Tuple[float, float]]], area_version: Optional[int] = None,
+                 plane: Optional[LocalPlane] = None, cell: Optional[float] = None):
+        self.area_version = area_version
+        self.dir_version: Optional[int] = None
+        self.plane = plane
+        self.cell = cell
+        if limit_rings and plane is None:
+            lon = np.concatenate([np.asarray(r, dtype=float)[:, 0] for r in limit_rings])
+            lat = np.concatenate([np.asarray(r, dtype=float)[:, 1] for r in limit_rings])
+            self.plane = LocalPlane.around(lon, lat)
+            x, y = self.plane.to_xy(lon, lat)
+            bbox = max(float((x.max() - x.min()) * (y.max() - y.min())), 1.0)
+            self.cell = max(MIN_CELL_M, math.sqrt(bbox / TARGET_CELLS))
+        self.limit: Optional[Window] = self._rasterize(limit_rings) if limit_rings else None
+        self.limit_cells = int(np.count_nonzero(self.limit[2])) if self.limit else 0
+
+        self.counts = np.zeros((0, 0), dtype=np.uint16)
+        self.i0 = self.j0 = 0
+        self.parts: Dict[str, Window] = {}
+        self.versions: Dict[str, Optional[int]] = {}   # mtime del archivo aplicado, por recorrido
+        self.skipped: Set[str] = set()
+        self.worked_in = self.worked_out = self.overlap_in = self.overlap_out = 0
+        self.fc: Optional[dict] = None
+        if self.limit:
+            i0, j0, m = self.limit
+            self._grow(i0, j0, i0 + m.shape[1], j0 + m.shape[0])
+
+    # ---- grilla ----
+    def _rasterize(self, rings) -> Optional[Window]:
+        edges = ring_edges(self.plane, rings)
+        if not len(edges):
+            return None
+        c = self.cell
+        xs, ys = edges[:, 0::2], edges[:, 1::2]
+        i0, i1 = math.floor(xs.min() / c), math.floor(xs.max() / c) + 1
+        j0, j1 = math.floor(ys.min() / c), math.floor(ys.max() / c) + 1
+        m = scanline_inside(edges, (np.arange(i0, i1) + 0.5) * c, (np.arange(j0, j1) + 0.5) * c)
+        rows, cols = np.flatnonzero(m.any(axis=1)), np.flatnonzero(m.any(axis=0))
+        if not len(rows):
+            return None
+        return i0 + int(cols[0]), j0 + int(rows[0]), m[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+
+    def _grow(self, i0: int, j0: int, i1: int, j1: int) -> None:
+        ny, nx = self.counts.shape
+        if nx and self.i0 <= i0 and i1 <= self.i0 + nx and self.j0 <= j0 and j1 <= self.j0 + ny:
+            return
+        if nx:
+            pad = GROW_PAD
+            i0, j0 = min(i0 - pad, self.i0), min(j0 - pad, self.j0)
+            i1, j1 = max(i1 + pad, self.i0 + nx), max(j1 + pad, self.j0 + ny)
+        if (i1 - i0) * (j1 - j0) > MAX_GRID_CELLS:
+            raise ValueError('cobertura demasiado extensa para la grilla del campo')
+        counts = np.zeros((j1 - j0, i1 - i0), dtype=np.uint16)
+        counts[self.j0 - j0:self.j0 - j0 + ny, self.i0 - i0:self.i0 - i0 + nx] = self.counts
+        self.counts, self.i0, self.j0 = counts, i0, j0
+
+    def _inside(self, i0: int, j0: int, shape: Tuple[int, int]) -> np.ndarray:
+        """Celdas de la ventana dentro del limite (todas si el campo no tiene limite)."""
+        if self.limit is None:
+            return np.ones(shape, dtype=bool)
+        li0, lj0, lm = self.limit
+        out = np.zeros(shape, dtype=bool)
+        a0, a1 = max(i0, li0), min(i0 + shape[1], li0 + lm.shape[1])
+        b0, b1 = max(j0, lj0), min(j0 + shape[0], lj0 + lm.shape[0])
+        if a0 < a1 and b0 < b1:
+            out[b0 - j0:b1 - j0, a0 - i0:a1 - i0] = lm[b0 - lj0:b1 - lj0, a0 - li0:a1 - li0]
+        return out
+
+    def _apply(self, part: Window, sign: int) -> None:
+        i0, j0, m = part
+        h, w = m.shape
+        view = self.counts[j0 - self.j0:j0 - self.j0 + h, i0 - self.i0:i0 - self.i0 + w]
+        # celdas que pasan de 0 a 1 (o de 1 a 0) y de 1 a 2 (o de 2 a 1) trabajos
+        first = m & (view == (0 if sign > 0 else 1))
+        second = m & (view == (1 if sign > 0 else 2))
+        if sign > 0:
+            view += m
+        else:
+            view -= m
+        inside = self._inside(i0, j0, m.shape)
+        fi, si = int(np.count_nonzero(first & inside)), int(np.count_nonzero(second & inside))
+        self.worked_in += sign * fi
+        self.worked_out += sign * (int(np.count_nonzero(first)) - fi)
+        self.overlap_in += sign * si
+        self.overlap_out += sign * (int(np.count_nonzero(second)) - si)
+
+    # ---- recorridos ----
+    def add(self, name: str, rings, version: Optional[int]) -> None:
+        """Aplica (o reemplaza) la cobertura de un recorrido."""
+        self.remove(name)
+        self.versions[name] = version
+        if not rings:
+            return
+        if self.plane is None:
+            pts = np.asarray([p for r in rings for p in r], dtype=float)
+            self.plane = LocalPlane.around(pts[:, 0], pts[:, 1])
+            self.cell = DEFAULT_CELL_M
+        part = self._rasterize(rings)
+        if part is None:
+            return
+        i0, j0, m = part
+        try:
+            self._grow(i0, j0, i0 + m.shape[1], j0 + m.shape[0])
+        except ValueError:
+            self.skipped.add(name)
+            return
+        self.parts[name] = part
+        self._apply(part, +1)
+        self.fc = None
+
+    def remove(self, name: str) -> None:
+        self.versions.pop(name, None)
+        self.skipped.discard(name)
+        part = self.parts.pop(name, None)
+        if part is not None:
+            self._apply(part, -1)
+            self.fc = None
+
+    # ---- productos ----
+    def summary(self) -> dict:
+        ha = (self.cell or 0.0) ** 2 / 10_000.0
+        out = {
+            'recorridos': len(self.versions),
+            'conCobertura': len(self.parts),
+            'celda_m': round(self.cell, 3) if self.cell else None,
+            'areaHa': None, 'trabajadaHa': round(self.worked_in * ha, 3), 'solapeHa': round(self.overlap_in * ha, 3),
+            'restanteHa': None, 'fueraHa': None, 'avance': None,
+            'omitidos': sorted(self.skipped),
+        }
+        if self.limit is not None:
+            out['areaHa'] = round(self.limit_cells * ha, 3)
+            out['restanteHa'] = round((self.limit_cells - self.worked_in) * ha, 3)
+            out['fueraHa'] = round(self.worked_out * ha, 3)
+            out['avance'] = round(100.0 * self.worked_in / self.limit_cells, 1) if self.limit_cells else None
+        return out
+
+    def to_geojson(self) -> dict:
+        """FeatureCollection con el poligono de la union (role 'coverage') y el resumen en metadata."""
+        if self.fc is None:
+            features = []
+            worked = self.counts > 0
+            rows, cols = np.flatnonzero(worked.any(axis=1)), np.flatnonzero(worked.any(axis=0))
+            if len(rows):
+                mask = worked[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+                grid = CoverageGrid((self.i0 + cols[0]) * self.cell, (self.j0 + rows[0]) * self.cell,
+                                    mask.shape[1], mask.shape[0], self.cell)
+                grid.mask = mask
+                geom = grid.to_geojson(self.plane)
+                if geom:
+                    features.append({'type': 'Feature', 'properties': {'role': 'coverage'}, 'geometry': geom})
+            self.fc = {'type': 'FeatureCollection', 'features': features}
+        return {**self.fc, 'metadata': self.summary()}
+
+    # ---- persistencia ----
+    def dump(self) -> bytes:
+        names = sorted(self.parts)
+        meta = {
+            'area_version': self.area_version, 'dir_version': self.dir_version,
+            'plane': [self.plane.lat0, self.plane.lon0] if self.plane else None, 'cell': self.cell,
+            'i0': self.i0, 'j0': self.j0, 'versions': self.versions, 'skipped': sorted(self.skipped),
+            'parts': [[n, self.parts[n][0], self.parts[n][1]] for n in names],
+            'tallies': [self.worked_in, self.worked_out, self.overlap_in, self.overlap_out],
+        }
+        arrays = {f'p{k}': self.parts[n][2] for k, n in enumerate(names)}
+        buf = io.BytesIO()
+        np.savez_compressed(buf, meta=np.array(json.dumps(meta)), counts=self.counts, **arrays)
+        return buf.getvalue()
+
+    @classmethod
+    def load(cls, data: bytes, limit_rings, area_version: Optional[int]) -> Optional['SeasonCoverage']:
+        """Estado guardado, o None si es de otra version del area."""
+        with np.load(io.BytesIO(data)) as z:
+            meta = json.loads(str(z['meta']))
+            if meta['area_version'] != area_version:
+                return None
+            plane = LocalPlane(*meta['plane']) if meta['plane'] else None
+            st = cls(limit_rings, area_version, plane, meta['cell'])
+            st.dir_version = meta['dir_version']
+            st.counts, st.i0, st.j0 = z['counts'], meta['i0'], meta['j0']
+            st.versions = meta['versions']
+            st.skipped = set(meta['skipped'])
+            st.parts = {n: (i0, j0, z[f'p{k}']) for k, (n, i0, j0) in enumerate(meta['parts'])}
+            st.worked_in, st.worked_out, st.overlap_in, st.overlap_out = meta['tallies']
+        return st
+
+
+class SeasonStore:
+    """Cobertura de temporada por campo, en memoria y en `<campo>/temporada.npz`.
+
+    Sin `changed`, solo se revisan los recorridos si cambio el mtime de la carpeta:
+    quien los escriba por fuera de la API debe hacerlo con temporal + rename.
+    """
+
+    def __init__(self):
+        self.states: Dict[str, SeasonCoverage] = {}
+        self.lock = threading.Lock()
+
+    def invalidate(self, campo: str) -> None:
+        with self.lock:
+            self.states.pop(campo, None)
+
+    def _current(self, campo_dir: Path, changed: Optional[str] = None) -> SeasonCoverage:
+        area_path = campo_dir / 'area.geojson'
+        area_version = _mtime(area_path)
+        st = self.states.get(campo_dir.name)
+        dirty = False
+        if st is None or st.area_version != area_version:
+            limit = [ring for poly in boundary_polygons(_read_fc(area_path)) for ring in poly]
+            st = None
+            try:
+                st = SeasonCoverage.load((campo_dir / STATE_FILE).read_bytes(), limit, area_version)
+            except (OSError, ValueError, KeyError):
+                pass
+            if st is None:
+                st, dirty = SeasonCoverage(limit, area_version), True
+            self.states[campo_dir.name] = st
+
+        rec_dir = campo_dir / 'recorridos'
+        dir_version = _mtime(rec_dir)
+        if st.dir_version != dir_version:
+            # alta o baja de archivos: conciliar por mtime (unico paso O(recorridos))
+            files = {p.name: p for p in rec_dir.glob('*.geojson') if p.is_file()} if dir_version else {}
+            for name in [n for n in st.versions if n not in files]:
+                st.remove(name)
+            for name, path in files.items():
+                version = _mtime(path)
+                if st.versions.get(name, -1) != version:
+                    st.add(name, coverage_rings(_read_fc(path)), version)
+            st.dir_version = dir_version
+            dirty = True
+        elif changed is not None:
+            path = rec_dir / changed
+            version = _mtime(path)
+            if version is None:
+                if changed in st.versions:
+                    st.remove(changed)
+                    dirty = True
+            elif st.versions.get(changed, -1) != version:
+                st.add(changed, coverage_rings(_read_fc(path)), version)
+                dirty = True
+        if dirty:
+            tmp = campo_dir / (STATE_FILE + '.tmp')
+            tmp.write_bytes(st.dump())
+            tmp.replace(campo_dir / STATE_FILE)
+        return st
+
+    def update(self, campo_dir: Path, filename: Optional[str] = None) -> dict:
+        """Concilia el campo (y el recorrido `filename` si se guardo o borro) y devuelve el resumen."""
+        with self.lock:
+            return self._current(campo_dir, filename).summary()
+
+    def summary(self, campo_dir: Path) -> dict:
+        return self.update(campo_dir)
+
+    def geojson(self, campo_dir: Path) -> dict:
+        with self.lock:
+            return self._current(campo_dir).to_geojson()
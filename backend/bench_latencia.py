@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Benchmark de latencia extremo a extremo POST /api/pos -> cliente /ws.
+
+Levanta el backend con uvicorn en un subproceso (o usa uno ya corriendo con
+--url), conecta K suscriptores WebSocket y postea fixes a R Hz para cada
+combinacion de la grilla K x R. Reporta p50/p99 de latencia, throughput y
+CPU del servidor por fix, y guarda los resultados en JSON para comparar
+corridas.
+
+El subproceso arranca con AGROPOST_FILTRO=0: se mide el transporte, y el
+filtro de ingesta descartaria fixes sinteticos que llegan desordenados. Con
+--url el filtro queda como este configurado; los fixes que rechaza se
+informan como `rechazados` y no cuentan como entregas faltantes.
+
+Uso (desde backend/):
+  python bench_latencia.py --clientes 1,10,50 --rates 10,50,200 --duracion 10 --json bench.json
+  python bench_latencia.py --comparar bench.json --tolerancia 0.25   # sale con error si empeora el p99
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import httpx
+import websockets
+
+BACKEND_DIR = Path(__file__).resolve().parent
+
+
+def percentile(sorted_vals, q: float):
+    if not sorted_vals:
+        return None
+    k = min(len(sorted_vals) - 1, max(0, int(round(q / 100.0 * (len(sorted_vals) - 1)))))
+    return round(sorted_vals[k], 3)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _proc_cpu_s(pid: int):
+    """CPU (usuario + sistema) consumida por el proceso, en segundos; None fuera de Linux."""
+    try:
+        fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def start_server(port: int):
+    cmd = [sys.executable, "-m", "uvicorn", "agropost.main:app", "--host", "127.0.0.1",
+           "--port", str(port), "--log-level", "warning", "--no-access-log"]
+    proc = subprocess.Popen(cmd, cwd=str(BACKEND_DIR), env=dict(os.environ, AGROPOST_FILTRO="0"))
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            if httpx.get(url + "/api/health", timeout=0.5).status_code == 200:
+                return proc, url
+        except httpx.HTTPError:
+            pass
+        if proc.poll() is not None:
+            raise SystemExit("uvicorn termino al arrancar")
+        time.sleep(0.1)
+    proc.kill()
+    raise SystemExit("el backend no respondio /api/health")
+
+
+async def subscriber(url: str, arrivals: dict, ready: asyncio.Event, counter: list, stop: asyncio.Event):
+    async with websockets.connect(url, max_queue=None) as ws:
+        counter[0] += 1
+        if counter[0] >= counter[1]:
+            ready.set()
+        while not stop.is_set():
+            try:
+                raw = await asyncio.wait_for(ws.recv(), timeout=0.2)
+            except asyncio.TimeoutError:
+                continue
+            t = time.perf_counter()
+            ts = json.loads(raw).get("ts")
+            if ts in arrivals:
+                arrivals[ts].append(t)
+
+
+async def run_cell(base_url: str, clients: int, rate: float, duration: float, warmup: float, server_pid):
+    ws_url = base_url.replace("http", "ws", 1) + "/ws"
+    period = 1.0 / rate
+    sent_at = {}
+    arrivals = {}
+    http_ms = []
+    errors = 0
+    rejected = 0
+    stop = asyncio.Event()
+    ready = asyncio.Event()
+    counter = [0, clients]
+    subs = [asyncio.create_task(subscriber(ws_url, arrivals, ready, counter, stop)) for _ in range(clients)]
+    if clients:
+        await asyncio.wait_for(ready.wait(), timeout=30)
+    base_ts = datetime.now(timezone.utc)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=10.0,
+                                 limits=httpx.Limits(max_connections=32, max_keepalive_connections=32)) as http:
+        async def post(seq: int, measured: bool):
+            nonlocal errors, rejected
+            # ts unico por fix a 1/rate (el backend lo devuelve tal cual por /ws); 1e-7 grados ~ 1 cm por fix
+            ts = (base_ts + timedelta(seconds=seq * period)).isoformat().replace("+00:00", "Z")
+            if measured:
+                arrivals[ts] = []
+            t0 = time.perf_counter()
+            if measured:
+                sent_at[ts] = t0
+            try:
+                r = await http.post("/api/pos", json={"ts": ts, "lat": -34.6 + seq * 1e-7, "lon": -58.38, "fix_quality": 4})
+                r.raise_for_status()
+            except httpx.HTTPError:
+                errors += 1
+                return
+            if r.json().get("rechazado"):
+                # Descartado por el filtro de ingesta: no se difunde, no es una entrega perdida
+                if measured:
+                    rejected += 1
+                    del arrivals[ts]
+                return
+            if measured:
+                http_ms.append(1000.0 * (time.perf_counter() - t0))
+
+        tasks = []
+        start = time.perf_counter()
+        cpu0 = t_measure = None
+        seq = 0
+        while True:
+            now = time.perf_counter()
+            elapsed = seq * period
+            if elapsed >= warmup + duration:
+                break
+            measured = elapsed >= warmup
+            if measured and t_measure is None:
+                cpu0 = _proc_cpu_s(server_pid) if server_pid else None
+                t_measure = now
+            delay = start + elapsed - now
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(post(seq, measured)))
+            seq += 1
+        await asyncio.gather(*tasks)
+        wall = time.perf_counter() - t_measure
+        cpu1 = _proc_cpu_s(server_pid) if server_pid else None
+        await asyncio.sleep(0.5)   # ultimas entregas por WS
+
+    stop.set()
+    await asyncio.gather(*subs, return_exceptions=True)
+
+    lat = sorted(1000.0 * (t - sent_at[ts]) for ts, ts_arr in arrivals.items() for t in ts_arr)
+    fixes = len(sent_at)
+    expected = (fixes - rejected) * clients
+    http_ms.sort()
+    cpu = (cpu1 - cpu0) if cpu0 is not None and cpu1 is not None else None
+    ok = fixes - errors - rejected
+    return {
+        "clientes": clients,
+        "rate_hz": rate,
+        "fixes": fixes,
+        "errores_http": errors,
+        "rechazados": rejected,
+        "entregas": len(lat),
+        "entregas_faltantes": expected - len(lat),
+        "throughput_fixes_s": round(ok / wall, 1) if wall > 0 else None,
+        "entregas_s": round(len(lat) / wall, 1) if wall > 0 else None,
+        "latencia_ms": {"p50": percentile(lat, 50), "p99": percentile(lat, 99), "max": percentile(lat, 100)},
+        "http_ms": {"p50": percentile(http_ms, 50), "p99": percentile(http_ms, 99)},
+        "cpu_servidor_ms_por_fix": round(1000.0 * cpu / ok, 4) if cpu is not None and ok else None,
+        "cpu_servidor_pct": round(100.0 * cpu / wall, 1) if cpu is not None and wall > 0 else None,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=str(BACKEND_DIR),
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(current: dict, baseline_path: Path, tolerance: float) -> int:
+    """Compara el p99 de cada celda con una corrida anterior; devuelve la cantidad de regresiones."""
+    base = json.loads(baseline_path.read_text(encoding="utf-8"))
+    prev = {(r["clientes"], r["rate_hz"]): r for r in base.get("resultados", [])}
+    regressions = 0
+    for r in current["resultados"]:
+        old = prev.get((r["clientes"], r["rate_hz"]))
+        if not old or old["latencia_ms"]["p99"] is None or r["latencia_ms"]["p99"] is None:
+            continue
+        ratio = r["latencia_ms"]["p99"] / max(old["latencia_ms"]["p99"], 1e-3)
+        flag = ratio > 1.0 + tolerance
+        regressions += flag
+        print(f"  K={r['clientes']:4d} R={r['rate_hz']:6g}: p99 {old['latencia_ms']['p99']:.2f} -> "
+              f"{r['latencia_ms']['p99']:.2f} ms ({ratio:.2f}x){'  REGRESION' if flag else ''}")
+    return regressions
+
+
+def _floats(text: str):
+    return [float(x) for x in text.split(",") if x.strip()]
+
+
+async def run_grid(args, base_url: str, server_pid):
+    results = []
+    for k in [int(x) for x in _floats(args.clientes)]:
+        for r in _floats(args.rates):
+            res = await run_cell(base_url, k, r, args.duracion, args.calentamiento, server_pid)
+            lat = res["latencia_ms"]
+            cpu = res["cpu_servidor_ms_por_fix"]
+            print(f"K={k:4d} R={r:6g} Hz: p50={lat['p50']} p99={lat['p99']} ms, "
+                  f"{res['throughput_fixes_s']} fixes/s, {res['entregas_s']} entregas/s, "
+                  f"faltantes={res['entregas_faltantes']} errores={res['errores_http']} rechazados={res['rechazados']}, "
+                  f"cpu={cpu if cpu is not None else '?'} ms/fix")
+            results.append(res)
+    return results
+
+
+def main():
+    p = argparse.ArgumentParser(description="Latencia POST /api/pos -> /ws en una grilla clientes x tasa")
+    p.add_argument("--clientes", default="1,10,50", help="suscriptores WS por celda (lista)")
+    p.add_argument("--rates", default="10,50,200", help="fixes por segundo por celda (lista)")
+    p.add_argument("--duracion", type=float, default=10.0, help="segundos medidos por celda")
+    p.add_argument("--calentamiento", type=float, default=1.0, help="segundos iniciales descartados")
+    p.add_argument("--url", help="backend ya corriendo (sin medicion de CPU), p.ej. http://127.0.0.1:8000")
+    p.add_argument("--json", help="guardar resultados en este archivo")
+    p.add_argument("--comparar", help="JSON de una corrida anterior para detectar regresiones de p99")
+    p.add_argument("--tolerancia", type=float, default=0.25, help="empeoramiento relativo de p99 admitido")
+    args = p.parse_args()
+
+    proc = None
+    if args.url:
+        base_url, pid = args.url.rstrip("/"), None
+    else:
+        proc, base_url = start_server(_free_port())
+        pid = proc.pid
+    try:
+        results = asyncio.run(run_grid(args, base_url, pid))
+    finally:
+        if proc:
+            proc.terminate()
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()   # el cierre ordenado espera a los /ws abiertos
+                proc.wait()
+
+    report = {
+        "fecha": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "backend": args.url or "uvicorn subproceso",
+        "config": {"duracion_s": args.duracion, "calentamiento_s": args.calentamiento},
+        "resultados": results,
+    }
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"resultados: {args.json}")
+    if args.comparar:
+        print(f"comparacion con {args.comparar} (tolerancia {100 * args.tolerancia:.0f}%):")
+        if compare(report, Path(args.comparar), args.tolerancia):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
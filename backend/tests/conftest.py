@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Los tests importan `agropost` como lo hace uvicorn desde backend/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
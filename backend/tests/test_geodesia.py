@@ -0,0 +1,104 @@
+"""Precision de agropost.geodesia contra la inversa de Vincenty sobre WGS84."""
+import math
+
+import numpy as np
+import pytest
+
+from agropost import geodesia as g
+
+
+def _vincenty(lat1, lon1, lat2, lon2):
+    """(distancia m, rumbo inicial en grados) por la inversa de Vincenty."""
+    a, f = g.WGS84_A, g.WGS84_F
+    b = a * (1 - f)
+    L = math.radians(lon2 - lon1)
+    u1 = math.atan((1 - f) * math.tan(math.radians(lat1)))
+    u2 = math.atan((1 - f) * math.tan(math.radians(lat2)))
+    su1, cu1, su2, cu2 = math.sin(u1), math.cos(u1), math.sin(u2), math.cos(u2)
+    lam = L
+    for _ in range(200):
+        sl, cl = math.sin(lam), math.cos(lam)
+        ss = math.hypot(cu2 * sl, cu1 * su2 - su1 * cu2 * cl)
+        if ss == 0:
+            return 0.0, 0.0
+        cs = su1 * su2 + cu1 * cu2 * cl
+        sig = math.atan2(ss, cs)
+        sa = cu1 * cu2 * sl / ss
+        c2a = 1 - sa * sa
+        c2sm = cs - 2 * su1 * su2 / c2a if c2a else 0.0
+        c = f / 16 * c2a * (4 + f * (4 - 3 * c2a))
+        prev, lam = lam, L + (1 - c) * f * sa * (sig + c * ss * (c2sm + c * cs * (-1 + 2 * c2sm ** 2)))
+        if abs(lam - prev) < 1e-13:
+            break
+    k2 = c2a * (a * a - b * b) / (b * b)
+    aa = 1 + k2 / 16384 * (4096 + k2 * (-768 + k2 * (320 - 175 * k2)))
+    bb = k2 / 1024 * (256 + k2 * (-128 + k2 * (74 - 47 * k2)))
+    ds = bb * ss * (c2sm + bb / 4 * (cs * (-1 + 2 * c2sm ** 2) - bb / 6 * c2sm * (-3 + 4 * ss * ss) * (-3 + 4 * c2sm ** 2)))
+    az = math.atan2(cu2 * math.sin(lam), cu1 * su2 - su1 * cu2 * math.cos(lam))
+    return b * aa * (sig - ds), math.degrees(az) % 360.0
+
+
+def _pares(escala, n=500, seed=1):
+    """Pares de puntos a menos de `escala` metros, en latitudes de -60 a 60."""
+    rng = np.random.default_rng(seed)
+    lat0, lon0 = rng.uniform(-60, 60, n), rng.uniform(-180, 180, n)
+    d, az = rng.uniform(1, escala, n), np.radians(rng.uniform(0, 360, n))
+    dlat, dlon = g.meters_to_deg(d * np.sin(az), d * np.cos(az), lat0)
+    return lat0, lon0, lat0 + dlat, lon0 + dlon
+
+
+@pytest.mark.parametrize('escala, tol', [(10, 1e-6), (1000, 1e-6), (20000, 1e-2)])
+def test_distancia_contra_vincenty(escala, tol):
+    lat0, lon0, lat1, lon1 = _pares(escala)
+    ref = np.array([_vincenty(*p)[0] for p in zip(lat0, lon0, lat1, lon1)])
+    assert np.abs(g.distance(lon0, lat0, lon1, lat1) - ref).max() < tol
+
+
+@pytest.mark.parametrize('escala', [10, 1000, 20000])
+def test_rumbo_contra_vincenty(escala):
+    lat0, lon0, lat1, lon1 = _pares(escala)
+    ref = np.array([_vincenty(*p)[1] for p in zip(lat0, lon0, lat1, lon1)])
+    err = np.abs((g.bearing(lon0, lat0, lon1, lat1) - ref + 180.0) % 360.0 - 180.0)
+    assert err.max() < 1e-6
+
+
+def test_dist_m_entre_fixes():
+    lat0, lon0, lat1, lon1 = _pares(1000)
+    ref = np.array([_vincenty(*p)[0] for p in zip(lat0, lon0, lat1, lon1)])
+    dist = np.array([g.dist_m(*p) for p in zip(lat0, lon0, lat1, lon1)])
+    assert np.abs(dist - ref).max() < 1e-5
+
+
+@pytest.mark.parametrize('lat0', [-75.0, -34.6, 0.0, 60.0])
+def test_plano_ida_y_vuelta(lat0):
+    plane = g.LocalPlane(lat0, -58.4)
+    x, y = np.meshgrid(np.linspace(-5000, 5000, 101), np.linspace(-5000, 5000, 101))
+    lon, lat = plane.to_lonlat(x, y)
+    x2, y2 = plane.to_xy(lon, lat)
+    assert np.abs(x2 - x).max() < 1e-8
+    assert np.abs(y2 - y).max() < 1e-8
+
+
+def test_plano_escalar_igual_al_vectorial():
+    plane = g.LocalPlane(-34.6, -58.4)
+    rng = np.random.default_rng(2)
+    x, y = rng.uniform(-5000, 5000, 200), rng.uniform(-5000, 5000, 200)
+    lon, lat = plane.to_lonlat(x, y)
+    for i in range(len(x)):
+        assert plane.lonlat(x[i], y[i]) == pytest.approx((lon[i], lat[i]), abs=1e-12)
+        assert plane.xy(lon[i], lat[i]) == pytest.approx((x[i], y[i]), abs=1e-8)
+
+
+def test_plano_distancias_contra_vincenty():
+    plane = g.LocalPlane(-34.6, -58.4)
+    rng = np.random.default_rng(3)
+    x, y = rng.uniform(-5000, 5000, (2, 300)), rng.uniform(-5000, 5000, (2, 300))
+    lon, lat = plane.to_lonlat(x, y)
+    ref = np.array([_vincenty(lat[0, i], lon[0, i], lat[1, i], lon[1, i])[0] for i in range(300)])
+    assert np.abs(np.hypot(x[1] - x[0], y[1] - y[0]) - ref).max() < 5e-3
+
+
+def test_area_de_un_cuadrado():
+    plane = g.LocalPlane(-34.6, -58.4)
+    lon, lat = plane.to_lonlat([0.0, 1000.0, 1000.0, 0.0], [0.0, 0.0, 1000.0, 1000.0])
+    assert g.area(lon, lat, plane) == pytest.approx(1e6, abs=1e-3)
@@ -2,6 +2,9 @@ const KEY = "agropost.config.v1";
 
 export const defaults = {
   wsUrl: "",                     // vacío = usar ws://<host>/ws
+  machine: "",                   // máquinas a seguir (separadas por coma); vacío = todas
+  maxHz: 0,                      // actualizaciones por segundo pedidas al backend (0 = todas)
+  minDist: 0,                    // metros mínimos entre puntos enviados (0 = sin filtro)
   defaultLat: -34.6037,
   defaultLon: -58.3816,
   defaultZoom: 18,
@@ -3,19 +3,29 @@
 # Autores: Carrasco, Hess
 # Descripcion: Envia correcciones GNSS via LoRa y graba datos RAW GNSS para Post-Proceso.
 
+import os
 import time
 import serial
 from datetime import datetime
 from LoRaRF import SX127x
+from lora_log import BufferedLogWriter, LoraEventLog
+from rtcm import RtcmScheduler, extract_rtcm_frames, lora_airtime
+from lora_fec import CORR_HEADER_V1, FLAG_PARIDAD, HEADER_V2_LEN, FecEncoder
+from telemetria import LinkTelemetry, TelemetryPusher
 
 # --- CONFIGURACION ---
 SERIAL_PORT = "/dev/ttyACM0"  # Puerto del u-blox M8T
 BAUD_RATE = 9600
 
+# Backend para publicar metricas del enlace (0 = no publicar)
+API_HOST = os.getenv("AGROPOST_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("AGROPOST_PORT", "8000"))
+TELEMETRY_INTERVAL = float(os.getenv("AGROPOST_TELEMETRIA_INTERVAL", "5.0"))
+
 # Generacion de nombres de archivo unicos por hora
 TIMESTAMP_START = datetime.now().strftime('%H%M')
 GPS_FILE = f"base_gps_{TIMESTAMP_START}.ubx"
-LORA_FILE = f"base_lora_{TIMESTAMP_START}.csv"
+LORA_FILE = f"base_lora_{TIMESTAMP_START}.lora"  # binario, ver lora_log.py para pasar a CSV
 
 # Parametros LoRa (deben coincidir con la estacion movil)
 LORA_FREQ = 433000000
@@ -25,36 +35,38 @@ LORA_BW = 250000
 LORA_CR = 5
 LORA_SYNCWORD = 0x3444
 
-# Protocolo simple de correcciones: [0xAA,0xC1,seq,len,payload...]
-CORR_HEADER = b"\xAA\xC1"
+# Protocolo de correcciones:
+#   v1: [0xAA,0xC1,seq,len,payload...]
+#   v2: cabecera versionada con compresion y paridad XOR (ver lora_fec.py)
+CORR_PROTOCOL = 2
+FEC_GROUP = 4               # paquetes de datos por paquete de paridad (0 = sin FEC)
+COMPRESS_PAYLOAD = True
 MAX_PAYLOAD = 200           # bytes por paquete (sin header)
 FLUSH_INTERVAL = 0.25       # seg. maximos a esperar antes de vaciar el buffer
 BEACON_INTERVAL = 5.0       # seg. entre beacons para monitorear enlace
+LINK_DUTY = 0.8             # fraccion del tiempo que puede ocupar la radio
+STATS_INTERVAL = 30.0       # seg. entre reportes de throughput
+
+
+def packet_airtime(packet_len: int) -> float:
+    return lora_airtime(packet_len, LORA_SF, LORA_BW, LORA_CR)
 
 
-def extract_rtcm_frames(buf: bytearray):
-    """Extrae frames RTCM3 (0xD3, len[10 bits], payload, CRC3) del buffer."""
-    frames = []
-    while True:
-        if len(buf) < 3:
-            break
-        try:
-            start = buf.index(0xD3)
-        except ValueError:
-            buf.clear()
-            break
-        if start:
-            del buf[:start]
-        if len(buf) < 3:
-            break
-        length = ((buf[1] & 0x03) << 8) | buf[2]
-        total = 3 + length + 3  # header + payload + CRC24
-        if len(buf) < total:
-            break
-        frame = bytes(buf[:total])
-        del buf[:total]
-        frames.append(frame)
-    return frames
+def airtime(payload_len: int) -> float:
+    """Airtime estimado de un paquete de correccion (incluye la cabecera del protocolo)."""
+    header = HEADER_V2_LEN if CORR_PROTOCOL == 2 else 4
+    return packet_airtime(payload_len + header)
+
+
+def print_stats(sched: RtcmScheduler, elapsed: float):
+    st = sched.stats
+    sent = sum(st["enviados"].values())
+    dec = sum(st["decimados"].values())
+    exp = sum(st["vencidos"].values())
+    rate = st["bytes"] / elapsed if elapsed > 0 else 0.0
+    usage = 100.0 * st["airtime"] / elapsed if elapsed > 0 else 0.0
+    print(f"[STATS] RTCM {rate:.0f} B/s de {sched.capacity_bps:.0f} B/s, airtime {usage:.0f}%, "
+          f"frames enviados={sent} decimados={dec} vencidos={exp} por tipo={st['enviados']}")
 
 
 def send_lora(lora: SX127x, payload: bytes):
@@ -92,9 +104,9 @@ def main():
         print(f"Error abriendo GPS: {e}")
         return
 
-    f_gps = open(GPS_FILE, "wb")
-    f_lora = open(LORA_FILE, "w")
-    f_lora.write("TIMESTAMP,EVENTO,SEQ,LEN,DETALLE\n")
+    # Los logs se escriben desde hilos propios: nunca frenan la transmision
+    f_gps = BufferedLogWriter(GPS_FILE)
+    f_lora = LoraEventLog(LORA_FILE)
 
     print(f"=== AGROPOST BASE INICIADA ===")
     print(f"GPS Log  > {GPS_FILE}")
@@ -104,8 +116,17 @@ def main():
     seq = 0
     last_beacon = 0.0
     last_flush = 0.0
-    tx_buffer = bytearray()
+    start = time.time()
+    last_stats = start
     rtcm_buffer = bytearray()
+    sched = RtcmScheduler(MAX_PAYLOAD, airtime, duty=LINK_DUTY)
+    encoder = FecEncoder(k=FEC_GROUP, compress=COMPRESS_PAYLOAD) if CORR_PROTOCOL == 2 else None
+    print(f"Capacidad del enlace SF{LORA_SF}/BW{LORA_BW // 1000}k: ~{sched.capacity_bps:.0f} B/s de RTCM")
+
+    telemetry = LinkTelemetry("base")
+    tel_pusher = TelemetryPusher(telemetry, API_HOST, API_PORT, TELEMETRY_INTERVAL)
+    tel_thread = tel_pusher.start()
+    last_tel = start
 
     try:
         while True:
@@ -116,47 +137,88 @@ def main():
                     f_gps.write(data)  # log completo para postproceso
                     rtcm_buffer.extend(data)
                     # Extraer unicamente los frames RTCM que sirven para RTK
+                    now = time.time()
                     for frame in extract_rtcm_frames(rtcm_buffer):
-                        tx_buffer.extend(frame)
+                        sched.push(frame, now)
 
             now = time.time()
 
-            # B. FRAGMENTAR Y ENVIAR CORRECCIONES (RTCM/UBX) VIA LORA
-            while tx_buffer and (len(tx_buffer) >= MAX_PAYLOAD or (now - last_flush) > FLUSH_INTERVAL):
-                chunk_len = min(MAX_PAYLOAD, len(tx_buffer))
-                chunk = bytes(tx_buffer[:chunk_len])
-                del tx_buffer[:chunk_len]
-
-                pkt = CORR_HEADER + bytes([seq & 0xFF, chunk_len]) + chunk
-                send_lora(lora, pkt)
-
+            # B. EMPAQUETAR Y ENVIAR CORRECCIONES VIA LORA (frames completos, por prioridad)
+            flush = (now - last_flush) > FLUSH_INTERVAL
+            for chunk in sched.next_packets(now, flush=flush):
+                chunk_len = len(chunk)
                 ts = datetime.now().strftime('%H:%M:%S.%f')[:-3]
-                f_lora.write(f"{ts},TX_CORR,{seq},{chunk_len},{chunk.hex()}\n")
-                f_lora.flush()
-
-                print(f"[{ts}] Tx CORR seq={seq} bytes={chunk_len}")
+                if encoder is None:
+                    send_lora(lora, CORR_HEADER_V1 + bytes([seq & 0xFF, chunk_len]) + chunk)
+                    telemetry.packet(chunk_len + 4, seq=seq & 0xFF)
+                    print(f"[{ts}] Tx CORR seq={seq} bytes={chunk_len}")
+                else:
+                    seq = encoder.seq
+                    for pkt in encoder.encode(chunk):
+                        send_lora(lora, pkt)
+                        # El scheduler estimo el paquete sin comprimir; ajustar al airtime real
+                        if pkt[2] & FLAG_PARIDAD:
+                            sched.charge(packet_airtime(len(pkt)))
+                            f_lora.log("TX_FEC", seq=pkt[3], data=pkt)
+                            telemetry.packet(len(pkt))
+                        else:
+                            sched.charge(packet_airtime(len(pkt)) - airtime(chunk_len))
+                            telemetry.packet(len(pkt), seq=pkt[3])
+                        print(f"[{ts}] Tx CORR seq={pkt[3]} bytes={len(pkt)} (payload={chunk_len})")
+                f_lora.log("TX_CORR", seq=seq, data=chunk)
                 seq = (seq + 1) % 256
                 last_flush = now
-                now = time.time()
+            if flush and not sched.pending:
+                # Sin mas datos: cerrar el grupo FEC para no dejarlo sin paridad
+                for pkt in encoder.flush() if encoder is not None else []:
+                    send_lora(lora, pkt)
+                    telemetry.packet(len(pkt))
+                    sched.charge(packet_airtime(len(pkt)))
+                    f_lora.log("TX_FEC", seq=pkt[3], data=pkt)
+                last_flush = now
 
             # C. BALIZA PERIODICA PARA MONITOREAR ENLACE
             if now - last_beacon > BEACON_INTERVAL:
                 beacon = b"BASE_OK"
                 send_lora(lora, beacon)
+                telemetry.packet(len(beacon))
+                sched.charge(packet_airtime(len(beacon)))
+                f_lora.log("TX_BEACON", seq=seq, data=beacon)
                 ts = datetime.now().strftime('%H:%M:%S.%f')[:-3]
-                f_lora.write(f"{ts},TX_BEACON,{seq},0,{beacon.decode()}\n")
-                f_lora.flush()
                 print(f"[{ts}] Tx Beacon")
                 last_beacon = now
 
+            # D. ESTADO DEL PLANIFICADOR PARA LA TELEMETRIA (acumulado desde el inicio)
+            if now - last_tel > 1.0:
+                st = sched.stats
+                elapsed = now - start
+                telemetry.set(
+                    airtime_pct=round(100.0 * st["airtime"] / elapsed, 1) if elapsed > 0 else None,
+                    capacidad_bps=round(sched.capacity_bps),
+                    rtcm_decimados=sum(st["decimados"].values()),
+                    rtcm_vencidos=sum(st["vencidos"].values()),
+                    log_descartados=f_gps.dropped + f_lora.dropped,
+                )
+                last_tel = now
+
+            # E. REPORTE DE THROUGHPUT EFECTIVO
+            if now - last_stats > STATS_INTERVAL:
+                print_stats(sched, now - start)
+                last_stats = now
+
             time.sleep(0.01)
 
     except KeyboardInterrupt:
         print("\nDeteniendo...")
     finally:
+        tel_pusher.stop_event.set()
+        if tel_thread is not None:
+            tel_thread.join(timeout=2.0)
         f_gps.close()
         f_lora.close()
         gps_serial.close()
+        if f_gps.dropped or f_lora.dropped:
+            print(f"AVISO: log saturado, descartados gps={f_gps.dropped} lora={f_lora.dropped}")
         print("Archivos cerrados correctamente.")
 
 
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# PROYECTO AGROPOST - DECODIFICADOR INCREMENTAL DEL FLUJO GNSS
+# Autores: Carrasco, Hess
+# Descripcion: Separa el flujo serie del receptor en frames NMEA, UBX y RTCM3
+# validando checksum (XOR, Fletcher-8 y CRC-24Q). Trabaja sobre un bytearray con
+# indice de lectura: cada lectura del puerto se recorre una sola vez y el buffer
+# se compacta al final, sin decodificar a texto. Los parsers GGA/GSA/RMC/GST
+# leen los campos directamente de los bytes.
+#
+# Benchmark contra logs grabados (o un flujo sintetico multi-constelacion):
+#   python gnss_stream.py rover_gps_1743.ubx --chunk 256 --hz 20
+#   python gnss_stream.py --sintetico 600 --hz 20
+
+import re
+import sys
+import time
+import random
+import struct
+import argparse
+from functools import reduce
+from itertools import accumulate
+from operator import xor
+from pathlib import Path
+
+import numpy as np
+
+from rtcm import crc24q
+
+NMEA = "NMEA"
+UBX = "UBX"
+RTCM3 = "RTCM3"
+
+NMEA_MAX_LEN = 120        # 82 segun la norma; algunos receptores agregan campos
+UBX_MAX_PAYLOAD = 8192
+MAX_BUFFER = 1 << 20      # si se supera se descarta (flujo sin sincronismo)
+KNOT_MS = 0.514444
+
+_SYNC = re.compile(rb"[$\xB5\xD3]")
+# CK_B = suma de las sumas parciales = sum(d[i] * (n - i)): pesos decrecientes precalculados
+_FLETCHER_W = np.arange(UBX_MAX_PAYLOAD + 4, 0, -1, dtype=np.int64)
+_FLETCHER_MIN = 64   # por debajo de esto el bucle en Python es mas rapido que NumPy
+
+
+def ubx_checksum(data) -> tuple:
+    """Fletcher-8 de UBX sobre clase, id, largo y payload."""
+    n = len(data)
+    if n < _FLETCHER_MIN:
+        return sum(data) & 0xFF, sum(accumulate(data)) & 0xFF
+    d = np.frombuffer(data, dtype=np.uint8)
+    return int(d.sum()) & 0xFF, int(np.dot(d, _FLETCHER_W[-n:])) & 0xFF
+
+
+def ubx_frame(msg_class: int, msg_id: int, payload: bytes) -> bytes:
+    body = struct.pack("<BBH", msg_class, msg_id, len(payload)) + payload
+    return b"\xB5\x62" + body + bytes(ubx_checksum(body))
+
+
+def nmea_sentence(body: str) -> bytes:
+    """Arma `$body*hh\\r\\n` con el checksum XOR."""
+    raw = body.encode()
+    return b"$" + raw + b"*%02X\r\n" % reduce(xor, raw, 0)
+
+
+class GnssStreamDecoder:
+    """Demultiplexor incremental NMEA / UBX / RTCM3.
+
+    `feed()` agrega una lectura del puerto y devuelve los frames completos y
+    validos como lista de (tipo, bytes). Los bytes que no forman un frame valido
+    se descartan avanzando de a uno hasta el proximo sincronismo.
+    """
+
+    def __init__(self, max_buffer: int = MAX_BUFFER):
+        self.buf = bytearray()
+        self.max_buffer = max_buffer
+        self.stats = {NMEA: 0, UBX: 0, RTCM3: 0, "checksum_error": 0, "descartados": 0}
+
+    def feed(self, data) -> list:
+        buf = self.buf
+        buf += data
+        out = []
+        pos = 0
+        end = len(buf)
+        stats = self.stats
+        with memoryview(buf) as mv:
+            while pos < end:
+                m = _SYNC.search(buf, pos)
+                if m is None:
+                    stats["descartados"] += end - pos
+                    pos = end
+                    break
+                p = m.start()
+                stats["descartados"] += p - pos
+                pos = p
+                kind, size = self._frame_at(buf, mv, p, end)
+                if size is None:      # frame incompleto: esperar mas datos
+                    break
+                if kind is None:      # sincronismo falso o checksum invalido
+                    pos = p + 1
+                    stats["descartados"] += 1
+                    continue
+                stats[kind] += 1
+                if kind == NMEA:
+                    stop = p + size
+                    while buf[stop - 1] in (0x0A, 0x0D):
+                        stop -= 1
+                    out.append((kind, mv[p:stop].tobytes()))
+                else:
+                    out.append((kind, mv[p:p + size].tobytes()))
+                pos = p + size
+        del buf[:pos]
+        if len(buf) > self.max_buffer:
+            stats["descartados"] += len(buf)
+            buf.clear()
+        return out
+
+    def _frame_at(self, buf, mv, p: int, end: int):
+        """(tipo, largo) del frame en `p`; (None, 1) si no es valido, (None, None) si falta data."""
+        head = buf[p]
+        if head == 0x24:   # '$'
+            nl = buf.find(b"\n", p, p + NMEA_MAX_LEN)
+            if nl < 0:
+                return (None, None) if end - p < NMEA_MAX_LEN else (None, 1)
+            star = buf.rfind(b"*", p, nl)
+            if star < 0 or nl - star < 3:
+                self.stats["checksum_error"] += 1
+                return None, 1
+            try:
+                expected = int(buf[star + 1:star + 3], 16)
+            except ValueError:
+                expected = -1
+            if reduce(xor, mv[p + 1:star], 0) != expected:
+                self.stats["checksum_error"] += 1
+                return None, 1
+            return NMEA, nl + 1 - p
+        if head == 0xB5:
+            if end - p < 6:
+                return None, None
+            if buf[p + 1] != 0x62:
+                return None, 1
+            length = buf[p + 4] | (buf[p + 5] << 8)
+            if length > UBX_MAX_PAYLOAD:
+                return None, 1
+            size = 8 + length
+            if end - p < size:
+                return None, None
+            ck_a, ck_b = ubx_checksum(mv[p + 2:p + 6 + length])
+            if ck_a != buf[p + size - 2] or ck_b != buf[p + size - 1]:
+                self.stats["checksum_error"] += 1
+                return None, 1
+            return UBX, size
+        # 0xD3
+        if end - p < 3:
+            return None, None
+        if buf[p + 1] & 0xFC:
+            return None, 1
+        length = ((buf[p + 1] & 0x03) << 8) | buf[p + 2]
+        size = 3 + length + 3
+        if end - p < size:
+            return None, None
+        if crc24q(mv[p:p + 3 + length]) != int.from_bytes(buf[p + 3 + length:p + size], "big"):
+            self.stats["checksum_error"] += 1
+            return None, 1
+        return RTCM3, size
+
+
+# --- Parsers NMEA sobre bytes ---
+
+def _num(field: bytes, cast=float):
+    if not field:
+        return None
+    try:
+        return cast(field)
+    except ValueError:
+        return None
+
+
+def nmea_to_deg(raw: bytes, hemi: bytes):
+    """Convierte coordenadas NMEA ddmm.mmmm a grados decimales."""
+    val = _num(raw)
+    if val is None:
+        return None
+    # ddmm.mm y dddmm.mm: los minutos son siempre las dos cifras enteras de menor orden
+    deg = int(val // 100)
+    res = deg + (val - deg * 100) / 60.0
+    return -res if hemi in (b"S", b"W") else res
+
+
+def nmea_time(raw: bytes):
+    """hhmmss.ss a segundos del dia."""
+    val = _num(raw)
+    if val is None:
+        return None
+    hh = int(val // 10000)
+    mm = int(val // 100) % 100
+    return hh * 3600 + mm * 60 + (val - hh * 10000 - mm * 100)
+
+
+def nmea_fields(frame: bytes):
+    """Campos de una sentencia (sin '$' ni checksum); el campo 0 es talker+tipo."""
+    star = frame.rfind(b"*")
+    return frame[1:star if star > 0 else len(frame)].split(b",")
+
+
+def parse_gga(f):
+    """lat/lon/fix/sats/hdop/altura desde los campos de un GGA."""
+    if len(f) < 10:
+        return None
+    lat = nmea_to_deg(f[2], f[3])
+    lon = nmea_to_deg(f[4], f[5])
+    if lat is None or lon is None:
+        return None
+    return {
+        "hora": nmea_time(f[1]),
+        "lat": lat,
+        "lon": lon,
+        "fix": _num(f[6], int) or 0,
+        "sats": _num(f[7], int) or 0,
+        "hdop": _num(f[8]),
+        "alt": _num(f[9]),
+    }
+
+
+def parse_gsa(f):
+    """PDOP/HDOP/VDOP desde un GSA (campos 15-17)."""
+    if len(f) < 18:
+        return None
+    return {"pdop": _num(f[15]), "hdop": _num(f[16]), "vdop": _num(f[17])}
+
+
+def parse_rmc(f):
+    """Posicion, validez, velocidad (m/s) y rumbo desde un RMC."""
+    if len(f) < 10:
+        return None
+    speed = _num(f[7])
+    return {
+        "hora": nmea_time(f[1]),
+        "valido": f[2] == b"A",
+        "lat": nmea_to_deg(f[3], f[4]),
+        "lon": nmea_to_deg(f[5], f[6]),
+        "speed": speed * KNOT_MS if speed is not None else None,
+        "heading": _num(f[8]),
+    }
+
+
+def parse_gst(f):
+    """Desvios estandar (m) de latitud, longitud y altura desde un GST."""
+    if len(f) < 9:
+        return None
+    return {"rms": _num(f[2]), "std_lat": _num(f[6]), "std_lon": _num(f[7]), "std_alt": _num(f[8])}
+
+
+NMEA_PARSERS = {b"GGA": parse_gga, b"GSA": parse_gsa, b"RMC": parse_rmc, b"GST": parse_gst}
+
+
+def parse_nmea(frame: bytes):
+    """(tipo, dict) para GGA/GSA/RMC/GST; None para otras sentencias."""
+    f = nmea_fields(frame)
+    kind = f[0][-3:]
+    parser = NMEA_PARSERS.get(kind)
+    if parser is None:
+        return None
+    data = parser(f)
+    return (kind.decode(), data) if data else None
+
+
+# --- Benchmark ---
+
+def _legacy_decode(chunks):
+    """Bucle anterior del rover (texto + split por linea), como referencia."""
+    nmea_buffer = ""
+    count = 0
+    for data in chunks:
+        nmea_buffer += data.decode(errors="ignore")
+        while "\n" in nmea_buffer:
+            line, nmea_buffer = nmea_buffer.split("\n", 1)
+            line = line.strip()
+            if not line:
+                continue
+            if "GGA" in line or "GSA" in line:
+                count += len(line.split(","))
+    return count
+
+
+def synthetic_stream(seconds: float, hz: float, seed: int = 1) -> bytes:
+    """Flujo tipo u-blox multi-constelacion: NMEA por epoca y UBX-RXM-RAWX de 40 satelites."""
+    rng = random.Random(seed)
+    out = bytearray()
+    lat, lon = 3443.12345, 5826.54321
+    for k in range(int(seconds * hz)):
+        t = k / hz
+        hh, mm, ss = int(t // 3600) % 24, int(t // 60) % 60, t % 60
+        hms = f"{hh:02d}{mm:02d}{ss:05.2f}"
+        lat += rng.uniform(-1e-4, 1e-4)
+        lon += rng.uniform(-1e-4, 1e-4)
+        out += nmea_sentence(f"GNGGA,{hms},{lat:.7f},S,{lon:.7f},W,4,28,0.6,35.2,M,14.1,M,1.0,0000")
+        for sys_id in range(1, 5):
+            svs = ",".join(f"{rng.randint(1, 32):02d}" for _ in range(12))
+            out += nmea_sentence(f"GNGSA,A,3,{svs},1.1,0.6,0.9,{sys_id}")
+        out += nmea_sentence(f"GNRMC,{hms},A,{lat:.7f},S,{lon:.7f},W,3.2,87.5,191026,,,R,V")
+        out += nmea_sentence(f"GNGST,{hms},0.9,0.02,0.01,45.0,0.012,0.011,0.025")
+        out += ubx_frame(0x02, 0x15, rng.randbytes(16 + 32 * 40))
+        if rng.random() < 0.01:
+            out += rng.randbytes(rng.randint(1, 40))   # ruido de linea
+    return bytes(out)
+
+
+def _chunks(data: bytes, size: int):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark del decodificador de flujo GNSS")
+    p.add_argument("file", nargs="?", help="log crudo del receptor (.ubx)")
+    p.add_argument("--sintetico", type=float, metavar="SEG", help="generar un flujo sintetico de SEG segundos")
+    p.add_argument("--hz", type=float, default=10.0, help="tasa de salida del receptor (epocas/s)")
+    p.add_argument("--chunk", type=int, default=256, help="bytes por lectura del puerto serie")
+    p.add_argument("--sin-referencia", action="store_true", help="no medir el bucle de texto anterior")
+    args = p.parse_args()
+
+    if args.file:
+        data = Path(args.file).read_bytes()
+    elif args.sintetico:
+        data = synthetic_stream(args.sintetico, args.hz)
+    else:
+        p.error("indicar un archivo o --sintetico")
+    chunks = _chunks(data, args.chunk)
+
+    dec = GnssStreamDecoder()
+    tipos = {}
+    t0 = time.perf_counter()
+    for chunk in chunks:
+        for kind, frame in dec.feed(chunk):
+            if kind == NMEA:
+                res = parse_nmea(frame)
+                if res:
+                    tipos[res[0]] = tipos.get(res[0], 0) + 1
+    elapsed = time.perf_counter() - t0
+
+    st = dec.stats
+    epochs = tipos.get("GGA", 0) or max(1, int(args.sintetico * args.hz) if args.sintetico else 1)
+    print(f"{len(data)} bytes en lecturas de {args.chunk} B")
+    print(f"  frames: NMEA={st[NMEA]} UBX={st[UBX]} RTCM3={st[RTCM3]} "
+          f"checksum_error={st['checksum_error']} descartados={st['descartados']} B")
+    print(f"  sentencias: " + " ".join(f"{k}={v}" for k, v in sorted(tipos.items())))
+    print(f"  decodificador: {elapsed:.3f}s, {len(data) / elapsed / 1e6:.1f} MB/s, "
+          f"{1e6 * elapsed / epochs:.0f} us/epoca, carga a {args.hz:g} Hz = {100 * elapsed / epochs * args.hz:.2f}% CPU")
+    if not args.sin_referencia:
+        t0 = time.perf_counter()
+        _legacy_decode(chunks)
+        legacy = time.perf_counter() - t0
+        print(f"  referencia, bucle de texto anterior (solo GGA/GSA, sin checksums): {legacy:.3f}s")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# PROYECTO AGROPOST - FEC Y COMPRESION PARA CORRECCIONES LORA
+# Autores: Carrasco, Hess
+# Descripcion: Protocolo v2 de paquetes de correccion con cabecera versionada,
+# compresion opcional por paquete (deflate crudo) y paridad XOR por grupos de
+# K paquetes: el rover reconstruye un paquete perdido por grupo sin pedir
+# retransmision. Incluye un simulador loopback con perdidas para probarlo.
+#
+# Cabecera v2 (7 bytes):
+#   0xAA 0xC2 flags seq grupo idx|k len
+#   flags: bit0 = payload comprimido, bit1 = paquete de paridad
+#   seq:   numero de paquete de datos (la paridad lleva el seq del primero del grupo)
+#   idx|k: nibble alto = posicion en el grupo, nibble bajo = paquetes de datos del grupo
+#
+# Simulador:
+#   python lora_fec.py base_gps_1743.ubx --perdida 0.1 --k 4
+
+import sys
+import zlib
+import random
+import argparse
+from pathlib import Path
+
+CORR_HEADER_V1 = b"\xAA\xC1"
+CORR_HEADER_V2 = b"\xAA\xC2"
+HEADER_V2_LEN = 7
+FLAG_COMPRIMIDO = 0x01
+FLAG_PARIDAD = 0x02
+MAX_GROUP = 15   # k entra en un nibble
+
+
+def _deflate(data: bytes) -> bytes:
+    comp = zlib.compressobj(9, zlib.DEFLATED, -15, 9)
+    return comp.compress(data) + comp.flush()
+
+
+def _inflate(data: bytes) -> bytes:
+    return zlib.decompress(data, -15)
+
+
+def _xor_into(acc: bytearray, data: bytes):
+    if len(data) > len(acc):
+        acc.extend(bytes(len(data) - len(acc)))
+    for i, b in enumerate(data):
+        acc[i] ^= b
+
+
+class FecEncoder:
+    """Arma paquetes v2 y agrega un paquete de paridad XOR cada `k` paquetes de datos.
+
+    `k=0` desactiva la paridad (solo cabecera v2 y compresion).
+    """
+
+    def __init__(self, k: int = 4, compress: bool = True):
+        if not 0 <= k <= MAX_GROUP:
+            raise ValueError(f"k debe estar entre 0 y {MAX_GROUP}")
+        self.k = k
+        self.compress = compress
+        self.seq = 0
+        self.group = 0
+        self.group_seq = 0
+        self.idx = 0
+        self.parity = bytearray()
+        self.stats = {"datos": 0, "paridad": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def _packet(self, flags: int, seq: int, idx: int, k: int, body: bytes) -> bytes:
+        return CORR_HEADER_V2 + bytes([flags, seq & 0xFF, self.group & 0xFF, (idx << 4) | k, len(body)]) + body
+
+    def encode(self, payload: bytes) -> list:
+        """Devuelve los paquetes a transmitir para `payload` (1 de datos y, al cerrar grupo, la paridad)."""
+        flags = 0
+        body = payload
+        if self.compress:
+            packed = _deflate(payload)
+            if len(packed) < len(payload):
+                flags |= FLAG_COMPRIMIDO
+                body = packed
+        if self.idx == 0:
+            self.group_seq = self.seq
+        pkt = self._packet(flags, self.seq, self.idx, self.k, body)
+        self.stats["datos"] += 1
+        self.stats["bytes_in"] += len(payload)
+        self.stats["bytes_out"] += len(pkt)
+        self.seq = (self.seq + 1) % 256
+        out = [pkt]
+        if self.k:
+            # La paridad cubre flags + largo + cuerpo para poder rearmar el paquete entero
+            _xor_into(self.parity, bytes([flags, len(body)]) + body)
+            self.idx += 1
+            if self.idx >= self.k:
+                out.extend(self.flush())
+        return out
+
+    def flush(self) -> list:
+        """Cierra el grupo en curso (aunque este incompleto) emitiendo su paridad."""
+        if not self.k or self.idx == 0:
+            return []
+        pkt = self._packet(FLAG_PARIDAD, self.group_seq, self.idx, self.idx, bytes(self.parity))
+        self.stats["paridad"] += 1
+        self.stats["bytes_out"] += len(pkt)
+        self.group = (self.group + 1) % 256
+        self.idx = 0
+        self.parity = bytearray()
+        return [pkt]
+
+
+def parse_v2(packet: bytes):
+    """Decodifica la cabecera v2. Devuelve dict o None si el paquete no es valido."""
+    if len(packet) < HEADER_V2_LEN or not packet.startswith(CORR_HEADER_V2):
+        return None
+    flags, seq, group, idxk, length = packet[2:HEADER_V2_LEN]
+    body = packet[HEADER_V2_LEN:HEADER_V2_LEN + length]
+    if len(body) != length:
+        return None
+    return {"flags": flags, "seq": seq, "group": group, "idx": idxk >> 4, "k": idxk & 0x0F, "body": body}
+
+
+class FecDecoder:
+    """Recibe paquetes v2 y entrega payloads de datos en orden, reconstruyendo con la paridad.
+
+    Los paquetes en orden se entregan en el acto. Ante un hueco dentro de un grupo
+    se retienen los siguientes hasta que llega la paridad (o empieza otro grupo),
+    asi el reensamblador RTCM los ve en secuencia.
+    """
+
+    def __init__(self):
+        self.group = None
+        self.group_seq = None
+        self.packets = {}     # idx -> (flags, body), se guardan para la paridad
+        self.next_idx = 0     # proximo indice a entregar
+        self.stats = {"recibidos": 0, "recuperados": 0, "paridad": 0, "error": 0}
+
+    def _reset(self, group: int, group_seq: int):
+        self.group = group
+        self.group_seq = group_seq
+        self.packets = {}
+        self.next_idx = 0
+
+    def _drain(self, upto: int | None = None) -> list:
+        """Entrega en orden lo consecutivo; con `upto` saltea huecos hasta ese indice."""
+        out = []
+        limit = upto if upto is not None else self.next_idx
+        while True:
+            if self.next_idx in self.packets:
+                flags, body = self.packets[self.next_idx]
+                seq = (self.group_seq + self.next_idx) % 256
+                try:
+                    payload = _inflate(body) if flags & FLAG_COMPRIMIDO else body
+                except zlib.error:
+                    self.stats["error"] += 1
+                else:
+                    out.append((seq, payload))
+            elif self.next_idx >= limit:
+                break
+            self.next_idx += 1
+        return out
+
+    def push(self, packet: bytes) -> list:
+        """Procesa un paquete crudo; devuelve lista de (seq, payload) listos para reensamblar."""
+        info = parse_v2(packet)
+        if info is None:
+            self.stats["error"] += 1
+            return []
+        out = []
+        is_parity = bool(info["flags"] & FLAG_PARIDAD)
+        group_seq = info["seq"] if is_parity else (info["seq"] - info["idx"]) % 256
+        if info["group"] != self.group:
+            if self.group is not None:
+                out.extend(self._drain(upto=MAX_GROUP + 1))
+            self._reset(info["group"], group_seq)
+
+        if is_parity:
+            self.stats["paridad"] += 1
+            n = info["k"]
+            missing = [i for i in range(n) if i not in self.packets]
+            if len(missing) == 1:
+                acc = bytearray(info["body"])
+                for i, (flags, body) in self.packets.items():
+                    if i < n:
+                        _xor_into(acc, bytes([flags, len(body)]) + body)
+                flags, length = acc[0], acc[1]
+                self.packets[missing[0]] = (flags, bytes(acc[2:2 + length]))
+                self.stats["recuperados"] += 1
+            out.extend(self._drain(upto=n))
+            return out
+
+        self.stats["recibidos"] += 1
+        self.packets.setdefault(info["idx"], (info["flags"], info["body"]))
+        out.extend(self._drain())
+        return out
+
+
+def simulate(payloads, k: int, loss: float, compress: bool = True, seed: int = 1):
+    """Canal loopback con perdida aleatoria: compara frames RTCM entregados con y sin FEC."""
+    from rtcm import RtcmReassembler
+
+    rng = random.Random(seed)
+    enc = FecEncoder(k=k, compress=compress)
+    dec = FecDecoder()
+    asm = RtcmReassembler()
+    asm_raw = RtcmReassembler()
+    tx_bytes = 0
+    delivered = 0
+    for seq, payload in enumerate(payloads):
+        lost = rng.random() < loss
+        if not lost:
+            delivered += len(asm_raw.push(seq % 256, payload))
+        for pkt in enc.encode(payload):
+            tx_bytes += len(pkt)
+            # El paquete de datos corre la misma suerte que en el enlace sin FEC
+            if lost if not pkt[2] & FLAG_PARIDAD else rng.random() < loss:
+                continue
+            for s, data in dec.push(pkt):
+                asm.push(s, data)
+    for pkt in enc.flush():
+        tx_bytes += len(pkt)
+        for s, data in dec.push(pkt):
+            asm.push(s, data)
+    return {
+        "frames_sin_fec": delivered,
+        "frames_con_fec": asm.stats["frames"],
+        "bytes_v1": sum(len(p) + 4 for p in payloads),
+        "bytes_v2": tx_bytes,
+        "recuperados": dec.stats["recuperados"],
+    }
+
+
+def main():
+    from rtcm import RtcmScheduler, extract_rtcm_frames
+
+    p = argparse.ArgumentParser(description="Simulador loopback del protocolo de correcciones v2")
+    p.add_argument("file", help="captura con RTCM3 (.ubx/.bin de la base o rover_corr)")
+    p.add_argument("--perdida", type=float, default=0.1, help="probabilidad de perder un paquete")
+    p.add_argument("--k", type=int, default=4, help="paquetes de datos por grupo de paridad (0=sin FEC)")
+    p.add_argument("--max-payload", type=int, default=200)
+    p.add_argument("--sin-compresion", action="store_true")
+    p.add_argument("--seed", type=int, default=1)
+    args = p.parse_args()
+
+    frames = extract_rtcm_frames(bytearray(Path(args.file).read_bytes()))
+    if not frames:
+        sys.exit("La captura no contiene frames RTCM3")
+    # Mismo empaquetado que la base, sin limite de airtime ni decimacion
+    sched = RtcmScheduler(args.max_payload, lambda n: 0.0, max_age=float("inf"))
+    for frame in frames:
+        sched.pending.append([0, sched.order, 0.0, None, frame])
+        sched.order += 1
+    payloads = sched.next_packets(0.0, flush=True)
+
+    res = simulate(payloads, args.k, args.perdida, compress=not args.sin_compresion, seed=args.seed)
+    total = len(frames)
+    print(f"frames={total} paquetes={len(payloads)} perdida={100 * args.perdida:.0f}% k={args.k}")
+    print(f"  sin FEC: {res['frames_sin_fec']}/{total} frames ({100 * res['frames_sin_fec'] / total:.1f}%), {res['bytes_v1']} bytes")
+    print(f"  con FEC: {res['frames_con_fec']}/{total} frames ({100 * res['frames_con_fec'] / total:.1f}%), "
+          f"{res['bytes_v2']} bytes, recuperados={res['recuperados']}")
+
+
+if __name__ == "__main__":
+    main()
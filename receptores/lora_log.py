@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# PROYECTO AGROPOST - LOGGING BINARIO CON BUFFER
+# Autores: Carrasco, Hess
+# Descripcion: Escritura de logs en un hilo dedicado con buffers grandes y
+# flush por intervalo (evita miles de escrituras chicas en la SD), formato
+# binario compacto para eventos LoRa y herramienta offline para pasar a CSV.
+#
+# Uso offline:
+#   python lora_log.py rover_lora_1743.lora               -> rover_lora_1743.csv
+#   python lora_log.py base_lora_1743.lora -o salida.csv
+
+import sys
+import math
+import time
+import queue
+import struct
+import argparse
+import threading
+from pathlib import Path
+from datetime import datetime
+
+# --- CONFIGURACION ---
+LOG_BUFFER_SIZE = 256 * 1024   # bytes de buffer del archivo antes de tocar la SD
+LOG_FLUSH_INTERVAL = 2.0       # seg. maximos entre flush a disco
+LOG_MAX_QUEUE = 4096           # items pendientes antes de descartar (nunca bloquea la radio)
+
+# Formato de archivo de eventos LoRa:
+#   cabecera: MAGIC(4) + VERSION(1)
+#   registro: ts(f64) evento(u8) seq(i16, -1=sin dato) rssi(f32) snr(f32) len(u16) + bytes crudos
+LOG_MAGIC = b"AGLR"
+LOG_VERSION = 1
+RECORD_HEADER = struct.Struct("<dBhffH")
+
+EVENTOS = {
+    "TX_CORR": 1,
+    "TX_BEACON": 2,
+    "CORR_OK": 3,
+    "CORR_BADLEN": 4,
+    "RX_OTHER": 5,
+    "TX_FEC": 6,
+    "RX_FEC": 7,
+}
+EVENTOS_POR_CODIGO = {code: name for name, code in EVENTOS.items()}
+
+_STOP = object()
+
+
+class BufferedLogWriter:
+    """Escribe bytes a un archivo desde un hilo propio.
+
+    `write()` solo encola y vuelve enseguida; si la cola se llena el dato se
+    descarta y se cuenta en `dropped` en lugar de frenar al llamador.
+    """
+
+    def __init__(self, path, header: bytes = b"", buffer_size: int = LOG_BUFFER_SIZE,
+                 flush_interval: float = LOG_FLUSH_INTERVAL, max_queue: int = LOG_MAX_QUEUE):
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._fh = open(self.path, "wb", buffering=buffer_size)
+        if header:
+            self._fh.write(header)
+        self._thread = threading.Thread(target=self._run, name=f"log-{self.path.name}", daemon=True)
+        self._thread.start()
+
+    def write(self, data: bytes) -> bool:
+        try:
+            self._queue.put_nowait(data)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                break
+            if item is not None:
+                self._fh.write(item)
+            now = time.monotonic()
+            if now - last_flush >= self.flush_interval:
+                self._fh.flush()
+                last_flush = now
+        self._fh.flush()
+        self._fh.close()
+
+    def close(self, timeout: float = 5.0):
+        """Vacia lo pendiente y cierra el archivo."""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout=timeout)
+
+
+class LoraEventLog(BufferedLogWriter):
+    """Log binario de eventos LoRa (TX/RX) con RSSI, SNR y bytes crudos."""
+
+    def __init__(self, path, **kwargs):
+        super().__init__(path, header=LOG_MAGIC + bytes([LOG_VERSION]), **kwargs)
+
+    def log(self, evento: str, seq: int | None = None, rssi: float | None = None,
+            snr: float | None = None, data: bytes = b"", ts: float | None = None) -> bool:
+        ts = time.time() if ts is None else ts
+        data = bytes(data[:0xFFFF])
+        header = RECORD_HEADER.pack(
+            ts,
+            EVENTOS.get(evento, 0),
+            -1 if seq is None else int(seq),
+            math.nan if rssi is None else float(rssi),
+            math.nan if snr is None else float(snr),
+            len(data),
+        )
+        return self.write(header + data)
+
+
+def iter_records(path):
+    """Recorre un archivo de eventos LoRa devolviendo un dict por registro."""
+    path = Path(path)
+    with open(path, "rb") as fh:
+        head = fh.read(len(LOG_MAGIC) + 1)
+        if len(head) < len(LOG_MAGIC) + 1 or head[:len(LOG_MAGIC)] != LOG_MAGIC:
+            raise ValueError(f"{path} no es un log LoRa de AgroPost")
+        if head[-1] != LOG_VERSION:
+            raise ValueError(f"{path}: version de log no soportada ({head[-1]})")
+        while True:
+            raw = fh.read(RECORD_HEADER.size)
+            if len(raw) < RECORD_HEADER.size:
+                break  # registro truncado al final (corte de energia)
+            ts, code, seq, rssi, snr, length = RECORD_HEADER.unpack(raw)
+            data = fh.read(length)
+            if len(data) < length:
+                break
+            yield {
+                "ts": ts,
+                "evento": EVENTOS_POR_CODIGO.get(code, f"EV{code}"),
+                "seq": None if seq < 0 else seq,
+                "rssi": None if math.isnan(rssi) else rssi,
+                "snr": None if math.isnan(snr) else snr,
+                "data": data,
+            }
+
+
+def _detalle(evento: str, data: bytes) -> str:
+    if evento in ("TX_BEACON", "RX_OTHER"):
+        return data.decode(errors="replace").replace(",", ";").replace("\n", " ")
+    return data.hex()
+
+
+def to_csv(src, dst) -> int:
+    """Convierte un log binario al CSV clasico de las estaciones. Devuelve filas escritas."""
+    rows = 0
+    with open(dst, "w", encoding="utf-8", newline="") as out:
+        out.write("TIMESTAMP,EVENTO,SEQ,LEN,RSSI,SNR,DETALLE\n")
+        for rec in iter_records(src):
+            ts = datetime.fromtimestamp(rec["ts"]).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+            seq = "" if rec["seq"] is None else rec["seq"]
+            rssi = "" if rec["rssi"] is None else f"{rec['rssi']:g}"
+            snr = "" if rec["snr"] is None else f"{rec['snr']:g}"
+            out.write(f"{ts},{rec['evento']},{seq},{len(rec['data'])},{rssi},{snr},{_detalle(rec['evento'], rec['data'])}\n")
+            rows += 1
+    return rows
+
+
+def main():
+    p = argparse.ArgumentParser(description="Convierte logs LoRa binarios (.lora) a CSV")
+    p.add_argument("files", nargs="+", help="archivos .lora de base o rover")
+    p.add_argument("-o", "--output", help="CSV de salida (solo con un archivo de entrada)")
+    args = p.parse_args()
+
+    if args.output and len(args.files) > 1:
+        p.error("--output solo admite un archivo de entrada")
+
+    for name in args.files:
+        src = Path(name)
+        dst = Path(args.output) if args.output else src.with_suffix(".csv")
+        try:
+            rows = to_csv(src, dst)
+        except (OSError, ValueError) as e:
+            print(f"ERROR {src}: {e}", file=sys.stderr)
+            continue
+        print(f"{src} -> {dst} ({rows} registros)")
+
+
+if __name__ == "__main__":
+    main()
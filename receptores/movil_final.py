@@ -11,8 +11,15 @@ import requests
 import subprocess
 import threading
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timezone
 from LoRaRF import SX127x
+from lora_log import BufferedLogWriter, LoraEventLog
+from rtcm import RtcmReassembler
+from lora_fec import CORR_HEADER_V1, CORR_HEADER_V2, FLAG_PARIDAD, FecDecoder
+from posfile import read_last_solution
+from gnss_stream import UBX, GnssStreamDecoder
+from ubx import UbxNavState, cfg_msgout
+from telemetria import LinkTelemetry, TelemetryPusher
 
 # --- CONFIGURACION ---
 SERIAL_PORT = os.getenv("ROVER_GPS_PORT", "/dev/ttyACM0")
@@ -22,6 +29,13 @@ API_HOST = os.getenv("AGROPOST_HOST", "127.0.0.1")
 API_PORT = int(os.getenv("AGROPOST_PORT", "8000"))
 POST_MIN_INTERVAL = float(os.getenv("AGROPOST_POST_INTERVAL", "1.0"))  # seg entre envios al backend
 MIN_FIX_QUALITY = int(os.getenv("AGROPOST_MIN_FIX", "4"))  # 4=RTK Fixed, 5=Float
+MACHINE = os.getenv("AGROPOST_MACHINE") or None  # nombre de la maquina (sesion y canal en el backend)
+CAMPO = os.getenv("AGROPOST_CAMPO") or None
+# Fuente de la posicion publicada: "rtklib" = RTKWorker (el NEO-M8T no resuelve RTK por si mismo),
+# "ubx" = NAV-PVT/HPPOSLLH del receptor, solo para receptores RTK (gen 9, p.ej. ZED-F9P) con ROVER_UBX_CONFIG=1
+POS_SOURCE = os.getenv("ROVER_POS_SOURCE", "rtklib")
+UBX_CONFIG = os.getenv("ROVER_UBX_CONFIG", "0") == "1"  # habilitar NAV-PVT/HPPOSLLH al iniciar (RAM)
+TELEMETRY_INTERVAL = float(os.getenv("AGROPOST_TELEMETRIA_INTERVAL", "5.0"))  # seg. entre envios de metricas (0 = no)
 
 # RTKLIB (usar ejecutables locales)
 RTKLIB_DIR = Path(os.getenv("RTKLIB_DIR", "../RTKLIB")).resolve()
@@ -35,7 +49,8 @@ RTK_CONF_FILE = Path(os.getenv("RTK_CONF_FILE", BASE_DIR / "rtk_conf.conf")).res
 TIMESTAMP_START = datetime.now().strftime('%H%M')
 GPS_FILE = f"rover_gps_{TIMESTAMP_START}.ubx"
 CORR_FILE = f"rover_corr_{TIMESTAMP_START}.bin"
-LORA_FILE = f"rover_lora_{TIMESTAMP_START}.csv"
+LORA_FILE = f"rover_lora_{TIMESTAMP_START}.lora"  # binario, ver lora_log.py para pasar a CSV
+CORR_FLUSH_INTERVAL = 1.0  # seg. entre flush del log de correcciones (lo lee el hilo RTK)
 
 # Parametros LoRa (deben coincidir con la base)
 LORA_FREQ = 433000000
@@ -44,81 +59,71 @@ LORA_BW = 250000
 LORA_CR = 5
 LORA_SYNCWORD = 0x3444
 
-# Protocolo de correcciones
-CORR_HEADER = b"\xAA\xC1"
+# Protocolo de correcciones: se aceptan v1 (0xAA 0xC1) y v2 con FEC (0xAA 0xC2), ver lora_fec.py
 
 
-def nmea_to_deg(raw: str, hemi: str, is_lat: bool = True):
-    """Convierte coordenadas NMEA ddmm.mmmm a grados decimales."""
-    if not raw:
-        return None
-    try:
-        val = float(raw)
-    except ValueError:
-        return None
-    deg_len = 2 if is_lat else 3
-    deg = int(val // (10 ** deg_len))
-    minutes = val - deg * (10 ** deg_len)
-    res = deg + minutes / 60.0
-    if hemi in ("S", "W"):
-        res *= -1
-    return res
-
-
-def parse_gga(line: str):
-    """Extrae lat/lon/fix/sats/hdop desde un mensaje GGA."""
-    if "GGA" not in line:
-        return None
-    parts = line.split(",")
-    if len(parts) < 9:
-        return None
-    lat = nmea_to_deg(parts[2], parts[3], is_lat=True)
-    lon = nmea_to_deg(parts[4], parts[5], is_lat=False)
-    if lat is None or lon is None:
-        return None
-    try:
-        fix = int(parts[6] or 0)
-    except ValueError:
-        fix = 0
-    try:
-        sats = int(parts[7] or 0)
-    except ValueError:
-        sats = 0
-    try:
-        hdop = float(parts[8] or 0.0)
-    except ValueError:
-        hdop = None
-    return {"lat": lat, "lon": lon, "fix": fix, "sats": sats, "hdop": hdop}
-
-
-def parse_gsa(line: str):
-    """Obtiene PDOP aproximado desde GSA (campo 15)."""
-    if "GSA" not in line:
-        return None
-    parts = line.split(",")
-    if len(parts) < 15:
-        return None
-    try:
-        return float(parts[14]) if parts[14] else None
-    except ValueError:
-        return None
-
-
-def post_pos(host: str, port: int, lat: float, lon: float, fix: int | None = 4, pdop: float | None = None, sats: int | None = None):
+def post_pos(host: str, port: int, lat: float, lon: float, fix: int | None = 4, pdop: float | None = None, sats: int | None = None,
+             ts: str | None = None, **extra):
+    """Postea la posicion; `extra` admite alt, h_acc, v_acc, speed y heading."""
     url = f"http://{host}:{port}/api/pos"
     payload = {
-        "ts": datetime.utcnow().isoformat() + "Z",
+        "ts": ts or datetime.utcnow().isoformat() + "Z",
         "lat": float(lat),
         "lon": float(lon),
         "fix_quality": fix,
         "pdop": pdop,
         "sats": sats,
+        "machine": MACHINE,
+        "campo": CAMPO,
     }
+    payload.update(extra)
     r = requests.post(url, json=payload, timeout=5)
     r.raise_for_status()
     return r.json()
 
 
+class PosPublisher:
+    """Publica al backend desde un hilo propio: el bucle serie/LoRa no espera al HTTP.
+
+    Solo se conserva la ultima solucion pendiente; si el backend tarda, las
+    intermedias se descartan.
+    """
+
+    def __init__(self):
+        self.pending = None
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.stop_event = threading.Event()
+        self.last_post = 0.0
+
+    def publish(self, sol: dict):
+        with self.lock:
+            self.pending = sol
+        self.event.set()
+
+    def loop(self):
+        while not self.stop_event.is_set():
+            if not self.event.wait(0.5):
+                continue
+            self.event.clear()
+            with self.lock:
+                sol, self.pending = self.pending, None
+            if sol is None:
+                continue
+            ts = None
+            if sol["ts"] is not None:
+                ts = datetime.fromtimestamp(sol["ts"], timezone.utc).isoformat().replace("+00:00", "Z")
+            try:
+                resp = post_pos(API_HOST, API_PORT, sol["lat"], sol["lon"], fix=sol["fix"], pdop=sol["pdop"],
+                                sats=sol["sats"], ts=ts, alt=sol["alt"], h_acc=sol["h_acc"], v_acc=sol["v_acc"],
+                                speed=sol["speed"], heading=sol["heading"])
+            except Exception as e:
+                print(f"[UBX] ERROR publicando: {e}")
+                continue
+            print(f"[UBX] -> lat={sol['lat']:.9f} lon={sol['lon']:.9f} fixQ={sol['fix']} hAcc={sol['h_acc']:.3f}m "
+                  f"v={sol['speed']:.2f}m/s rumbo={sol['heading']:.1f} delivered={resp.get('delivered')}")
+
+
 def run_convbin(input_path: Path, fmt: str, out_dir: Path, prefix: str):
     """Ejecuta convbin para generar RINEX desde archivo raw."""
     out_dir.mkdir(parents=True, exist_ok=True)
@@ -158,40 +163,24 @@ def run_rnx2rtkp(rover_obs: Path, base_obs: Path, rover_nav: Path | None, base_n
     subprocess.run(cmd, check=True, cwd=str(RTKLIB_DIR))
 
 
-def parse_rtk_solution(pos_file: Path):
-    """Lee el ultimo fix del archivo .pos de RTKLIB."""
-    if not pos_file.exists():
-        return None
-    lines = pos_file.read_text().splitlines()
-    for line in reversed(lines):
-        if not line.strip() or line.startswith("%"):
-            continue
-        cols = line.split()
-        if len(cols) < 7:
-            continue
-        try:
-            lat = float(cols[2])
-            lon = float(cols[3])
-            fix_q = int(cols[5])
-            sats = int(cols[6])
-        except Exception:
-            continue
-        # Mapear calidad RTKLIB -> fix_quality del backend
-        # RTKLIB Q: 1=Fix, 2=Float, 3=SBAS, 4=DGPS, 5=Single, 6=PPP
-        fix_quality = 4 if fix_q == 1 else 5 if fix_q == 2 else 1
-        return {"lat": lat, "lon": lon, "fix": fix_quality, "rtk_q": fix_q, "sats": sats}
-    return None
-
-
 class RTKWorker:
     """Procesa RTK en segundo plano usando RTKLIB y publica al backend."""
 
-    def __init__(self, raw_path: Path, corr_path: Path):
+    def __init__(self, raw_path: Path, corr_path: Path, telemetry: LinkTelemetry | None = None):
         self.raw_path = raw_path.resolve()
         self.corr_path = corr_path.resolve()
         self.tmp_dir = RTK_TMP_DIR
         self.stop_event = threading.Event()
         self.last_post = 0.0
+        self.telemetry = telemetry
+
+    def _timed(self, name: str, fn, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if self.telemetry is not None:
+                self.telemetry.duration(name, time.perf_counter() - t0)
 
     def loop(self):
         if not CONVBIN_EXE.exists() or not RNX2RTKP_EXE.exists():
@@ -228,9 +217,9 @@ class RTKWorker:
                 pass
 
         # 1) RINEX de rover (UBX crudo)
-        run_convbin(self.raw_path, "ubx", self.tmp_dir, "rover")
+        self._timed("convbin_rover", run_convbin, self.raw_path, "ubx", self.tmp_dir, "rover")
         # 2) RINEX de base (RTCM recibido)
-        run_convbin(self.corr_path, "rtcm3", self.tmp_dir, "base")
+        self._timed("convbin_base", run_convbin, self.corr_path, "rtcm3", self.tmp_dir, "base")
         # 3) Solucion RTK
         nav_extras = [
             self.tmp_dir / "base.gnav",
@@ -240,11 +229,14 @@ class RTKWorker:
             self.tmp_dir / "rover.lnav",
             self.tmp_dir / "rover.sbs",
         ]
-        run_rnx2rtkp(rover_obs, base_obs, rover_nav, base_nav, pos_out, RTK_CONF_FILE, nav_extras=nav_extras)
+        self._timed("rnx2rtkp", run_rnx2rtkp, rover_obs, base_obs, rover_nav, base_nav, pos_out, RTK_CONF_FILE,
+                    nav_extras=nav_extras)
 
-        sol = parse_rtk_solution(pos_out)
+        sol = read_last_solution(pos_out)
         if not sol:
             return
+        if self.telemetry is not None:
+            self.telemetry.fix(sol["fix"])
         now = time.time()
         if sol["fix"] >= MIN_FIX_QUALITY and (now - self.last_post) >= POST_MIN_INTERVAL:
             resp = post_pos(API_HOST, API_PORT, sol["lat"], sol["lon"], fix=sol["fix"], pdop=None, sats=sol["sats"])
@@ -274,26 +266,59 @@ def main():
         print(f"Error abriendo GPS: {e}")
         return
 
-    f_gps = open(GPS_FILE, "wb")
-    f_corr = open(CORR_FILE, "wb")
-    f_lora = open(LORA_FILE, "w")
-    f_lora.write("TIMESTAMP,EVENTO,SEQ,LEN,RSSI,SNR,DETALLE\n")
+    # Los logs se escriben desde hilos propios: nunca frenan la recepcion LoRa
+    f_gps = BufferedLogWriter(GPS_FILE, flush_interval=CORR_FLUSH_INTERVAL)
+    f_corr = BufferedLogWriter(CORR_FILE, flush_interval=CORR_FLUSH_INTERVAL)
+    f_lora = LoraEventLog(LORA_FILE)
 
-    # Lanzar hilo de RTK (procesa archivos y publica al backend)
-    rtk_worker = RTKWorker(Path(GPS_FILE), Path(CORR_FILE))
+    if UBX_CONFIG:
+        gps_serial.write(cfg_msgout())
+
+    # Metricas de enlace y RTK publicadas al backend desde un hilo propio
+    telemetry = LinkTelemetry("rover")
+    tel_pusher = TelemetryPusher(telemetry, API_HOST, API_PORT, TELEMETRY_INTERVAL)
+    tel_thread = tel_pusher.start()
+
+    # Publicacion: NAV-PVT del receptor o hilo de RTKLIB (procesa archivos y publica al backend)
+    rtk_worker = RTKWorker(Path(GPS_FILE), Path(CORR_FILE), telemetry)
     rtk_thread = threading.Thread(target=rtk_worker.loop, daemon=True)
-    rtk_thread.start()
+    publisher = PosPublisher()
+    pub_thread = threading.Thread(target=publisher.loop, daemon=True)
+    if POS_SOURCE == "rtklib":
+        rtk_thread.start()
+    else:
+        pub_thread.start()
 
     print(f"=== AGROPOST ROVER INICIADO ===")
     print(f"GPS Log   > {GPS_FILE}")
     print(f"Corr Log  > {CORR_FILE}")
     print(f"LoRa Log  > {LORA_FILE}")
-    print(f"Publicando posiciones hacia http://{API_HOST}:{API_PORT}/api/pos cada {POST_MIN_INTERVAL}s")
+    print(f"Publicando posiciones ({POS_SOURCE}) hacia http://{API_HOST}:{API_PORT}/api/pos cada {POST_MIN_INTERVAL}s")
     print("Esperando correcciones y RTK fix...")
 
-    nmea_buffer = ""
-    last_pdop = None
-    last_gga = None
+    gnss = GnssStreamDecoder()
+    nav = UbxNavState()
+    reassembler = RtcmReassembler()
+    fec = FecDecoder()
+    corr_start = time.time()
+
+    def print_corr(ts: str, seq, length: int, rssi, snr):
+        st = reassembler.stats
+        rate = st["bytes"] / max(time.time() - corr_start, 1e-3)
+        age = reassembler.last_age
+        age_txt = f"{age:.1f}s" if age is not None else "?"
+        print(f"[{ts}] Rx CORR seq={seq} len={length} RSSI={rssi}dBm SNR={snr} edad={age_txt} {rate:.0f}B/s "
+              f"perdidos={st['perdidos']} ({100 * reassembler.packet_loss:.1f}%) recuperados={fec.stats['recuperados']} "
+              f"frames={st['frames']} incompletos={st['frames_incompletos']} crc={st['crc_error']} resync={st['resync']}")
+
+    def forward_corr(seq: int, payload: bytes):
+        # Solo frames RTCM completos y con CRC valido llegan al receptor y a RTKLIB
+        frames = reassembler.push(seq, payload, time.time())
+        for frame in frames:
+            gps_serial.write(frame)
+            f_corr.write(frame)
+        if frames:
+            telemetry.correction_age(reassembler.last_age)
 
     try:
         while True:
@@ -302,23 +327,18 @@ def main():
                 data = gps_serial.read(gps_serial.in_waiting)
                 if data:
                     f_gps.write(data)
-                    text = data.decode(errors="ignore")
-                    nmea_buffer += text
-
-                    # Procesar NMEA por lineas para obtener fix RTK
-                    while "\n" in nmea_buffer:
-                        line, nmea_buffer = nmea_buffer.split("\n", 1)
-                        line = line.strip()
-                        if not line:
-                            continue
-                        if "GGA" in line:
-                            gga = parse_gga(line)
-                            if gga:
-                                last_gga = gga
-                        elif "GSA" in line:
-                            pdop = parse_gsa(line)
-                            if pdop is not None:
-                                last_pdop = pdop
+
+                    # Frames UBX validados: NAV-PVT alimenta la telemetria y, con POS_SOURCE=ubx, se publica
+                    for kind, frame in gnss.feed(data):
+                        if kind == UBX:
+                            sol = nav.push(frame)
+                            if sol:
+                                telemetry.fix(sol["fix"])
+                            now = time.time()
+                            if (sol and POS_SOURCE != "rtklib" and sol["fix"] >= MIN_FIX_QUALITY
+                                    and now - publisher.last_post >= POST_MIN_INTERVAL):
+                                publisher.last_post = now
+                                publisher.publish(sol)
 
             # 2) Escuchar LoRa (correcciones desde base)
             lora.request()
@@ -335,36 +355,40 @@ def main():
                 snr = lora.packetSnr()
 
                 evento = "RX_OTHER"
-                seq = ""
-                detalle = ""
+                seq = None
+                detalle = packet
                 length = len(packet)
 
-                if packet.startswith(CORR_HEADER) and length >= 4:
+                if packet.startswith(CORR_HEADER_V2):
+                    evento = "RX_FEC"
+                    for seq, payload in fec.push(packet):
+                        forward_corr(seq, payload)
+                        f_lora.log("CORR_OK", seq=seq, rssi=rssi, snr=snr, data=payload)
+                    seq = packet[3] if length > 3 else None
+                    # La paridad repite el seq del grupo: no cuenta para los huecos
+                    data_seq = seq if length > 3 and not packet[2] & FLAG_PARIDAD else None
+                    telemetry.packet(length, seq=data_seq, rssi=rssi, snr=snr)
+                    telemetry.set(perdida_post_fec=round(reassembler.packet_loss, 4),
+                                  recuperados_fec=fec.stats["recuperados"])
+                    print_corr(ts, seq, length, rssi, snr)
+                elif packet.startswith(CORR_HEADER_V1) and length >= 4:
                     seq = packet[2]
+                    telemetry.packet(length, seq=seq, rssi=rssi, snr=snr)
                     expected_len = packet[3]
                     payload = packet[4:4 + expected_len]
                     if len(payload) != expected_len:
                         evento = "CORR_BADLEN"
-                        detalle = packet.hex()
                     else:
-                        # Enviar correccion al receptor GNSS local
-                        gps_serial.write(payload)
-                        f_corr.write(payload)
-                        f_corr.flush()
+                        forward_corr(seq, payload)
                         evento = "CORR_OK"
-                        detalle = payload.hex()
-                    print(f"[{ts}] Rx CORR seq={seq} len={len(payload)} RSSI={rssi}dBm SNR={snr}")
+                        detalle = payload
+                    print_corr(ts, seq, len(payload), rssi, snr)
                 else:
                     # Beacon u otro mensaje
-                    evento = "RX_OTHER"
-                    try:
-                        detalle = packet.decode(errors="replace")
-                    except Exception:
-                        detalle = packet.hex()
-                    print(f"[{ts}] Rx {detalle} RSSI={rssi}dBm SNR={snr}")
+                    telemetry.packet(length, rssi=rssi, snr=snr)
+                    print(f"[{ts}] Rx {packet.decode(errors='replace')} RSSI={rssi}dBm SNR={snr}")
 
-                f_lora.write(f"{ts},{evento},{seq},{length},{rssi},{snr},{detalle}\n")
-                f_lora.flush()
+                f_lora.log(evento, seq=seq, rssi=rssi, snr=snr, data=detalle)
 
             time.sleep(0.001)
 
@@ -372,11 +396,21 @@ def main():
         print("\nDeteniendo...")
     finally:
         rtk_worker.stop_event.set()
-        rtk_thread.join(timeout=2.0)
+        publisher.stop_event.set()
+        tel_pusher.stop_event.set()
+        if rtk_thread.is_alive():
+            rtk_thread.join(timeout=2.0)
+        if pub_thread.is_alive():
+            pub_thread.join(timeout=2.0)
+        if tel_thread is not None:
+            tel_thread.join(timeout=2.0)
         f_gps.close()
         f_corr.close()
         f_lora.close()
         gps_serial.close()
+        dropped = f_gps.dropped + f_corr.dropped + f_lora.dropped
+        if dropped:
+            print(f"AVISO: log saturado, {dropped} escrituras descartadas")
         print("Archivos cerrados correctamente.")
 
 
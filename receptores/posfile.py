@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# PROYECTO AGROPOST - LECTOR DE SOLUCIONES .POS DE RTKLIB
+# Autores: Carrasco, Hess
+# Descripcion: Lectura rapida de archivos .pos (formato lat/lon/altura):
+# ultima solucion leyendo solo el final del archivo, y carga completa por
+# bloques a arrays estructurados de NumPy para estadisticas y filtros
+# vectorizados.
+#
+# Uso:
+#   python posfile.py solucion.pos     -> epocas, % FIX/FLOAT y duracion
+
+import os
+import re
+import sys
+import calendar
+from pathlib import Path
+
+import numpy as np
+
+# Calidad RTKLIB (columna Q)
+Q_FIX = 1
+Q_FLOAT = 2
+Q_SBAS = 3
+Q_DGPS = 4
+Q_SINGLE = 5
+Q_PPP = 6
+
+POS_DTYPE = np.dtype([
+    ("time", "f8"),     # seg. desde 1970 en la escala de tiempo del archivo (GPST por defecto)
+    ("lat", "f8"),
+    ("lon", "f8"),
+    ("height", "f8"),
+    ("q", "i1"),
+    ("ns", "i2"),
+    ("sdn", "f4"),
+    ("sde", "f4"),
+    ("sdu", "f4"),
+])
+
+GPS_EPOCH_UNIX = calendar.timegm((1980, 1, 6, 0, 0, 0))
+TAIL_BLOCK = 4096
+CHUNK_LINES = 65536
+CALENDAR_TIME = re.compile(r"\d{4}/\d\d/\d\d \d\d:\d\d:\d\d\.\d{3}\s")
+
+
+def rtklib_to_fix_quality(q: int) -> int:
+    """Mapea Q de RTKLIB al fix_quality NMEA que usa el backend (4=Fix, 5=Float)."""
+    return 4 if q == Q_FIX else 5 if q == Q_FLOAT else 1
+
+
+def _parse_line(line: str):
+    cols = line.split()
+    if len(cols) < 7 or line.startswith("%"):
+        return None
+    try:
+        lat = float(cols[2])
+        lon = float(cols[3])
+        height = float(cols[4])
+        q = int(cols[5])
+        sats = int(cols[6])
+    except ValueError:
+        return None
+    return {"lat": lat, "lon": lon, "height": height, "fix": rtklib_to_fix_quality(q), "rtk_q": q, "sats": sats}
+
+
+def read_last_solution(pos_file):
+    """Ultima solucion valida del .pos leyendo bloques desde el final (no todo el archivo)."""
+    pos_file = Path(pos_file)
+    try:
+        fh = open(pos_file, "rb")
+    except FileNotFoundError:
+        return None
+    with fh:
+        end = fh.seek(0, os.SEEK_END)
+        block = TAIL_BLOCK
+        tail = b""
+        pos = end
+        while pos > 0:
+            step = min(block, pos)
+            pos -= step
+            fh.seek(pos)
+            tail = fh.read(step) + tail
+            lines = tail.split(b"\n")
+            # La primera linea puede estar cortada salvo que se haya llegado al inicio
+            candidates = lines if pos == 0 else lines[1:]
+            for raw in reversed(candidates):
+                sol = _parse_line(raw.decode(errors="ignore"))
+                if sol:
+                    return sol
+            tail = lines[0] if pos else b""
+            block *= 2
+    return None
+
+
+def _parse_times(text_lines, calendar_time: bool):
+    if calendar_time:
+        # "yyyy/mm/dd hh:mm:ss.sss" de ancho fijo: digitos como matriz uint8
+        head = np.array([ln[:23] for ln in text_lines], dtype="S23")
+        d = head.view(np.uint8).reshape(-1, 23).astype(np.int64) - 48
+        year = d[:, 0] * 1000 + d[:, 1] * 100 + d[:, 2] * 10 + d[:, 3]
+        month = d[:, 5] * 10 + d[:, 6]
+        day = d[:, 8] * 10 + d[:, 9]
+        hour = d[:, 11] * 10 + d[:, 12]
+        minute = d[:, 14] * 10 + d[:, 15]
+        sec = d[:, 17] * 10 + d[:, 18] + (d[:, 20] * 100 + d[:, 21] * 10 + d[:, 22]) / 1000.0
+        days = (np.array(year - 1970, dtype="datetime64[Y]").astype("datetime64[M]") + (month - 1)).astype("datetime64[D]")
+        days = (days + (day - 1)).astype(np.int64)
+        return days * 86400.0 + hour * 3600 + minute * 60 + sec
+    week_tow = np.loadtxt(text_lines, usecols=(0, 1), ndmin=2)
+    return GPS_EPOCH_UNIX + week_tow[:, 0] * 604800.0 + week_tow[:, 1]
+
+
+def _valid_line(line: str, calendar_time: bool) -> bool:
+    """Linea con las 10 columnas numericas (p.ej. no la ultima cortada por RTKLIB a medio escribir)."""
+    cols = line.split()
+    if len(cols) < 10 or (calendar_time and not CALENDAR_TIME.match(line)):
+        return False
+    try:
+        for c in cols[2 if calendar_time else 0:10]:
+            float(c)
+    except ValueError:
+        return False
+    return True
+
+
+def _chunk_to_array(text_lines, calendar_time: bool):
+    # Ambos formatos de tiempo ocupan 2 columnas: lat lon h Q ns sdn sde sdu desde la 3ra
+    try:
+        cols = np.loadtxt(text_lines, usecols=range(2, 10), ndmin=2)
+    except ValueError:
+        # Alguna linea mal formada: se descartan solo esas y se vuelve a parsear el bloque
+        text_lines = [ln for ln in text_lines if _valid_line(ln, calendar_time)]
+        if not text_lines:
+            return np.empty(0, dtype=POS_DTYPE)
+        cols = np.loadtxt(text_lines, usecols=range(2, 10), ndmin=2)
+    out = np.empty(len(text_lines), dtype=POS_DTYPE)
+    out["time"] = _parse_times(text_lines, calendar_time)
+    out["lat"], out["lon"], out["height"] = cols[:, 0], cols[:, 1], cols[:, 2]
+    out["q"], out["ns"] = cols[:, 3], cols[:, 4]
+    out["sdn"], out["sde"], out["sdu"] = cols[:, 5], cols[:, 6], cols[:, 7]
+    return out
+
+
+def iter_pos_chunks(pos_file, chunk_lines: int = CHUNK_LINES):
+    """Recorre el .pos por bloques de `chunk_lines` epocas, cada uno como array POS_DTYPE."""
+    calendar_time = None
+    batch = []
+    with open(pos_file, "r", errors="ignore") as fh:
+        for line in fh:
+            if line.startswith("%") or not line.strip():
+                continue
+            if calendar_time is None:
+                calendar_time = "/" in line.split(None, 1)[0]
+            batch.append(line)
+            if len(batch) >= chunk_lines:
+                yield _chunk_to_array(batch, calendar_time)
+                batch = []
+    if batch:
+        yield _chunk_to_array(batch, calendar_time)
+
+
+def load_pos(pos_file) -> np.ndarray:
+    """Carga el .pos completo como array estructurado POS_DTYPE."""
+    chunks = list(iter_pos_chunks(pos_file))
+    return np.concatenate(chunks) if chunks else np.empty(0, dtype=POS_DTYPE)
+
+
+def filter_quality(sol: np.ndarray, max_q: int = Q_FLOAT) -> np.ndarray:
+    """Epocas con Q entre 1 y `max_q` (por defecto Fix y Float)."""
+    return sol[(sol["q"] >= Q_FIX) & (sol["q"] <= max_q)]
+
+
+def fix_stats(sol: np.ndarray) -> dict:
+    """Epocas, cantidad y proporcion de FIX/FLOAT y duracion de una solucion."""
+    n = len(sol)
+    fixed = int(np.count_nonzero(sol["q"] == Q_FIX))
+    floated = int(np.count_nonzero(sol["q"] == Q_FLOAT))
+    duration = float(sol["time"][-1] - sol["time"][0]) if n else 0.0
+    return {
+        "epocas": n,
+        "fix": fixed,
+        "float": floated,
+        "fix_ratio": round(fixed / n, 4) if n else 0.0,
+        "duracion_s": duration,
+    }
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Uso: python posfile.py solucion.pos [...]")
+        return
+    for name in sys.argv[1:]:
+        stats = fix_stats(load_pos(name))
+        print(f"{name}: {stats['epocas']} epocas, FIX {100 * stats['fix_ratio']:.1f}%, "
+              f"FLOAT {stats['float']}, duracion {stats['duracion_s']:.0f}s")
+
+
+if __name__ == "__main__":
+    main()
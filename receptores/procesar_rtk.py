@@ -1,128 +1,385 @@
-import subprocess
+#!/usr/bin/env python3
+# PROYECTO AGROPOST - POST-PROCESO PPK
+# Autores: Carrasco, Hess
+# Descripcion: Convierte logs .ubx de base y rover a RINEX y calcula la solucion
+# cinematica con RTKLIB. Procesa una sesion o un lote completo de campaña en
+# paralelo, cada sesion en su propio directorio temporal. Las sesiones largas
+# pueden partirse en ventanas de tiempo solapadas que se resuelven en paralelo.
+#
+# Uso:
+#   python procesar_rtk.py sesion base_gps_1743.ubx rover_gps_1743.ubx --abrir
+#   python procesar_rtk.py sesion base_gps_1743.ubx rover_gps_1743.ubx --ventana 20 -j 4
+#   python procesar_rtk.py lote ./logs -o ./ppk -j 4
+
 import os
 import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+import tempfile
+from pathlib import Path
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from posfile import fix_stats, load_pos
 
 # --- CONFIGURACIÓN ---
-BASE_GPS_FILE = "base_gps_1743.ubx"
-ROVER_GPS_FILE = "rover_gps_1743.ubx"
-
-# Ejecutables (Sin "./")
-CONVBIN_EXE = "convbin.exe"
-RNX2RTKP_EXE = "rnx2rtkp.exe"
-RTKPLOT_EXE = "rtkplot.exe"
-POS2KML_EXE = "pos2kml.exe"
-RTK_CONF_FILE = "rtk_conf.conf"
-
-SOLUTION_FILE = "solucion_final.pos"
-
-def clean_previous_files():
-    print("Limpiando archivos anteriores...")
-    # Agregamos .sbs a la lista de limpieza
-    extensions = [".obs", ".nav", ".gnav", ".lnav", ".qnav", ".hnav", ".sbs"]
-    prefixes = ["base", "rover"]
-    
-    files_to_delete = [SOLUTION_FILE, f"{SOLUTION_FILE}.kml"]
-    
-    for pre in prefixes:
-        for ext in extensions:
-            files_to_delete.append(pre + ext)
-            
-    for f in files_to_delete:
-        if os.path.exists(f):
-            try:
-                os.remove(f)
-            except: pass
+BASE_DIR = Path(__file__).resolve().parent
+RTKLIB_DIR = Path(os.getenv("RTKLIB_DIR", BASE_DIR.parent / "RTKLIB")).resolve()
+EXE_SUFFIX = ".exe" if os.name == "nt" else ""
+CONVBIN_EXE = RTKLIB_DIR / f"convbin{EXE_SUFFIX}"
+RNX2RTKP_EXE = RTKLIB_DIR / f"rnx2rtkp{EXE_SUFFIX}"
+RTKPLOT_EXE = RTKLIB_DIR / f"rtkplot{EXE_SUFFIX}"
+POS2KML_EXE = RTKLIB_DIR / f"pos2kml{EXE_SUFFIX}"
+RTK_CONF_FILE = Path(os.getenv("RTK_CONF_FILE", BASE_DIR / "rtk_conf.conf")).resolve()
+
+MATCH_TOLERANCE_MIN = 30    # minutos maximos entre inicio de base y rover para emparejar
+WINDOW_OVERLAP_MIN = 5      # minutos de solape entre ventanas (convergencia del filtro)
+SUMMARY_FILE = "resumen.json"
+
+# Archivos de navegacion que genera convbin por prefijo
+NAV_EXTS = [".nav", ".gnav", ".lnav", ".sbs"]
+
 
-def run_command(command, description):
-    print(f"\n--- {description} ---")
+def run_command(command, description, log=None):
+    """Ejecuta un comando externo. Con `log` la salida va a ese archivo en lugar de la consola."""
+    if log is None:
+        print(f"\n--- {description} ---")
     try:
-        subprocess.run(command, check=True, shell=False) 
-        print("OK.")
+        if log is None:
+            subprocess.run([str(c) for c in command], check=True, shell=False)
+            print("OK.")
+        else:
+            log.write(f"--- {description} ---\n")
+            log.flush()
+            subprocess.run([str(c) for c in command], check=True, shell=False, stdout=log, stderr=subprocess.STDOUT)
         return True
     except subprocess.CalledProcessError:
-        print(f"ERROR CRÍTICO en: {description}")
-        return False
+        msg = f"ERROR CRÍTICO en: {description}"
     except FileNotFoundError:
-        print(f"ERROR: No se encontró el programa '{command[0]}'.")
-        return False
+        msg = f"ERROR: No se encontró el programa '{command[0]}'."
+    if log is None:
+        print(msg)
+    else:
+        log.write(msg + "\n")
+    return False
 
-def main():
-    print("=== PROCESAMIENTO AGROPOST RTK (FULL GNSS + SBAS) ===")
-    
-    clean_previous_files()
-
-    # 1. CONVERSIÓN A RINEX
-    # AHORA INCLUIMOS TODOS LOS SISTEMAS PARA EVITAR ERRORES DE NOMBRE
-    print("\n1. Convirtiendo archivos .ubx a RINEX...")
-    
-    # Comando BASE
-    cmd_conv_base = [
-        CONVBIN_EXE, "-r", "ubx", 
-        "-o", "base.obs",   # GPS Observaciones
-        "-n", "base.nav",   # GPS Nav
-        "-g", "base.gnav",  # GLONASS Nav
-        "-l", "base.lnav",  # Galileo Nav
-        "-s", "base.sbs",   # SBAS Messages (Corrección del error î╩GwLΘ↓)
-        BASE_GPS_FILE
-    ]
-    if not run_command(cmd_conv_base, "Convirtiendo BASE"):
-        sys.exit(1)
-    
-    # Comando ROVER
-    cmd_conv_rover = [
+
+def convbin_cmd(input_path: Path, out_dir: Path, prefix: str):
+    return [
         CONVBIN_EXE, "-r", "ubx",
-        "-o", "rover.obs",
-        "-n", "rover.nav",
-        "-g", "rover.gnav",
-        "-l", "rover.lnav",
-        "-s", "rover.sbs",  # SBAS Messages
-        ROVER_GPS_FILE
+        "-o", out_dir / f"{prefix}.obs",    # Observaciones
+        "-n", out_dir / f"{prefix}.nav",    # GPS Nav
+        "-g", out_dir / f"{prefix}.gnav",   # GLONASS Nav
+        "-l", out_dir / f"{prefix}.lnav",   # Galileo Nav
+        "-s", out_dir / f"{prefix}.sbs",    # SBAS
+        input_path,
     ]
-    if not run_command(cmd_conv_rover, "Convirtiendo ROVER"):
-        sys.exit(1)
 
-    # 2. PROCESAMIENTO PPK
-    print("\n2. Calculando solución cinemática (PPK)...")
-    
-    cmd_ppk = [
-        RNX2RTKP_EXE,
-        "-k", RTK_CONF_FILE,
-        "-o", SOLUTION_FILE,
-        "rover.obs",
-        "base.obs",
-        "base.nav"
-    ]
-    
-    # Agregamos todos los archivos extra de navegación disponibles
-    # para que el motor matemático tenga la mayor cantidad de datos posible
-    extra_navs = ["base.gnav", "base.lnav", "base.sbs", 
-                  "rover.nav", "rover.gnav", "rover.lnav", "rover.sbs"]
-    
-    for nav in extra_navs:
-        if os.path.exists(nav):
-            cmd_ppk.append(nav)
-
-    if not run_command(cmd_ppk, "Procesamiento Matemático RTK"):
-        sys.exit(1)
 
-    # 3. GENERAR KML
-    print("\n3. Generando mapa para Google Earth...")
-    if run_command([POS2KML_EXE, "-c", "2", SOLUTION_FILE], "Creando KML"):
-        kml_file = SOLUTION_FILE + ".kml"
-        if os.path.exists(kml_file):
-            print(f"Abriendo Google Earth...")
+def rnx2rtkp_cmd(work: Path, out_pos: Path, extra_args=()):
+    cmd = [RNX2RTKP_EXE, "-k", RTK_CONF_FILE, *extra_args, "-o", out_pos, work / "rover.obs", work / "base.obs"]
+    # Todos los archivos de navegacion disponibles para el motor de RTKLIB
+    for pre in ("base", "rover"):
+        for ext in NAV_EXTS:
+            nav = work / f"{pre}{ext}"
+            if nav.exists():
+                cmd.append(nav)
+    return cmd
+
+
+def pos_summary(pos_file: Path) -> dict:
+    """Epocas, porcentaje de FIX y duracion de una solucion .pos."""
+    return fix_stats(load_pos(pos_file))
+
+
+def _rinex_time(fields) -> datetime | None:
+    try:
+        y, mo, d, h, mi = (int(float(v)) for v in fields[:5])
+        sec = float(fields[5])
+    except (ValueError, IndexError):
+        return None
+    if y < 100:
+        y += 2000 if y < 80 else 1900
+    return datetime(y, mo, d, h, mi) + timedelta(seconds=sec)
+
+
+def rinex_obs_span(obs_file: Path):
+    """(primera, ultima) epoca de un RINEX de observacion (v2 o v3)."""
+    first = last = None
+    in_header = True
+    with open(obs_file, "r", errors="ignore") as fh:
+        for line in fh:
+            if in_header:
+                label = line[60:].strip()
+                if label == "TIME OF FIRST OBS":
+                    first = _rinex_time(line[:43].split())
+                elif label == "TIME OF LAST OBS":
+                    last = _rinex_time(line[:43].split())
+                elif label == "END OF HEADER":
+                    in_header = False
+                    if first and last:
+                        break
+                continue
+            if line.startswith(">"):                      # RINEX 3
+                t = _rinex_time(line[1:].split())
+            elif len(line) > 29 and line[0] == " " and line[28] in "0123456" and line[3] == " ":  # RINEX 2
+                t = _rinex_time(line[:26].split())
+            else:
+                continue
+            if t is not None:
+                first = first or t
+                last = t
+    return first, last
+
+
+def time_windows(first: datetime, last: datetime, window_min: float, overlap_min: float):
+    """Ventanas [inicio, fin] de `window_min` minutos con `overlap_min` de solape a cada lado."""
+    windows = []
+    step = timedelta(minutes=window_min)
+    pad = timedelta(minutes=overlap_min)
+    t = first
+    while t < last:
+        windows.append((max(first, t - pad), min(last, t + step + pad)))
+        t += step
+    return windows or [(first, last)]
+
+
+def _pos_epochs(pos_file: Path):
+    """Cabecera y lineas de epoca de un .pos, con su instante."""
+    header, epochs = [], []
+    fmt = "%Y/%m/%d %H:%M:%S.%f"
+    with open(pos_file, "r", errors="ignore") as fh:
+        for line in fh:
+            if line.startswith("%"):
+                header.append(line)
+                continue
+            cols = line.split()
+            if len(cols) < 7:
+                continue
             try:
-                os.startfile(kml_file)
-            except: pass
+                epochs.append((datetime.strptime(f"{cols[0]} {cols[1]}", fmt), int(cols[5]), line))
+            except ValueError:
+                continue
+    return header, epochs
+
+
+def stitch_pos(parts, out_pos: Path):
+    """Une las soluciones por ventana: por epoca queda la de mejor Q y, a igual Q,
+    la mas alejada de los bordes de su ventana (donde el filtro ya convergio)."""
+    best = {}
+    header = None
+    for (start, end), pos_file in parts:
+        if not pos_file.exists():
+            continue
+        head, epochs = _pos_epochs(pos_file)
+        header = header or head
+        for t, q, line in epochs:
+            margin = min((t - start).total_seconds(), (end - t).total_seconds())
+            rank = (q if q > 0 else 99, -margin)
+            if t not in best or rank < best[t][0]:
+                best[t] = (rank, line)
+    with open(out_pos, "w") as out:
+        out.writelines(header or [])
+        for t in sorted(best):
+            out.write(best[t][1])
+    return len(best)
+
+
+def solve_windows(work: Path, out_pos: Path, window_min: float, overlap_min: float, jobs: int, log) -> bool:
+    """Resuelve la sesion por ventanas de tiempo en paralelo y las une en `out_pos`."""
+    first, last = rinex_obs_span(work / "rover.obs")
+    if first is None or last is None:
+        return run_command(rnx2rtkp_cmd(work, out_pos), "Procesamiento PPK", log)
+    windows = time_windows(first, last, window_min, overlap_min)
+    fmt = lambda t: [t.strftime("%Y/%m/%d"), t.strftime("%H:%M:%S")]
+    parts = []
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = []
+        for i, (start, end) in enumerate(windows):
+            part = work / f"ventana_{i:03d}.pos"
+            cmd = rnx2rtkp_cmd(work, part, extra_args=["-ts", *fmt(start), "-te", *fmt(end)])
+            futures.append(pool.submit(run_command, cmd, f"PPK ventana {i + 1}/{len(windows)} {start:%H:%M}-{end:%H:%M}", log))
+            parts.append(((start, end), part))
+        ok = all(f.result() for f in futures)
+    return ok and stitch_pos(parts, out_pos) > 0
 
-    # 4. ABRIR GRÁFICO
-    if os.path.exists(SOLUTION_FILE):
-        print("\n4. Abriendo gráfico de análisis...")
+
+def missing_inputs(base_file, rover_file) -> list:
+    """Archivos de entrada de una sesion (logs y configuracion RTK) que no existen."""
+    return [str(p) for p in (Path(base_file), Path(rover_file), RTK_CONF_FILE) if not p.is_file()]
+
+
+def process_session(base_file, rover_file, out_dir, force: bool = False, window_min: float = 0,
+                    overlap_min: float = WINDOW_OVERLAP_MIN, jobs: int = 1) -> dict:
+    """Pipeline convbin + rnx2rtkp de una sesion en un directorio temporal propio.
+
+    Con `window_min` > 0 la solucion se calcula por ventanas de tiempo en `jobs` procesos.
+    """
+    base_file, rover_file, out_dir = Path(base_file), Path(rover_file), Path(out_dir)
+    pos_out = out_dir / f"{rover_file.stem}.pos"
+    result = {"sesion": rover_file.stem, "base": str(base_file), "rover": str(rover_file), "pos": str(pos_out)}
+    missing = missing_inputs(base_file, rover_file)
+    if missing:
+        result.update(estado="error", detalle="no existe: " + ", ".join(missing))
+        return result
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    newest_input = max(base_file.stat().st_mtime, rover_file.stat().st_mtime, RTK_CONF_FILE.stat().st_mtime)
+    if not force and pos_out.exists() and pos_out.stat().st_mtime > newest_input:
+        result.update(estado="al dia", **pos_summary(pos_out))
+        return result
+
+    t0 = time.time()
+    with tempfile.TemporaryDirectory(prefix=f"ppk_{rover_file.stem}_", dir=out_dir) as tmp, \
+            open(out_dir / f"{rover_file.stem}.log", "w") as log:
+        work = Path(tmp)
+        ok = (run_command(convbin_cmd(base_file, work, "base"), "Convirtiendo BASE", log)
+              and run_command(convbin_cmd(rover_file, work, "rover"), "Convirtiendo ROVER", log))
+        if ok and window_min > 0:
+            ok = solve_windows(work, work / "solucion.pos", window_min, overlap_min, jobs, log)
+        elif ok:
+            ok = run_command(rnx2rtkp_cmd(work, work / "solucion.pos"), "Procesamiento PPK", log)
+        if ok and (work / "solucion.pos").exists():
+            shutil.move(str(work / "solucion.pos"), pos_out)
+    result["segundos"] = round(time.time() - t0, 1)
+    if not ok or not pos_out.exists():
+        result["estado"] = "error"
+        return result
+    result.update(estado="procesada", **pos_summary(pos_out))
+    return result
+
+
+def _session_start(path: Path):
+    """Inicio de sesion a partir del HHMM del nombre y la fecha del archivo."""
+    stamp = path.stem.rsplit("_", 1)[-1]
+    if len(stamp) != 4 or not stamp.isdigit():
+        return None
+    mtime = datetime.fromtimestamp(path.stat().st_mtime)
+    start = mtime.replace(hour=int(stamp[:2]), minute=int(stamp[2:]), second=0, microsecond=0)
+    if start > mtime:
+        start -= timedelta(days=1)  # la sesion empezo antes de medianoche
+    return start
+
+
+def find_sessions(folder: Path, tolerance_min: float = MATCH_TOLERANCE_MIN):
+    """Empareja cada rover_gps_*.ubx con la base_gps_*.ubx de inicio mas cercano."""
+    bases = [(p, _session_start(p)) for p in sorted(folder.rglob("base_gps_*.ubx"))]
+    bases = [(p, t) for p, t in bases if t is not None]
+    pairs = []
+    for rover in sorted(folder.rglob("rover_gps_*.ubx")):
+        start = _session_start(rover)
+        if start is None:
+            continue
+        best = min(bases, key=lambda b: abs((b[1] - start).total_seconds()), default=None)
+        if best is None or abs((best[1] - start).total_seconds()) > tolerance_min * 60:
+            print(f"Sin base para {rover.name}")
+            continue
+        pairs.append((best[0], rover))
+    return pairs
+
+
+def print_summary(results):
+    print(f"\n{'SESION':<24}{'ESTADO':<12}{'EPOCAS':>8}{'FIX %':>8}{'DURACION':>10}")
+    for r in results:
+        ratio = f"{100 * r['fix_ratio']:.1f}" if "fix_ratio" in r else "-"
+        dur = str(timedelta(seconds=int(r.get("duracion_s", 0))))
+        print(f"{r['sesion']:<24}{r['estado']:<12}{r.get('epocas', 0):>8}{ratio:>8}{dur:>10}")
+
+
+def cmd_lote(args):
+    folder = Path(args.carpeta)
+    out_root = Path(args.salida) if args.salida else folder / "ppk"
+    pairs = find_sessions(folder, args.tolerancia)
+    if not pairs:
+        sys.exit("No se encontraron pares base/rover.")
+    print(f"=== PROCESAMIENTO PPK POR LOTE: {len(pairs)} sesiones, {args.jobs} procesos ===")
+
+    # Los nucleos que sobran entre sesiones se usan para ventanas dentro de cada una
+    window_jobs = max(1, (os.cpu_count() or 1) // max(1, min(args.jobs, len(pairs))))
+    results = []
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {
+            pool.submit(process_session, base, rover, out_root / rover.stem, args.forzar,
+                        args.ventana, args.solape, window_jobs): rover
+            for base, rover in pairs
+        }
+        for fut in as_completed(futures):
+            rover = futures[fut]
+            try:
+                res = fut.result()
+            except Exception as e:
+                res = {"sesion": rover.stem, "estado": "error", "detalle": str(e)}
+            print(f"[{res['estado']}] {res['sesion']}" + (f": {res['detalle']}" if res.get("detalle") else ""))
+            results.append(res)
+
+    results.sort(key=lambda r: r["sesion"])
+    print_summary(results)
+    out_root.mkdir(parents=True, exist_ok=True)
+    (out_root / SUMMARY_FILE).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\nResumen > {out_root / SUMMARY_FILE}")
+
+
+def cmd_sesion(args):
+    print("=== PROCESAMIENTO AGROPOST RTK (FULL GNSS + SBAS) ===")
+    rover = Path(args.rover)
+    missing = missing_inputs(args.base, rover)
+    if missing:
+        sys.exit("No se encuentra: " + ", ".join(missing))
+    out_dir = Path(args.salida) if args.salida else Path(".")
+    res = process_session(args.base, rover, out_dir, force=True, window_min=args.ventana,
+                          overlap_min=args.solape, jobs=args.jobs)
+    print_summary([res])
+    if res["estado"] == "error":
+        print(f"Ver detalle en {out_dir / (rover.stem + '.log')}")
+        sys.exit(1)
+
+    solution = res["pos"]
+    print("\nGenerando mapa para Google Earth...")
+    if run_command([POS2KML_EXE, "-c", "2", solution], "Creando KML") and args.abrir:
+        kml_file = solution + ".kml"
+        if os.path.exists(kml_file) and hasattr(os, "startfile"):
+            os.startfile(kml_file)
+    if args.abrir:
         try:
-            subprocess.Popen([RTKPLOT_EXE, SOLUTION_FILE])
-        except: pass
-    
+            subprocess.Popen([str(RTKPLOT_EXE), solution])
+        except OSError:
+            pass
     print("\n=== PROCESO TERMINADO ===")
 
+
+def main():
+    p = argparse.ArgumentParser(description="Post-proceso PPK de AgroPost con RTKLIB")
+    sub = p.add_subparsers(dest="cmd")
+
+    p_ses = sub.add_parser("sesion", help="procesar un par base/rover")
+    p_ses.add_argument("base", help="log .ubx de la base")
+    p_ses.add_argument("rover", help="log .ubx del rover")
+    p_ses.add_argument("-o", "--salida", help="carpeta de salida (por defecto la actual)")
+    p_ses.add_argument("--abrir", action="store_true", help="abrir KML y rtkplot al terminar")
+    p_ses.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="procesos rnx2rtkp en paralelo (con --ventana)")
+    p_ses.set_defaults(func=cmd_sesion)
+
+    p_lote = sub.add_parser("lote", help="procesar todas las sesiones de una carpeta")
+    p_lote.add_argument("carpeta", help="carpeta con base_gps_*.ubx y rover_gps_*.ubx")
+    p_lote.add_argument("-o", "--salida", help="carpeta de salida (por defecto <carpeta>/ppk)")
+    p_lote.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="procesos en paralelo")
+    p_lote.add_argument("--tolerancia", type=float, default=MATCH_TOLERANCE_MIN, help="minutos entre inicios para emparejar")
+    p_lote.add_argument("--forzar", action="store_true", help="reprocesar aunque la salida este al dia")
+    p_lote.set_defaults(func=cmd_lote)
+
+    for sp in (p_ses, p_lote):
+        sp.add_argument("--ventana", type=float, default=0, help="minutos por ventana de PPK en paralelo (0=sesion entera)")
+        sp.add_argument("--solape", type=float, default=WINDOW_OVERLAP_MIN, help="minutos de solape entre ventanas")
+
+    args = p.parse_args()
+    if not getattr(args, "cmd", None):
+        p.print_help()
+        return
+    args.func(args)
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
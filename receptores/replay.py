@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+# PROYECTO AGROPOST - REPRODUCCION DE LOGS DE CAMPO
+# Autores: Carrasco, Hess
+# Descripcion: Hace correr movil_final.py sin hardware: el log crudo del GNSS
+# del rover (.ubx) entra por un serial.Serial falso y los paquetes de radio
+# grabados (.lora de la base o del rover) por un SX127x falso, respetando los
+# tiempos originales en tiempo real o N veces mas rapido. El rover postea al
+# backend local como en el campo y un cliente WebSocket mide la latencia desde
+# que llegan los bytes GNSS hasta que el punto se entrega por /ws.
+#
+# Uso:
+#   python replay.py rover_gps_1743.ubx --radio base_lora_1743.lora --velocidad 4
+#   python replay.py rover_gps_1743.ubx --radio rover_lora_1743.lora --json latencias.json
+#
+# Tiempos: el .ubx no tiene marcas de tiempo, se usan las de NAV-PVT (o la hora
+# de GGA con la fecha del log de radio); el .lora tiene la hora de cada evento.
+
+import os
+import sys
+import json
+import time
+import types
+import random
+import argparse
+import threading
+from pathlib import Path
+from datetime import datetime, timezone
+
+from gnss_stream import NMEA, UBX, GnssStreamDecoder, parse_nmea
+from lora_log import iter_records
+from lora_fec import CORR_HEADER_V1, FecEncoder
+from telemetria import percentile
+from ubx import NAV_PVT_ID, decode_nav_pvt, ubx_id
+
+LATENCY_BINS_MS = (5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+
+class ReplayFinished(KeyboardInterrupt):
+    """Fin de los logs: movil_final lo trata como Ctrl+C y cierra sus archivos."""
+
+
+# --- Carga de logs ---
+
+def gnss_epochs(path, fecha=None):
+    """Divide el log GNSS en (t_unix, bytes) por epoca usando NAV-PVT o GGA."""
+    dec = GnssStreamDecoder()
+    frames = dec.feed(Path(path).read_bytes())
+    pvt_times = {}
+    for kind, frame in frames:
+        if kind == UBX and ubx_id(frame) == NAV_PVT_ID:
+            pvt = decode_nav_pvt(frame)
+            if pvt and pvt["ts"] is not None:
+                pvt_times[pvt["itow"]] = pvt["ts"]
+    base_day = None
+    if not pvt_times:
+        day = fecha or datetime.fromtimestamp(Path(path).stat().st_mtime, timezone.utc)
+        base_day = datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp()
+
+    epochs = []
+    chunk = bytearray()
+    cur = None
+    last_hora = None
+    for kind, frame in frames:
+        t = None
+        if pvt_times:
+            if kind == UBX and ubx_id(frame) == NAV_PVT_ID:
+                itow = int.from_bytes(frame[6:10], "little")
+                t = pvt_times.get(itow)
+        elif kind == NMEA and frame[3:6] == b"GGA":
+            msg = parse_nmea(frame)
+            if msg and msg[1]["hora"] is not None:
+                hora = msg[1]["hora"]
+                if last_hora is not None and hora < last_hora - 43200:
+                    base_day += 86400   # cambio de dia UTC
+                last_hora = hora
+                t = base_day + hora
+        if t is not None and t != cur:
+            if chunk and cur is not None:
+                epochs.append((cur, bytes(chunk)))
+                chunk = bytearray()
+            cur = t
+        chunk += frame if kind != NMEA else frame + b"\r\n"
+    if chunk and cur is not None:
+        epochs.append((cur, bytes(chunk)))
+    return epochs
+
+
+def radio_packets(path, loss: float = 0.0, fec_k: int = 4, protocol: int = 2, seed: int = 1):
+    """Paquetes (t_unix, bytes, rssi, snr) tal como los recibe el rover.
+
+    Con un log de la base se rearman los paquetes transmitidos (los TX_CORR
+    guardan el payload antes del protocolo) y se puede simular perdida; con un
+    log del rover se reproduce lo que realmente se recibio.
+    """
+    records = list(iter_records(path))
+    eventos = {r["evento"] for r in records}
+    out = []
+    if any(e.startswith("TX_") for e in eventos):
+        rng = random.Random(seed)
+        encoder = FecEncoder(k=fec_k) if protocol == 2 else None
+        for r in records:
+            if r["evento"] == "TX_CORR":
+                if encoder is None:
+                    pkts = [CORR_HEADER_V1 + bytes([r["seq"] & 0xFF, len(r["data"])]) + r["data"]]
+                else:
+                    pkts = encoder.encode(r["data"])
+            elif r["evento"] == "TX_BEACON":
+                pkts = [r["data"]]
+            else:
+                continue   # TX_FEC: la paridad la regenera el encoder
+            for pkt in pkts:
+                if rng.random() >= loss:
+                    out.append((r["ts"], pkt, -60.0, 9.0))
+        return out
+    has_fec = "RX_FEC" in eventos
+    for r in records:
+        ev = r["evento"]
+        if ev in ("RX_FEC", "RX_OTHER", "CORR_BADLEN"):
+            pkt = r["data"]
+        elif ev == "CORR_OK" and not has_fec:
+            pkt = CORR_HEADER_V1 + bytes([r["seq"] & 0xFF, len(r["data"])]) + r["data"]
+        else:
+            continue
+        out.append((r["ts"], pkt, r["rssi"], r["snr"]))
+    return out
+
+
+# --- Reloj y hardware falso ---
+
+class ReplayClock:
+    """Tiempo de log (unix) en funcion del reloj real, escalado por `speed`."""
+
+    def __init__(self, t0: float, speed: float):
+        self.t0 = t0
+        self.speed = speed
+        self.start = time.monotonic()
+
+    def now(self) -> float:
+        return self.t0 + (time.monotonic() - self.start) * self.speed
+
+    def wall_of(self, t: float) -> float:
+        """time.time() en el que se alcanza el instante de log `t`."""
+        return time.time() + (t - self.now()) / self.speed
+
+    def sleep_until(self, t: float):
+        delay = (t - self.now()) / self.speed
+        if delay > 0:
+            time.sleep(delay)
+
+
+class FakeSerial:
+    """serial.Serial que entrega las epocas del log cuando se cumple su hora."""
+
+    def __init__(self, epochs, clock: ReplayClock):
+        self.epochs = epochs
+        self.clock = clock
+        self.idx = 0
+        self.pending = bytearray()
+        self.last_arrival = None   # time.time() en que "llego" la ultima epoca leida
+        self.written = 0
+
+    def _pull(self):
+        now = self.clock.now()
+        while self.idx < len(self.epochs) and self.epochs[self.idx][0] <= now:
+            t, data = self.epochs[self.idx]
+            self.pending += data
+            self.last_arrival = self.clock.wall_of(t)
+            self.idx += 1
+
+    @property
+    def exhausted(self) -> bool:
+        return self.idx >= len(self.epochs) and not self.pending
+
+    def next_time(self):
+        return self.epochs[self.idx][0] if self.idx < len(self.epochs) else None
+
+    @property
+    def in_waiting(self) -> int:
+        self._pull()
+        return len(self.pending)
+
+    def read(self, size: int = 1) -> bytes:
+        self._pull()
+        data = bytes(self.pending[:size])
+        del self.pending[:size]
+        return data
+
+    def write(self, data) -> int:
+        self.written += len(data)   # correcciones reenviadas al receptor
+        return len(data)
+
+    def close(self):
+        pass
+
+
+class FakeSX127x:
+    """SX127x con la interfaz que usa movil_final; `wait()` bloquea hasta el proximo paquete."""
+
+    HEADER_EXPLICIT = 0
+
+    def __init__(self, packets, clock: ReplayClock, gnss: FakeSerial):
+        self.packets = packets
+        self.clock = clock
+        self.gnss = gnss
+        self.idx = 0
+        self.rx = b""
+        self.rx_pos = 0
+        self.rssi = None
+        self.snr = None
+
+    def __getattr__(self, name):
+        # setPins, setSpi, setFrequency, setLoRaModulation, ... no hacen nada
+        if name.startswith("set"):
+            return lambda *args, **kwargs: None
+        raise AttributeError(name)
+
+    def begin(self):
+        return True
+
+    def request(self, *args):
+        pass
+
+    def wait(self, timeout: int = 0):
+        if self.idx < len(self.packets):
+            self.clock.sleep_until(self.packets[self.idx][0])
+            _, self.rx, self.rssi, self.snr = self.packets[self.idx]
+            self.rx_pos = 0
+            self.idx += 1
+            return True
+        # Sin mas radio: el bucle avanza al ritmo del GNSS hasta terminar
+        nxt = self.gnss.next_time()
+        if nxt is None:
+            if self.gnss.exhausted:
+                raise ReplayFinished()
+            return False
+        self.clock.sleep_until(nxt)
+        return False
+
+    def available(self) -> int:
+        return len(self.rx) - self.rx_pos
+
+    def read(self):
+        b = self.rx[self.rx_pos]
+        self.rx_pos += 1
+        return b
+
+    def packetRssi(self):
+        return self.rssi
+
+    def packetSnr(self):
+        return self.snr
+
+
+# --- Medicion ---
+
+class WsLatency:
+    """Cliente de /ws que registra la hora de llegada de cada punto.
+
+    El filtro del backend mueve lat/lon: con `raw=1` el mensaje trae ademas la
+    posicion tal como se posteo (`lat_raw`/`lon_raw`) y esa es la clave.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.arrivals = {}
+        self.received = 0
+        self.stop_event = threading.Event()
+        self.error = None
+
+    def run(self):
+        from websockets.sync.client import connect
+
+        try:
+            with connect(self.url, open_timeout=5) as ws:
+                while not self.stop_event.is_set():
+                    try:
+                        raw = ws.recv(timeout=0.5)
+                    except TimeoutError:
+                        continue
+                    t = time.time()
+                    msg = json.loads(raw)
+                    self.received += 1
+                    key = (msg.get("lat_raw", msg.get("lat")), msg.get("lon_raw", msg.get("lon")))
+                    self.arrivals.setdefault(key, t)
+        except Exception as e:
+            self.error = e
+
+
+def histogram(values_ms):
+    counts = [0] * (len(LATENCY_BINS_MS) + 1)
+    for v in values_ms:
+        for i, edge in enumerate(LATENCY_BINS_MS):
+            if v < edge:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+    labels = [f"<{e}" for e in LATENCY_BINS_MS] + [f">={LATENCY_BINS_MS[-1]}"]
+    return dict(zip(labels, counts))
+
+
+def _install_fake_modules():
+    # En la notebook no suele estar LoRaRF (y a veces tampoco pyserial)
+    try:
+        import LoRaRF  # noqa: F401
+    except ImportError:
+        sys.modules["LoRaRF"] = types.SimpleNamespace(SX127x=FakeSX127x)
+    try:
+        import serial  # noqa: F401
+    except ImportError:
+        sys.modules["serial"] = types.SimpleNamespace(Serial=None)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Reproduce logs de base/rover a traves de movil_final.py")
+    p.add_argument("gnss", help="log crudo del GNSS del rover (rover_gps_*.ubx)")
+    p.add_argument("--radio", help="log de radio (.lora) de la base o del rover")
+    p.add_argument("--velocidad", type=float, default=1.0, help="factor de velocidad (1 = tiempo real)")
+    p.add_argument("--desfase", type=float, default=0.0, help="seg. a sumar a los tiempos del log de radio")
+    p.add_argument("--perdida", type=float, default=0.0, help="perdida simulada de paquetes (solo log de base)")
+    p.add_argument("--fec-k", type=int, default=4, help="grupo FEC con el que se rearma el log de la base")
+    p.add_argument("--protocolo", type=int, choices=(1, 2), default=2, help="protocolo de correcciones de la base")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8000)
+    p.add_argument("--min-fix", type=int, default=1,
+                   help="calidad minima a publicar (1 = cualquier fix: la latencia no depende del RTK)")
+    p.add_argument("--salida", default="replay_out", help="carpeta para los logs que escribe el rover")
+    p.add_argument("--sin-ws", action="store_true", help="no medir latencia por WebSocket")
+    p.add_argument("--json", help="guardar el reporte en este archivo")
+    args = p.parse_args()
+    if args.velocidad <= 0:
+        p.error("--velocidad debe ser positiva")
+
+    epochs = gnss_epochs(args.gnss)
+    if not epochs:
+        sys.exit(f"{args.gnss}: sin epocas con hora (NAV-PVT o GGA)")
+    packets = []
+    if args.radio:
+        packets = radio_packets(args.radio, args.perdida, args.fec_k, args.protocolo)
+        if packets and not args.desfase and (packets[0][0] > epochs[-1][0] or packets[-1][0] < epochs[0][0]):
+            # Relojes sin sincronizar (Pi sin NTP): alinear el inicio de la radio con el del GNSS
+            args.desfase = epochs[0][0] - packets[0][0]
+            print(f"AVISO: los logs no se superponen en el tiempo, radio desplazada {args.desfase:.0f}s")
+        packets = [(t + args.desfase, pkt, rssi, snr) for t, pkt, rssi, snr in packets]
+    t0 = min(epochs[0][0], packets[0][0]) if packets else epochs[0][0]
+    span_gnss = epochs[-1][0] - epochs[0][0]
+    print(f"GNSS : {len(epochs)} epocas, {span_gnss:.0f}s desde {datetime.fromtimestamp(epochs[0][0], timezone.utc):%H:%M:%S}")
+    if packets:
+        print(f"Radio: {len(packets)} paquetes, {packets[-1][0] - packets[0][0]:.0f}s "
+              f"desde {datetime.fromtimestamp(packets[0][0], timezone.utc):%H:%M:%S}")
+    print(f"Reproduciendo a {args.velocidad:g}x (~{span_gnss / args.velocidad:.0f}s)")
+
+    # La configuracion de movil_final se lee del entorno al importarlo
+    os.environ["AGROPOST_HOST"] = args.host
+    os.environ["AGROPOST_PORT"] = str(args.port)
+    # Se mide el camino NAV-PVT -> PosPublisher; RTKLIB no corre en la notebook
+    os.environ["ROVER_POS_SOURCE"] = "ubx"
+    interval = float(os.getenv("AGROPOST_POST_INTERVAL", "1.0"))
+    os.environ["AGROPOST_POST_INTERVAL"] = str(interval / args.velocidad)
+    os.environ["AGROPOST_MIN_FIX"] = str(args.min_fix)
+    report_path = Path(args.json).resolve() if args.json else None
+    out_dir = Path(args.salida).resolve()
+    out_dir.mkdir(parents=True, exist_ok=True)
+    os.chdir(out_dir)
+    _install_fake_modules()
+    import movil_final as movil
+
+    clock = ReplayClock(t0, args.velocidad)
+    gnss = FakeSerial(epochs, clock)
+    radio = FakeSX127x(packets, clock, gnss)
+    movil.serial = types.SimpleNamespace(Serial=lambda *a, **kw: gnss)
+    movil.SX127x = lambda: radio
+
+    # Hora de llegada de los bytes GNSS de cada solucion publicada
+    published = {}
+    orig_publish = movil.PosPublisher.publish
+
+    def publish(self, sol):
+        published[(sol["lat"], sol["lon"])] = gnss.last_arrival
+        orig_publish(self, sol)
+
+    movil.PosPublisher.publish = publish
+
+    ws = None
+    if not args.sin_ws:
+        ws = WsLatency(f"ws://{args.host}:{args.port}/ws?raw=1")
+        threading.Thread(target=ws.run, daemon=True).start()
+        time.sleep(0.5)
+        if ws.error:
+            sys.exit(f"No se pudo conectar a {ws.url}: {ws.error}")
+
+    start = time.monotonic()
+    movil.main()
+    elapsed = time.monotonic() - start
+    if ws:
+        time.sleep(1.0)   # ultimos envios del hilo publicador
+        ws.stop_event.set()
+
+    lat_ms = []
+    if ws:
+        for key, t_gnss in published.items():
+            t_ws = ws.arrivals.get(key)
+            if t_gnss is not None and t_ws is not None:
+                lat_ms.append(1000.0 * (t_ws - t_gnss))
+    lat_ms.sort()
+    report = {
+        "gnss": str(args.gnss),
+        "radio": args.radio,
+        "velocidad": args.velocidad,
+        "duracion_s": round(elapsed, 2),
+        "epocas": len(epochs),
+        "paquetes_radio": len(packets),
+        "bytes_correccion_al_gnss": gnss.written,
+        "publicados": len(published),
+        "recibidos_ws": ws.received if ws else None,
+        "latencia_ms": {
+            "p50": percentile(lat_ms, 50),
+            "p90": percentile(lat_ms, 90),
+            "p99": percentile(lat_ms, 99),
+            "max": lat_ms[-1] if lat_ms else None,
+            "histograma": histogram(lat_ms),
+        },
+    }
+    print(f"\nPublicados={report['publicados']} recibidos por WS={report['recibidos_ws']} "
+          f"correcciones al GNSS={gnss.written} B en {elapsed:.1f}s")
+    if lat_ms:
+        lat = report["latencia_ms"]
+        print(f"Latencia GNSS->WS: p50={lat['p50']:.1f}ms p90={lat['p90']:.1f}ms p99={lat['p99']:.1f}ms max={lat['max']:.1f}ms")
+        top = max(lat["histograma"].values())
+        for label, n in lat["histograma"].items():
+            print(f"  {label:>7} ms {n:6d} {'#' * int(40 * n / top) if top else ''}")
+    if report_path:
+        report_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"Reporte: {report_path}")
+    if not published:
+        sys.exit(f"ERROR: no se publico ninguna solucion con calidad >= {args.min_fix} (NAV-PVT sin fix en el log?)")
+
+
+if __name__ == "__main__":
+    main()
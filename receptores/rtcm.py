@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+# PROYECTO AGROPOST - UTILIDADES RTCM3 Y ENLACE LORA
+# Autores: Carrasco, Hess
+# Descripcion: Extraccion de frames RTCM3 con CRC-24Q, decodificacion minima de
+# cabeceras (tipo de mensaje y epoca MSM), calculo de airtime LoRa, planificador
+# que empaqueta correcciones respetando limites de frame y prioridades, y
+# reensamblado de frames del lado del rover.
+#
+# Verificacion offline de capturas:
+#   python rtcm.py rover_corr_1743.bin     -> frames por tipo y errores de CRC
+#   python rtcm.py base_lora_1743.lora     -> reensambla los paquetes grabados
+
+import sys
+import math
+import argparse
+from pathlib import Path
+from datetime import datetime, timezone
+
+# Prioridad (0 = mas importante) e intervalo minimo en seg. entre envios por tipo.
+# Intervalo 0 = enviar todas las epocas.
+RTCM_PRIORIDADES = {
+    # Observaciones MSM4/MSM7 (GPS, GLONASS, Galileo, BeiDou)
+    1074: (0, 0.0), 1077: (0, 0.0),
+    1084: (0, 0.0), 1087: (0, 0.0),
+    1094: (0, 0.0), 1097: (0, 0.0),
+    1124: (1, 0.0), 1127: (1, 0.0),
+    # Posicion de la estacion base
+    1005: (2, 10.0), 1006: (2, 10.0),
+    # Sesgos de codigo-fase GLONASS
+    1230: (3, 10.0),
+    # Efemerides (el rover tambien las recibe del cielo)
+    1019: (4, 60.0), 1020: (4, 60.0), 1042: (4, 60.0), 1046: (4, 60.0),
+}
+RTCM_PRIORIDAD_OTROS = (5, 30.0)   # tipos no listados (p.ej. propietarios 4072)
+MAX_FRAME_AGE = 1.5                 # seg. que puede esperar un frame antes de descartarse
+RESYNC_PACKETS = 3                  # paquetes seguidos "viejos" que indican que la base reinicio su seq
+RESYNC_GAP = 5.0                    # seg. sin paquetes tras los que un seq "viejo" tambien resincroniza
+
+GPS_EPOCH = datetime(1980, 1, 6, tzinfo=timezone.utc)
+GPS_LEAP_SECONDS = 18
+WEEK_MS = 7 * 86400 * 1000
+DAY_MS = 86400 * 1000
+CRC24Q_POLY = 0x1864CFB
+
+
+def _crc24q_table():
+    table = []
+    for i in range(256):
+        crc = i << 16
+        for _ in range(8):
+            crc <<= 1
+            if crc & 0x1000000:
+                crc ^= CRC24Q_POLY
+        table.append(crc & 0xFFFFFF)
+    return tuple(table)
+
+
+CRC24Q_TABLE = _crc24q_table()
+
+
+def crc24q(data) -> int:
+    """CRC-24Q (RTCM3) por tabla de 256 entradas, un lookup por byte."""
+    crc = 0
+    table = CRC24Q_TABLE
+    for b in data:
+        crc = ((crc << 8) & 0xFFFFFF) ^ table[(crc >> 16) ^ b]
+    return crc
+
+
+def extract_rtcm_frames(buf: bytearray, check_crc: bool = True, stats: dict | None = None):
+    """Extrae frames RTCM3 (0xD3, len[10 bits], payload, CRC3) del buffer.
+
+    Con `check_crc` los candidatos con CRC-24Q invalido se descartan avanzando un
+    byte para resincronizar; `stats["crc_error"]` cuenta esos descartes.
+    """
+    frames = []
+    while True:
+        if len(buf) < 3:
+            break
+        try:
+            start = buf.index(0xD3)
+        except ValueError:
+            buf.clear()
+            break
+        if start:
+            del buf[:start]
+        if len(buf) < 3:
+            break
+        if buf[1] & 0xFC:
+            del buf[:1]  # los 6 bits reservados deben ser 0: falso preambulo
+            continue
+        length = ((buf[1] & 0x03) << 8) | buf[2]
+        total = 3 + length + 3  # header + payload + CRC24
+        if len(buf) < total:
+            break
+        if check_crc:
+            mv = memoryview(buf)
+            ok = crc24q(mv[:total - 3]) == int.from_bytes(mv[total - 3:total], "big")
+            mv.release()
+            if not ok:
+                if stats is not None:
+                    stats["crc_error"] = stats.get("crc_error", 0) + 1
+                del buf[:1]
+                continue
+        frame = bytes(buf[:total])
+        del buf[:total]
+        frames.append(frame)
+    return frames
+
+
+def getbitu(buf: bytes, pos: int, length: int) -> int:
+    """Lee `length` bits sin signo desde el bit `pos` (MSB primero)."""
+    byte0 = pos >> 3
+    byte1 = (pos + length + 7) >> 3
+    value = int.from_bytes(buf[byte0:byte1], "big")
+    shift = (byte1 - byte0) * 8 - (pos & 7) - length
+    return (value >> shift) & ((1 << length) - 1)
+
+
+def rtcm_message_type(frame: bytes) -> int | None:
+    """Numero de mensaje RTCM3 (DF002) de un frame completo."""
+    if len(frame) < 8 or frame[0] != 0xD3:
+        return None
+    return getbitu(frame, 24, 12)
+
+
+def is_msm(msg_type: int | None) -> bool:
+    return msg_type is not None and 1071 <= msg_type <= 1127 and msg_type % 10 != 0
+
+
+def msm_epoch_ms(frame: bytes):
+    """Epoca de un mensaje MSM: (sistema, ms de semana/dia). None si no es MSM."""
+    msg_type = rtcm_message_type(frame)
+    if not is_msm(msg_type):
+        return None
+    system = (msg_type // 10) % 100  # 107=GPS, 108=GLO, 109=GAL, 112=BDS
+    if system == 8:
+        dow = getbitu(frame, 24 + 24, 3)
+        tod = getbitu(frame, 24 + 27, 27)
+        return "GLO", tod, dow
+    return {7: "GPS", 9: "GAL", 12: "BDS"}.get(system, "OTRO"), getbitu(frame, 24 + 24, 30), None
+
+
+def correction_age(frame: bytes, now: datetime | None = None) -> float | None:
+    """Edad (seg.) de la epoca MSM respecto del reloj local (requiere hora UTC sincronizada)."""
+    epoch = msm_epoch_ms(frame)
+    if epoch is None:
+        return None
+    system, ms, _ = epoch
+    now = now or datetime.now(timezone.utc)
+    gps_ms = int((now - GPS_EPOCH).total_seconds() * 1000) + GPS_LEAP_SECONDS * 1000
+    if system in ("GPS", "GAL"):
+        ref, period = gps_ms % WEEK_MS, WEEK_MS
+    elif system == "BDS":
+        ref, period = (gps_ms - 14000) % WEEK_MS, WEEK_MS
+    elif system == "GLO":
+        # Hora GLONASS = UTC + 3 h, el mensaje lleva ms del dia
+        glo_ms = gps_ms - GPS_LEAP_SECONDS * 1000 + 3 * 3600 * 1000
+        ref, period = glo_ms % DAY_MS, DAY_MS
+    else:
+        return None
+    age = (ref - ms) % period
+    if age > period / 2:
+        age -= period  # epoca "en el futuro": reloj local atrasado
+    return age / 1000.0
+
+
+def lora_airtime(payload_len: int, sf: int, bw: int, cr: int, preamble: int = 8,
+                 explicit_header: bool = True, crc: bool = True) -> float:
+    """Tiempo en el aire (seg.) de un paquete LoRa (formula de Semtech AN1200.13).
+
+    `cr` sigue la convencion de LoRaRF: 5..8 para 4/5..4/8.
+    """
+    t_sym = (2 ** sf) / bw
+    low_dr = 1 if t_sym > 0.016 else 0
+    num = 8 * payload_len - 4 * sf + 28 + (16 if crc else 0) - (0 if explicit_header else 20)
+    n_payload = 8 + max(math.ceil(num / (4 * (sf - 2 * low_dr))) * cr, 0)
+    return (preamble + 4.25) * t_sym + n_payload * t_sym
+
+
+class RtcmScheduler:
+    """Arma paquetes LoRa con frames RTCM completos segun prioridad y presupuesto de airtime.
+
+    - Los tipos con intervalo minimo se deciman (solo pasa un frame por intervalo).
+    - El airtime disponible se modela con un balde de tokens (`duty` del tiempo).
+    - Se atiende por prioridad; lo que no alcanza a salir en MAX_FRAME_AGE se descarta.
+    - Un frame nunca comparte paquete con otro si no entra entero: los frames
+      mas grandes que un paquete ocupan paquetes propios consecutivos.
+    """
+
+    def __init__(self, max_payload: int, airtime_fn, duty: float = 0.8,
+                 prioridades: dict | None = None, max_age: float = MAX_FRAME_AGE):
+        self.max_payload = max_payload
+        self.airtime_fn = airtime_fn
+        self.duty = duty
+        self.prioridades = RTCM_PRIORIDADES if prioridades is None else prioridades
+        self.max_age = max_age
+        # Airtime acumulable (seg.): alcanza para el frame RTCM mas largo (1029 bytes)
+        self.burst = math.ceil(1029 / max_payload) * airtime_fn(max_payload)
+        self.tokens = self.burst
+        self.last_refill = None
+        self.pending = []      # [prioridad, orden, t_llegada, tipo, frame]
+        self.order = 0
+        self.last_sent = {}    # tipo -> ultimo envio aceptado
+        self.stats = {"enviados": {}, "decimados": {}, "vencidos": {}, "bytes": 0, "airtime": 0.0}
+
+    @property
+    def capacity_bps(self) -> float:
+        """Bytes RTCM por segundo que admite el enlace con paquetes llenos."""
+        return self.duty * self.max_payload / self.airtime_fn(self.max_payload)
+
+    def _count(self, key: str, msg_type):
+        bucket = self.stats[key]
+        bucket[msg_type] = bucket.get(msg_type, 0) + 1
+
+    def push(self, frame: bytes, now: float):
+        msg_type = rtcm_message_type(frame)
+        prio, interval = self.prioridades.get(msg_type, RTCM_PRIORIDAD_OTROS)
+        last = self.last_sent.get(msg_type)
+        if interval > 0 and last is not None and now - last < interval:
+            self._count("decimados", msg_type)
+            return
+        self.last_sent[msg_type] = now
+        self.pending.append([prio, self.order, now, msg_type, frame])
+        self.order += 1
+
+    def charge(self, airtime: float):
+        """Descuenta airtime usado por otros paquetes (p.ej. beacons)."""
+        self.tokens -= airtime
+
+    def _refill(self, now: float):
+        if self.last_refill is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.duty)
+        self.last_refill = now
+
+    def next_packets(self, now: float, flush: bool = False):
+        """Devuelve la lista de payloads listos para enviar ahora."""
+        self._refill(now)
+        fresh = []
+        for item in self.pending:
+            if now - item[2] > self.max_age:
+                self._count("vencidos", item[3])
+            else:
+                fresh.append(item)
+        self.pending = sorted(fresh, key=lambda it: (it[0], it[1]))
+
+        packets = []
+        while self.pending:
+            first = self.pending[0][4]
+            if len(first) > self.max_payload:
+                chunks = [first[i:i + self.max_payload] for i in range(0, len(first), self.max_payload)]
+                cost = sum(self.airtime_fn(len(c)) for c in chunks)
+                if self.tokens < cost:
+                    break
+                self._sent(self.pending.pop(0), cost)
+                packets.extend(chunks)
+                continue
+
+            # Llenar el paquete con frames enteros en orden de prioridad
+            chosen, size = [], 0
+            for idx, item in enumerate(self.pending):
+                flen = len(item[4])
+                if flen <= self.max_payload and size + flen <= self.max_payload:
+                    chosen.append(idx)
+                    size += flen
+            full = self.max_payload - size < 24  # no entra ni un frame chico mas
+            if not (flush or full or len(chosen) < len(self.pending)):
+                break  # esperar a completar el paquete
+            cost = self.airtime_fn(size)
+            if self.tokens < cost:
+                break
+            payload = bytearray()
+            for idx in reversed(chosen):
+                item = self.pending.pop(idx)
+                payload[:0] = item[4]
+                self._sent(item, 0.0)
+            self.tokens -= cost
+            self.stats["airtime"] += cost
+            packets.append(bytes(payload))
+        return packets
+
+    def _sent(self, item, cost: float):
+        self.tokens -= cost
+        self.stats["airtime"] += cost
+        self.stats["bytes"] += len(item[4])
+        self._count("enviados", item[3])
+
+
+class RtcmReassembler:
+    """Reconstruye frames RTCM3 a partir de paquetes de correccion numerados.
+
+    Sigue el `seq` de 8 bits: los saltos cuentan como paquetes perdidos y tiran
+    el frame que estaba a medio armar; los paquetes viejos o duplicados se
+    ignoran. Si la base reinicia (seq vuelve a empezar), los paquetes parecen
+    viejos para siempre: tras RESYNC_PACKETS seguidos, o si llegan despues de
+    RESYNC_GAP seg. sin paquetes, se toma el seq recibido como nuevo origen y
+    se cuenta como `resync`. Solo devuelve frames con CRC-24Q valido.
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.expected_seq = None
+        self.behind = 0
+        self.last_packet_time = None
+        self.last_frame_time = None
+        self.last_age = None
+        self.stats = {
+            "paquetes": 0, "perdidos": 0, "duplicados": 0, "resync": 0,
+            "frames": 0, "frames_incompletos": 0, "crc_error": 0, "bytes": 0,
+        }
+
+    def push(self, seq: int, payload: bytes, now: float | None = None):
+        st = self.stats
+        silent = (now is not None and self.last_packet_time is not None
+                  and now - self.last_packet_time > RESYNC_GAP)
+        if now is not None:
+            self.last_packet_time = now
+        if self.expected_seq is not None:
+            gap = (seq - self.expected_seq) % 256
+            if gap > 128:
+                self.behind += 1
+                if not silent and self.behind < RESYNC_PACKETS:
+                    st["duplicados"] += 1
+                    return []
+                # Reinicio de la base: los "duplicados" de esta racha no lo eran
+                st["duplicados"] -= self.behind - 1
+                st["resync"] += 1
+                if self.buf:
+                    st["frames_incompletos"] += 1
+                    self.buf.clear()
+                gap = 0
+            self.behind = 0
+            if gap:
+                st["perdidos"] += gap
+                if self.buf:
+                    st["frames_incompletos"] += 1
+                    self.buf.clear()
+        self.expected_seq = (seq + 1) % 256
+        st["paquetes"] += 1
+        if not self.buf and payload[:1] != b"\xD3":
+            # Continuacion de un frame cuyo inicio se perdio
+            st["frames_incompletos"] += 1
+            return []
+        self.buf.extend(payload)
+        frames = extract_rtcm_frames(self.buf, stats=st)
+        if frames:
+            self.last_frame_time = now
+            st["frames"] += len(frames)
+            for frame in frames:
+                st["bytes"] += len(frame)
+                age = correction_age(frame)
+                if age is not None:
+                    self.last_age = age
+        return frames
+
+    @property
+    def packet_loss(self) -> float:
+        total = self.stats["paquetes"] + self.stats["perdidos"]
+        return self.stats["perdidos"] / total if total else 0.0
+
+
+def _frames_por_tipo(frames) -> dict:
+    out = {}
+    for frame in frames:
+        t = rtcm_message_type(frame)
+        out[t] = out.get(t, 0) + 1
+    return dict(sorted(out.items()))
+
+
+def main():
+    p = argparse.ArgumentParser(description="Verifica capturas RTCM3 (.bin crudos o logs LoRa .lora)")
+    p.add_argument("files", nargs="+")
+    args = p.parse_args()
+
+    for name in args.files:
+        path = Path(name)
+        try:
+            if path.suffix == ".lora":
+                from lora_log import iter_records
+                asm = RtcmReassembler()
+                frames = []
+                for rec in iter_records(path):
+                    if rec["evento"] in ("TX_CORR", "CORR_OK") and rec["seq"] is not None:
+                        frames.extend(asm.push(rec["seq"], rec["data"], rec["ts"]))
+                print(f"{path}: {asm.stats} perdida={100 * asm.packet_loss:.1f}%")
+            else:
+                stats = {}
+                frames = extract_rtcm_frames(bytearray(path.read_bytes()), stats=stats)
+                print(f"{path}: frames={len(frames)} crc_error={stats.get('crc_error', 0)}")
+        except (OSError, ValueError) as e:
+            print(f"ERROR {path}: {e}", file=sys.stderr)
+            continue
+        print(f"  por tipo: {_frames_por_tipo(frames)}")
+
+
+if __name__ == "__main__":
+    main()
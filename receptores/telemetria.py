@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# PROYECTO AGROPOST - TELEMETRIA DE ENLACE Y RTK
+# Autores: Carrasco, Hess
+# Descripcion: Metricas en ventana deslizante para base y rover (paquetes/s,
+# bytes/s, perdida por huecos de seq, percentiles de RSSI/SNR, duracion de
+# convbin/rnx2rtkp, proporcion de fix y edad de las correcciones) y un hilo
+# que las publica cada pocos segundos en el backend
+# (POST /api/metrics/estaciones) para que el mapa muestre el estado del enlace.
+#
+# Uso offline (misma ventana aplicada a un log de eventos grabado):
+#   python telemetria.py rover_lora_1743.lora --ventana 30
+
+import time
+import argparse
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+import requests
+
+TELEMETRY_WINDOW = 30.0     # seg. de historia para tasas y percentiles
+TELEMETRY_INTERVAL = 5.0    # seg. entre envios al backend
+SEQ_MOD = 256               # el seq de los paquetes de correccion es de 8 bits
+SEQ_MAX_GAP = 64            # saltos mayores se toman como reinicio de la base, no como perdida
+
+
+def percentile(sorted_vals, q: float):
+    if not sorted_vals:
+        return None
+    k = min(len(sorted_vals) - 1, max(0, int(round(q / 100.0 * (len(sorted_vals) - 1)))))
+    return sorted_vals[k]
+
+
+class Window:
+    """Muestras (t, valor) de los ultimos `span` segundos."""
+
+    def __init__(self, span: float):
+        self.span = span
+        self.items = deque()
+
+    def add(self, t: float, value):
+        self.items.append((t, value))
+
+    def trim(self, now: float):
+        limit = now - self.span
+        items = self.items
+        while items and items[0][0] < limit:
+            items.popleft()
+
+    def values(self):
+        return [v for _, v in self.items]
+
+
+class LinkTelemetry:
+    """Metricas de una estacion. Se alimenta desde el bucle principal y el hilo RTK.
+
+    Todas las operaciones toman un lock corto: `snapshot()` corre en el hilo
+    que publica al backend.
+    """
+
+    def __init__(self, estacion: str, window: float = TELEMETRY_WINDOW):
+        self.estacion = estacion
+        self.window = window
+        self.lock = threading.Lock()
+        self.packets = Window(window)     # (t, bytes)
+        self.numbered = Window(window)    # (t, paquetes perdidos antes de este segun el seq)
+        self.rssi = Window(window)
+        self.snr = Window(window)
+        self.fixes = Window(window)       # (t, calidad de la solucion)
+        self.ages = Window(window)        # (t, edad de la correccion en seg.)
+        self.durations = {}               # nombre -> Window de segundos
+        self.last_seq = None
+        self.totals = {"paquetes": 0, "bytes": 0, "perdidos": 0}
+        self.extra = {}
+
+    def packet(self, nbytes: int, seq: int | None = None, rssi: float | None = None,
+               snr: float | None = None, now: float | None = None):
+        """Registra un paquete enviado/recibido; `seq` solo para paquetes de datos numerados."""
+        now = time.time() if now is None else now
+        with self.lock:
+            self.packets.add(now, nbytes)
+            self.totals["paquetes"] += 1
+            self.totals["bytes"] += nbytes
+            if rssi is not None:
+                self.rssi.add(now, rssi)
+            if snr is not None:
+                self.snr.add(now, snr)
+            if seq is None:
+                return
+            gap = 0
+            if self.last_seq is not None:
+                gap = (seq - self.last_seq - 1) % SEQ_MOD
+                if gap > SEQ_MAX_GAP:
+                    gap = 0
+            self.numbered.add(now, gap)
+            self.totals["perdidos"] += gap
+            self.last_seq = seq
+
+    def duration(self, name: str, seconds: float, now: float | None = None):
+        now = time.time() if now is None else now
+        with self.lock:
+            win = self.durations.get(name)
+            if win is None:
+                win = self.durations[name] = Window(self.window)
+            win.add(now, seconds)
+
+    def fix(self, quality: int, now: float | None = None):
+        now = time.time() if now is None else now
+        with self.lock:
+            self.fixes.add(now, quality)
+
+    def correction_age(self, age: float | None, now: float | None = None):
+        if age is None:
+            return
+        now = time.time() if now is None else now
+        with self.lock:
+            self.ages.add(now, age)
+
+    def set(self, **values):
+        """Valores sueltos que se publican tal cual (p.ej. airtime de la base)."""
+        with self.lock:
+            self.extra.update(values)
+
+    @staticmethod
+    def _stats(values, digits: int = 1):
+        vals = sorted(values)
+        if not vals:
+            return None
+        return {"p10": round(percentile(vals, 10), digits), "p50": round(percentile(vals, 50), digits),
+                "p90": round(percentile(vals, 90), digits)}
+
+    def snapshot(self, now: float | None = None) -> dict:
+        now = time.time() if now is None else now
+        with self.lock:
+            wins = [self.packets, self.numbered, self.rssi, self.snr, self.fixes, self.ages, *self.durations.values()]
+            for w in wins:
+                w.trim(now)
+            span = min(self.window, max(now - self.packets.items[0][0], 1.0)) if self.packets.items else self.window
+            sizes = self.packets.values()
+            gaps = self.numbered.values()
+            lost = sum(gaps)
+            fixes = self.fixes.values()
+            ages = sorted(self.ages.values())
+            out = {
+                "estacion": self.estacion,
+                "ts": datetime.fromtimestamp(now, timezone.utc).isoformat().replace("+00:00", "Z"),
+                "ventana_s": self.window,
+                "paquetes_s": round(len(sizes) / span, 2),
+                "bytes_s": round(sum(sizes) / span, 1),
+                "perdida": round(lost / (lost + len(gaps)), 4) if gaps else None,
+                "rssi": self._stats(self.rssi.values()),
+                "snr": self._stats(self.snr.values()),
+                "fix_ratio": round(sum(1 for q in fixes if q == 4) / len(fixes), 3) if fixes else None,
+                "float_ratio": round(sum(1 for q in fixes if q == 5) / len(fixes), 3) if fixes else None,
+                "edad_correccion_s": {"p50": round(percentile(ages, 50), 2), "max": round(ages[-1], 2)} if ages else None,
+                "duraciones_s": {name: self._stats(w.values(), 3) for name, w in self.durations.items() if w.items},
+                "totales": dict(self.totals),
+            }
+            out.update(self.extra)
+        return out
+
+
+class TelemetryPusher:
+    """Hilo que publica `telemetry.snapshot()` en el backend cada `interval` segundos.
+
+    Los errores de red solo se informan una vez por racha para no inundar la consola.
+    """
+
+    def __init__(self, telemetry: LinkTelemetry, host: str, port: int, interval: float = TELEMETRY_INTERVAL):
+        self.telemetry = telemetry
+        self.url = f"http://{host}:{port}/api/metrics/estaciones"
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.failing = False
+        self.session = requests.Session()
+
+    def loop(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                r = self.session.post(self.url, json=self.telemetry.snapshot(), timeout=3)
+                r.raise_for_status()
+                if self.failing:
+                    print("[TELEMETRIA] backend disponible otra vez")
+                self.failing = False
+            except requests.RequestException as e:
+                if not self.failing:
+                    print(f"[TELEMETRIA] no se pudo publicar: {e}")
+                self.failing = True
+
+    def start(self) -> threading.Thread | None:
+        if self.interval <= 0:
+            return None
+        thread = threading.Thread(target=self.loop, name="telemetria", daemon=True)
+        thread.start()
+        return thread
+
+
+def main():
+    from lora_log import iter_records
+
+    p = argparse.ArgumentParser(description="Metricas de enlace calculadas sobre un log LoRa grabado")
+    p.add_argument("file", help="archivo .lora de base o rover")
+    p.add_argument("--ventana", type=float, default=TELEMETRY_WINDOW, help="segundos de la ventana")
+    args = p.parse_args()
+
+    tel = None
+    last_print = None
+    has_fec = False
+    for rec in iter_records(args.file):
+        if tel is None:
+            tel = LinkTelemetry("base" if rec["evento"].startswith("TX") else "rover", args.ventana)
+        ev = rec["evento"]
+        has_fec = has_fec or ev == "RX_FEC"
+        if ev == "CORR_OK" and has_fec:
+            continue   # con FEC el payload ya se conto en el RX_FEC que lo trajo
+        data = rec["data"]
+        seq = rec["seq"]
+        if ev in ("TX_BEACON", "RX_OTHER") or (ev in ("RX_FEC", "TX_FEC") and len(data) > 2 and data[2] & 0x02):
+            seq = None   # beacons y paridad no cuentan para los huecos de seq
+        tel.packet(len(data), seq=seq, rssi=rec["rssi"], snr=rec["snr"], now=rec["ts"])
+        if last_print is None or rec["ts"] - last_print >= args.ventana:
+            snap = tel.snapshot(now=rec["ts"])
+            rssi = snap["rssi"]["p50"] if snap["rssi"] else "?"
+            perdida = f"{100 * snap['perdida']:.1f}%" if snap["perdida"] is not None else "?"
+            print(f"{snap['ts']} {snap['paquetes_s']} paq/s {snap['bytes_s']} B/s perdida={perdida} RSSI p50={rssi}")
+            last_print = rec["ts"]
+    if tel is None:
+        print("log vacio")
+        return
+    print(f"totales: {tel.totals}")
+
+
+if __name__ == "__main__":
+    main()
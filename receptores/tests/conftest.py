@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Los modulos de receptores/ se importan entre si como scripts (from rtcm import ...)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
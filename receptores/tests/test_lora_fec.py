@@ -0,0 +1,108 @@
+"""Protocolo v2: paridad XOR por grupo, cabecera y compresion, en loopback."""
+from pathlib import Path
+
+import pytest
+
+from lora_fec import (CORR_HEADER_V2, FLAG_COMPRIMIDO, FLAG_PARIDAD, HEADER_V2_LEN, FecDecoder, FecEncoder,
+                      parse_v2, simulate)
+from lora_log import iter_records
+from rtcm import extract_rtcm_frames
+
+DATOS = Path(__file__).parent / "datos"
+
+
+@pytest.fixture(scope="module")
+def payloads():
+    """Paquetes de correccion grabados por la base (RTCM ya empaquetado)."""
+    return [r["data"] for r in iter_records(DATOS / "base_corr.lora") if r["evento"] == "TX_CORR"]
+
+
+def _enlace(payloads, k, perdidos=(), compress=True):
+    """Codifica, descarta los paquetes de aire con indice en `perdidos` y decodifica."""
+    enc, dec = FecEncoder(k=k, compress=compress), FecDecoder()
+    aire = [pkt for p in payloads for pkt in enc.encode(p)] + enc.flush()
+    out = [x for i, pkt in enumerate(aire) if i not in perdidos for x in dec.push(pkt)]
+    return aire, out, dec
+
+
+@pytest.mark.parametrize("k", [1, 2, 4, 8])
+def test_sin_perdidas(payloads, k):
+    aire, out, dec = _enlace(payloads, k)
+    assert out == [(i % 256, p) for i, p in enumerate(payloads)]
+    assert sum(1 for pkt in aire if pkt[2] & FLAG_PARIDAD) == -(-len(payloads) // k)
+    assert dec.stats["recuperados"] == 0 and dec.stats["error"] == 0
+
+
+@pytest.mark.parametrize("k", [1, 2, 4, 8])
+def test_recupera_cualquier_perdida_por_grupo(payloads, k):
+    aire, _, _ = _enlace(payloads, k)
+    # Grupos de k datos + 1 paridad (el ultimo puede ser incompleto): se prueba cada posicion del grupo
+    grupos, actual = [], []
+    for i, pkt in enumerate(aire):
+        actual.append(i)
+        if pkt[2] & FLAG_PARIDAD:
+            grupos.append(actual)
+            actual = []
+    for pos in range(k + 1):
+        perdidos = {g[pos] for g in grupos if pos < len(g)}
+        _, out, dec = _enlace(payloads, k, perdidos)
+        assert out == [(i % 256, p) for i, p in enumerate(payloads)], f"posicion {pos}"
+        datos_perdidos = sum(1 for i in perdidos if not aire[i][2] & FLAG_PARIDAD)
+        assert dec.stats["recuperados"] == datos_perdidos
+
+
+def test_dos_perdidas_en_un_grupo(payloads):
+    _, out, dec = _enlace(payloads, 4, perdidos={0, 1})
+    assert [seq for seq, _ in out] == list(range(2, len(payloads)))
+    assert dec.stats["recuperados"] == 0
+
+
+def test_deflate_ida_y_vuelta():
+    texto = b"\xd3\x00\x13" + bytes(19) + b"\x00\x00\x00"    # muy comprimible
+    ruido = bytes((i * 97 + 13) % 251 for i in range(180))   # no comprime: viaja tal cual
+    enc, dec = FecEncoder(k=2), FecDecoder()
+    aire = enc.encode(texto * 6) + enc.encode(ruido)
+    assert aire[0][2] & FLAG_COMPRIMIDO and len(aire[0]) < HEADER_V2_LEN + len(texto) * 6
+    assert not aire[1][2] & FLAG_COMPRIMIDO
+    assert [x for pkt in aire for x in dec.push(pkt)] == [(0, texto * 6), (1, ruido)]
+    # la paridad tambien rearma un paquete comprimido
+    dec = FecDecoder()
+    assert [x for pkt in aire[1:] for x in dec.push(pkt)] == [(0, texto * 6), (1, ruido)]
+
+
+def test_sin_compresion(payloads):
+    aire, out, _ = _enlace(payloads, 4, compress=False)
+    assert not any(pkt[2] & FLAG_COMPRIMIDO for pkt in aire)
+    assert [p for _, p in out] == payloads
+
+
+@pytest.mark.parametrize("pkt", [
+    b"",
+    b"\xAA\xC2\x00",                                   # cabecera cortada
+    b"\xAA\xC1\x00\x00\x00\x14\x03abc",                # protocolo v1
+    CORR_HEADER_V2 + bytes([0, 0, 0, 0x04, 10]) + b"abc",   # largo mayor que el cuerpo
+])
+def test_cabecera_v2_invalida(pkt):
+    assert parse_v2(pkt) is None
+    dec = FecDecoder()
+    assert dec.push(pkt) == []
+    assert dec.stats["error"] == 1
+
+
+def test_cuerpo_comprimido_corrupto():
+    dec = FecDecoder()
+    assert dec.push(CORR_HEADER_V2 + bytes([FLAG_COMPRIMIDO, 0, 0, 0x04, 3]) + b"\xff\xff\xff") == []
+    assert dec.stats["error"] == 1
+
+
+def test_k_fuera_de_rango():
+    with pytest.raises(ValueError):
+        FecEncoder(k=16)
+
+
+def test_simulador_loopback(payloads):
+    frames = len(extract_rtcm_frames(bytearray(b"".join(payloads))))
+    assert simulate(payloads, 4, 0.0)["frames_con_fec"] == frames
+    res = simulate(payloads, 4, 0.15, seed=3)
+    assert res["recuperados"] > 0
+    assert res["frames_sin_fec"] <= res["frames_con_fec"] <= frames
@@ -0,0 +1,60 @@
+"""Lectura de .pos de RTKLIB: formato calendario y semana GPS, lineas cortadas."""
+import pytest
+
+from posfile import Q_FIX, Q_FLOAT, fix_stats, load_pos, read_last_solution
+
+HEADER = (
+    "% program   : RTKPOST ver.2.4.3 b34\n"
+    "%  GPST                  latitude(deg) longitude(deg)  height(m)   Q  ns   sdn(m)   sde(m)   sdu(m)\n"
+)
+EPOCAS = [
+    "2026/01/10 12:00:00.000  -34.603700000  -58.381600000    25.1230   1  14   0.0040   0.0030   0.0090\n",
+    "2026/01/10 12:00:00.200  -34.603701000  -58.381601000    25.1240   1  14   0.0040   0.0030   0.0090\n",
+    "2026/01/10 12:00:00.400  -34.603702000  -58.381602000    25.1250   2  13   0.0400   0.0300   0.0900\n",
+    "2026/01/10 12:00:00.600  -34.603703000  -58.381603000    25.1260   1  14   0.0040   0.0030   0.0090\n",
+]
+
+
+def _escribir(tmp_path, lineas):
+    path = tmp_path / "solucion.pos"
+    path.write_text(HEADER + "".join(lineas), encoding="utf-8")
+    return path
+
+
+def test_load_pos_calendario(tmp_path):
+    sol = load_pos(_escribir(tmp_path, EPOCAS))
+    assert len(sol) == 4
+    assert list(sol["q"]) == [Q_FIX, Q_FIX, Q_FLOAT, Q_FIX]
+    assert sol["lat"][2] == pytest.approx(-34.603702)
+    assert sol["time"][-1] - sol["time"][0] == pytest.approx(0.6)
+    stats = fix_stats(sol)
+    assert stats["fix"] == 3 and stats["float"] == 1
+
+
+def test_load_pos_semana_gps(tmp_path):
+    lineas = [f"2400 {475200 + 0.2 * i:.3f} " + ln.split(None, 2)[2] for i, ln in enumerate(EPOCAS)]
+    sol = load_pos(_escribir(tmp_path, lineas))
+    assert len(sol) == 4
+    assert sol["time"][1] - sol["time"][0] == pytest.approx(0.2)
+
+
+def test_ultima_linea_cortada(tmp_path):
+    # RTKLIB escribiendo todavia: la ultima epoca quedo a medio escribir
+    path = _escribir(tmp_path, EPOCAS + ["2026/01/10 12:00:00.800  -34.6037\n"])
+    sol = load_pos(path)
+    assert len(sol) == 4
+    assert sol["lat"][-1] == pytest.approx(-34.603703)
+    last = read_last_solution(path)
+    assert last["lat"] == pytest.approx(-34.603703) and last["fix"] == 4
+
+
+def test_linea_con_basura_en_el_medio(tmp_path):
+    lineas = EPOCAS[:2] + ["2026/01/10 12:00:00.300  -34.60370x  -58.38160  25.1 1 14 0.004 0.003 0.009\n"] + EPOCAS[2:]
+    sol = load_pos(_escribir(tmp_path, lineas))
+    assert len(sol) == 4
+    assert list(sol["ns"]) == [14, 14, 13, 14]
+
+
+def test_sin_epocas(tmp_path):
+    assert len(load_pos(_escribir(tmp_path, []))) == 0
+    assert read_last_solution(tmp_path / "no_existe.pos") is None
@@ -0,0 +1,118 @@
+"""CRC-24Q, extraccion de frames y reensamblado del rover sobre capturas grabadas.
+
+datos/base_corr.lora: 36 paquetes TX_CORR de la base (12 epocas de 1077/1087 a
+1 Hz, 1005 y 1230 cada 10 s; el 1077 no entra en un paquete y viaja partido).
+datos/rover_corr.bin: los 28 frames que el rover reensamblo de esos paquetes.
+"""
+from pathlib import Path
+
+import pytest
+
+from lora_log import iter_records
+from rtcm import RESYNC_PACKETS, RtcmReassembler, crc24q, extract_rtcm_frames, msm_epoch_ms, rtcm_message_type
+
+DATOS = Path(__file__).parent / "datos"
+TIPOS = {1005: 2, 1077: 12, 1087: 12, 1230: 2}
+
+
+@pytest.fixture(scope="module")
+def paquetes():
+    return [(r["seq"], r["data"], r["ts"]) for r in iter_records(DATOS / "base_corr.lora") if r["evento"] == "TX_CORR"]
+
+
+@pytest.fixture(scope="module")
+def frames():
+    return extract_rtcm_frames(bytearray((DATOS / "rover_corr.bin").read_bytes()))
+
+
+def _tipos(frames):
+    out = {}
+    for f in frames:
+        out[rtcm_message_type(f)] = out.get(rtcm_message_type(f), 0) + 1
+    return out
+
+
+def _reensamblar(asm, paquetes):
+    return [f for seq, data, ts in paquetes for f in asm.push(seq, data, ts)]
+
+
+def test_crc24q():
+    assert crc24q(b"123456789") == 0xCDE703
+    assert crc24q(b"") == 0
+
+
+def test_extraer_captura(frames):
+    assert _tipos(frames) == TIPOS
+    gps = [msm_epoch_ms(f) for f in frames if rtcm_message_type(f) == 1077]
+    assert [ms for _, ms, _ in gps] == [345600000 + 1000 * e for e in range(12)]
+
+
+def test_extraer_con_basura_y_crc_invalido(frames):
+    malo = bytearray(frames[1])
+    malo[10] ^= 0xFF
+    largo = next(f for f in frames if len(f) > 100)
+    buf = bytearray(b"\x00\xd3\xff$GPGGA,basura\r\n" + frames[0] + bytes(malo) + frames[2] + largo[:50])
+    stats = {}
+    out = extract_rtcm_frames(buf, stats=stats)
+    assert out == [frames[0], frames[2]]
+    assert stats["crc_error"] >= 1
+    assert bytes(buf) == largo[:50]   # frame a medio llegar: queda para el proximo bloque
+
+
+def test_reensamblar_captura(paquetes, frames):
+    asm = RtcmReassembler()
+    assert _reensamblar(asm, paquetes) == frames
+    assert asm.stats["perdidos"] == asm.stats["duplicados"] == asm.stats["resync"] == 0
+    assert asm.packet_loss == 0.0
+
+
+def test_paquete_perdido(paquetes, frames):
+    asm = RtcmReassembler()
+    out = _reensamblar(asm, paquetes[:5] + paquetes[6:])
+    assert asm.stats["perdidos"] == 1
+    assert 0 < len(frames) - len(out) <= 3
+    assert all(f in frames for f in out)
+    assert asm.packet_loss == pytest.approx(1 / 36)
+
+
+def test_paquete_duplicado(paquetes, frames):
+    asm = RtcmReassembler()
+    assert _reensamblar(asm, paquetes[:8] + paquetes[7:]) == frames
+    assert asm.stats["duplicados"] == 1 and asm.stats["perdidos"] == 0
+
+
+def test_crc_invalido_en_el_enlace(paquetes, frames):
+    seq, data, ts = paquetes[3]
+    malo = bytearray(data)
+    malo[-1] ^= 0x01
+    asm = RtcmReassembler()
+    out = _reensamblar(asm, paquetes[:3] + [(seq, bytes(malo), ts)] + paquetes[4:])
+    assert asm.stats["crc_error"] >= 1
+    assert len(out) < len(frames) and all(f in frames for f in out)
+
+
+def test_resync_tras_reinicio_de_la_base(paquetes, frames):
+    # La base reinicia enseguida: el seq vuelve a 0 y parece viejo hasta RESYNC_PACKETS seguidos
+    asm = RtcmReassembler()
+    _reensamblar(asm, paquetes)
+    out = _reensamblar(asm, [(seq, data, ts + 1.0) for seq, data, ts in paquetes])
+    assert asm.stats["resync"] == 1 and asm.stats["duplicados"] == 0
+    assert asm.expected_seq == (paquetes[-1][0] + 1) % 256
+    assert out and all(f in frames for f in out)
+
+
+def test_resync_tras_silencio(paquetes, frames):
+    # Reinicio despues de un corte largo: resincroniza con el primer paquete
+    asm = RtcmReassembler()
+    _reensamblar(asm, paquetes)
+    out = _reensamblar(asm, [(seq, data, ts + 60.0) for seq, data, ts in paquetes])
+    assert asm.stats["resync"] == 1 and asm.stats["duplicados"] == 0
+    assert out == frames
+
+
+def test_duplicados_aislados_no_resincronizan(paquetes, frames):
+    # Cada paquete llega repetido despues del siguiente: nunca hay RESYNC_PACKETS viejos seguidos
+    orden = [paquetes[0]] + [p for i in range(1, len(paquetes)) for p in (paquetes[i], paquetes[i - 1])]
+    asm = RtcmReassembler()
+    assert _reensamblar(asm, orden) == frames
+    assert asm.stats["resync"] == 0 and asm.stats["duplicados"] == len(paquetes) - 1 >= RESYNC_PACKETS
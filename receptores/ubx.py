@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# PROYECTO AGROPOST - DECODIFICACION UBX DE NAVEGACION
+# Autores: Carrasco, Hess
+# Descripcion: Lectura de UBX-NAV-PVT y UBX-NAV-HPPOSLLH con struct.unpack_from
+# sobre el frame ya validado por gnss_stream (sin copiar el payload). Entrega
+# posicion a resolucion completa, precision horizontal/vertical, velocidad
+# sobre el suelo y rumbo tal como los calcula el receptor.
+#
+# Resumen de un log grabado:
+#   python ubx.py rover_gps_1743.ubx
+
+import sys
+import struct
+from datetime import datetime, timezone
+
+UBX_HEADER_LEN = 6
+NAV_PVT_ID = (0x01, 0x07)
+NAV_HPPOSLLH_ID = (0x01, 0x14)
+
+NAV_PVT = struct.Struct("<IHBBBBBBIiBBBBiiiiIIiiiiiIIHH4xihH")        # 92 bytes
+NAV_HPPOSLLH = struct.Struct("<B2xBIiiiibbbbII")                      # 36 bytes
+
+# Claves CFG-MSGOUT (UBX-CFG-VALSET, receptores de generacion 9)
+CFG_MSGOUT = {
+    "NAV_PVT": {"UART1": 0x20910007, "USB": 0x20910009},
+    "NAV_HPPOSLLH": {"UART1": 0x20910034, "USB": 0x20910036},
+}
+CFG_LAYER_RAM = 0x01
+
+
+def ubx_id(frame) -> tuple:
+    return frame[2], frame[3]
+
+
+def fix_quality(fix_type: int, flags: int) -> int:
+    """Calidad estilo GGA (0 sin fix, 1 GNSS, 2 DGNSS, 4 RTK fijo, 5 RTK flotante)."""
+    if not flags & 0x01 or fix_type not in (2, 3, 4):
+        return 0
+    carr = (flags >> 6) & 0x03
+    if carr == 2:
+        return 4
+    if carr == 1:
+        return 5
+    return 2 if flags & 0x02 else 1
+
+
+def decode_nav_pvt(frame):
+    """Campos de UBX-NAV-PVT en unidades SI (grados, m, m/s)."""
+    if len(frame) < UBX_HEADER_LEN + NAV_PVT.size:
+        return None
+    (itow, year, month, day, hour, minute, sec, valid, _t_acc, nano, fix_type, flags, _flags2, num_sv,
+     lon, lat, _height, h_msl, h_acc, v_acc, vel_n, vel_e, vel_d, g_speed, head_mot, s_acc, head_acc,
+     p_dop, _flags3, _head_veh, _mag_dec, _mag_acc) = NAV_PVT.unpack_from(frame, UBX_HEADER_LEN)
+    ts = None
+    if valid & 0x03 == 0x03:   # validDate y validTime
+        try:
+            base = datetime(year, month, day, hour, minute, sec, tzinfo=timezone.utc)
+            ts = (base.timestamp() + nano * 1e-9)
+        except ValueError:
+            ts = None
+    return {
+        "itow": itow,
+        "ts": ts,
+        "lat": lat * 1e-7,
+        "lon": lon * 1e-7,
+        "alt": h_msl * 1e-3,
+        "fix_type": fix_type,
+        "fix": fix_quality(fix_type, flags),
+        "sats": num_sv,
+        "pdop": p_dop * 0.01,
+        "h_acc": h_acc * 1e-3,
+        "v_acc": v_acc * 1e-3,
+        "speed": g_speed * 1e-3,
+        "heading": head_mot * 1e-5,
+        "s_acc": s_acc * 1e-3,
+        "head_acc": head_acc * 1e-5,
+        "vel_ned": (vel_n * 1e-3, vel_e * 1e-3, vel_d * 1e-3),
+    }
+
+
+def decode_nav_hpposllh(frame):
+    """Posicion de alta precision (0.1 mm) de UBX-NAV-HPPOSLLH."""
+    if len(frame) < UBX_HEADER_LEN + NAV_HPPOSLLH.size:
+        return None
+    (_version, flags, itow, lon, lat, _height, h_msl, lon_hp, lat_hp, _height_hp, h_msl_hp,
+     h_acc, v_acc) = NAV_HPPOSLLH.unpack_from(frame, UBX_HEADER_LEN)
+    if flags & 0x01:   # invalidLlh
+        return None
+    return {
+        "itow": itow,
+        "lat": lat * 1e-7 + lat_hp * 1e-9,
+        "lon": lon * 1e-7 + lon_hp * 1e-9,
+        "alt": h_msl * 1e-3 + h_msl_hp * 1e-4,
+        "h_acc": h_acc * 1e-4,
+        "v_acc": v_acc * 1e-4,
+    }
+
+
+class UbxNavState:
+    """Combina NAV-PVT y NAV-HPPOSLLH de la misma epoca (iTOW) en una solucion.
+
+    Si el receptor no emite HPPOSLLH la solucion sale con cada NAV-PVT; cuando
+    aparece HPPOSLLH se espera el par de la epoca para publicar la posicion fina.
+    """
+
+    def __init__(self):
+        self.pvt = None
+        self.hp = None
+        self.hp_enabled = False
+        self.stats = {"pvt": 0, "hpposllh": 0, "soluciones": 0}
+
+    def _emit(self, pvt: dict, hp: dict | None):
+        if hp is not None:
+            pvt.update(hp)
+        self.pvt = None
+        self.hp = None
+        self.stats["soluciones"] += 1
+        return pvt
+
+    def push(self, frame):
+        """Procesa un frame UBX; devuelve la solucion completa de la epoca o None."""
+        mid = ubx_id(frame)
+        if mid == NAV_PVT_ID:
+            pvt = decode_nav_pvt(frame)
+            if pvt is None:
+                return None
+            self.stats["pvt"] += 1
+            if self.hp is not None and self.hp["itow"] == pvt["itow"]:
+                return self._emit(pvt, self.hp)
+            if self.hp_enabled:
+                self.pvt = pvt
+                return None
+            return self._emit(pvt, None)
+        if mid == NAV_HPPOSLLH_ID:
+            self.hp_enabled = True
+            hp = decode_nav_hpposllh(frame)
+            self.stats["hpposllh"] += 1
+            if self.pvt is not None and (hp is None or hp["itow"] == self.pvt["itow"]):
+                return self._emit(self.pvt, hp)
+            self.hp = hp
+        return None
+
+
+def cfg_msgout(rate: int = 1, ports=("UART1", "USB")) -> bytes:
+    """UBX-CFG-VALSET (capa RAM) que habilita NAV-PVT y NAV-HPPOSLLH en cada epoca."""
+    from gnss_stream import ubx_frame
+
+    payload = bytearray([0x00, CFG_LAYER_RAM, 0x00, 0x00])
+    for keys in CFG_MSGOUT.values():
+        for port in ports:
+            payload += struct.pack("<IB", keys[port], rate)
+    return ubx_frame(0x06, 0x8A, bytes(payload))
+
+
+def main():
+    from pathlib import Path
+    from gnss_stream import UBX, GnssStreamDecoder
+
+    if len(sys.argv) < 2:
+        print("Uso: python ubx.py log.ubx [...]")
+        return
+    for name in sys.argv[1:]:
+        dec = GnssStreamDecoder()
+        nav = UbxNavState()
+        calidad = {}
+        h_acc = []
+        speed_max = 0.0
+        for kind, frame in dec.feed(Path(name).read_bytes()):
+            if kind != UBX:
+                continue
+            sol = nav.push(frame)
+            if sol:
+                calidad[sol["fix"]] = calidad.get(sol["fix"], 0) + 1
+                h_acc.append(sol["h_acc"])
+                speed_max = max(speed_max, sol["speed"])
+        n = nav.stats["soluciones"]
+        if not n:
+            print(f"{name}: sin NAV-PVT (habilitar con ROVER_UBX_CONFIG=1 en movil_final.py)")
+            continue
+        h_acc.sort()
+        print(f"{name}: {n} soluciones (PVT={nav.stats['pvt']} HPPOSLLH={nav.stats['hpposllh']}), "
+              f"calidad={dict(sorted(calidad.items()))}, hAcc mediana={h_acc[n // 2]:.3f} m, "
+              f"velocidad max={speed_max:.1f} m/s")
+
+
+if __name__ == "__main__":
+    main()
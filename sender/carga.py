@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Generador de carga: simula una flota de N maquinas posteando a /api/pos en
+paralelo (asyncio + conexiones HTTP reutilizadas) y mide latencia de ingesta,
+errores y entregas por WebSocket. Cada maquina sigue su propio patron
+(geojson, circle, lawnmower) a la tasa indicada.
+
+Ejemplos:
+  python carga.py --vehiculos 20 --rate 10 --duracion 60
+  python carga.py --vehiculos 50 --patron lawnmower,circle --rate 5 --json carga_pi5.json
+  python carga.py --vehiculos 10 --patron geojson --geojson campo.geojson --rate 2
+"""
+import argparse
+import asyncio
+import json
+import math
+import time
+from datetime import datetime, timezone
+from itertools import cycle
+from pathlib import Path
+
+import httpx
+
+from sender import iter_once, load_coords, meters_to_deg_xy
+from sender2 import circle_points
+from sender3 import build_lawnmower_points
+
+PATRONES = ("geojson", "circle", "lawnmower")
+VEL_MAX = 15.0   # m/s: el filtro de ingesta del backend (AGROPOST_VEL_MAX) rechaza saltos mas rapidos
+
+
+def percentile(sorted_vals, q: float):
+    if not sorted_vals:
+        return None
+    k = min(len(sorted_vals) - 1, max(0, int(round(q / 100.0 * (len(sorted_vals) - 1)))))
+    return sorted_vals[k]
+
+
+def latency_summary(values_ms):
+    vals = sorted(values_ms)
+    out = {"n": len(vals)}
+    for name, q in (("p50", 50), ("p90", 90), ("p99", 99), ("max", 100)):
+        v = percentile(vals, q)
+        out[name] = round(v, 2) if v is not None else None
+    return out
+
+
+def vehicle_path(idx: int, patron: str, args):
+    """Lista (lat, lon) de una vuelta del patron, desplazada hacia el Este segun el vehiculo."""
+    dlat, dlon = meters_to_deg_xy(idx * args.separacion, 0.0, args.lat)
+    lat0, lon0 = args.lat + dlat, args.lon + dlon
+    if patron == "circle":
+        n = max(8, int(round(2 * math.pi * args.radius / max(args.step, 0.1))))
+        return circle_points(lat0, lon0, args.radius, n)
+    if patron == "lawnmower":
+        return _cerrado(build_lawnmower_points(lat0, lon0, args.radius, args.width, args.step), args.step)
+    base = [(lat + dlat, lon + dlon) for lat, lon in load_coords(args.geojson)]
+    return _cerrado(base, args.step)
+
+
+def _cerrado(path, step: float):
+    """Vuelta cerrada interpolada cada `step` m: al repetirla no hay salto del final al inicio
+    (ni entre pasadas del lawnmower), que el filtro de ingesta rechazaria por velocidad."""
+    return list(iter_once(path + path[:1], step))[:-1]
+
+
+class Vehicle:
+    def __init__(self, name: str, patron: str, path):
+        self.name = name
+        self.patron = patron
+        self.path = path
+        self.sent = 0
+        self.ok = 0
+        self.rejected = {}   # motivo del filtro de ingesta -> cantidad
+        self.errors = {}
+        self.delivered = 0
+        self.latencies = []   # ms desde la hora programada hasta la respuesta
+
+
+async def post_fix(client: httpx.AsyncClient, url: str, veh: Vehicle, lat: float, lon: float, scheduled: float, args):
+    # ts de la hora programada: los fixes quedan a 1/rate aunque el envio se atrase
+    ts = datetime.fromtimestamp(scheduled + args.reloj, timezone.utc)
+    payload = {
+        "ts": ts.isoformat().replace("+00:00", "Z"),
+        "lat": lat,
+        "lon": lon,
+        "fix_quality": args.fix,
+        "pdop": args.pdop,
+        "sats": args.sats,
+        "machine": veh.name,
+    }
+    veh.sent += 1
+    try:
+        r = await client.post(url, json=payload)
+        done = time.perf_counter()
+        if r.status_code != 200:
+            key = f"http_{r.status_code}"
+            veh.errors[key] = veh.errors.get(key, 0) + 1
+            return
+        body = r.json()
+        if body.get("rechazado"):
+            veh.rejected[body["rechazado"]] = veh.rejected.get(body["rechazado"], 0) + 1
+            return
+        veh.ok += 1
+        veh.delivered += int(body.get("delivered") or 0)
+        # Desde la hora programada: si el cliente se atrasa, la espera tambien cuenta
+        veh.latencies.append(1000.0 * (done - scheduled))
+    except httpx.HTTPError as e:
+        key = type(e).__name__
+        veh.errors[key] = veh.errors.get(key, 0) + 1
+
+
+async def run_vehicle(client, url: str, veh: Vehicle, args, start: float, end: float, inflight: set):
+    period = 1.0 / args.rate
+    k = 0
+    for lat, lon in cycle(veh.path):
+        # Carga de lazo abierto: la hora de envio no depende de la respuesta anterior
+        scheduled = start + k * period
+        if scheduled >= end:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.create_task(post_fix(client, url, veh, lat, lon, scheduled, args))
+        inflight.add(task)
+        task.add_done_callback(inflight.discard)
+        k += 1
+
+
+async def progress(vehicles, start: float, interval: float = 5.0):
+    last = 0
+    while True:
+        await asyncio.sleep(interval)
+        sent = sum(v.sent for v in vehicles)
+        errs = sum(sum(v.errors.values()) for v in vehicles)
+        print(f"[{time.perf_counter() - start:5.0f}s] enviados={sent} ({(sent - last) / interval:.0f}/s) errores={errs}")
+        last = sent
+
+
+async def run(args):
+    patrones = [p.strip() for p in args.patron.split(",") if p.strip()]
+    for p in patrones:
+        if p not in PATRONES:
+            raise SystemExit(f"patron desconocido: {p} (opciones: {', '.join(PATRONES)})")
+    if "geojson" in patrones and not args.geojson:
+        raise SystemExit("el patron geojson requiere --geojson")
+
+    if args.rate * args.step > VEL_MAX:
+        print(f"AVISO: {args.rate:g} Hz x {args.step:g} m = {args.rate * args.step:g} m/s supera {VEL_MAX:g} m/s; "
+              f"el filtro del backend rechazara los fixes (bajar --step/--rate o AGROPOST_FILTRO=0)")
+    args.reloj = time.time() - time.perf_counter()   # hora de pared de los instantes perf_counter
+
+    vehicles = []
+    for i in range(args.vehiculos):
+        patron = patrones[i % len(patrones)]
+        vehicles.append(Vehicle(f"{args.prefijo}{i + 1:03d}", patron, vehicle_path(i, patron, args)))
+
+    url = f"http://{args.host}:{args.port}/api/pos"
+    limits = httpx.Limits(max_connections=args.conexiones, max_keepalive_connections=args.conexiones)
+    timeout = httpx.Timeout(args.timeout)
+    target = args.vehiculos * args.rate
+    print(f"{args.vehiculos} vehiculos ({', '.join(patrones)}) a {args.rate:g} Hz = {target:g} fixes/s "
+          f"durante {args.duracion:g}s hacia {url} ({args.conexiones} conexiones)")
+
+    inflight = set()
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        start = time.perf_counter() + 0.2
+        end = start + args.duracion
+        prog = asyncio.create_task(progress(vehicles, start))
+        # Cada vehiculo arranca desfasado dentro del primer periodo para no sincronizar rafagas
+        jobs = [run_vehicle(client, url, v, args, start + (i / len(vehicles)) / args.rate, end, inflight)
+                for i, v in enumerate(vehicles)]
+        await asyncio.gather(*jobs)
+        if inflight:
+            await asyncio.wait(set(inflight), timeout=args.timeout + 1)
+        elapsed = time.perf_counter() - start
+        prog.cancel()
+
+    sent = sum(v.sent for v in vehicles)
+    ok = sum(v.ok for v in vehicles)
+    rejected = {}
+    for v in vehicles:
+        for k, n in v.rejected.items():
+            rejected[k] = rejected.get(k, 0) + n
+    errors = {}
+    for v in vehicles:
+        for k, n in v.errors.items():
+            errors[k] = errors.get(k, 0) + n
+    all_lat = [x for v in vehicles for x in v.latencies]
+    report = {
+        "fecha": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+        "destino": url,
+        "config": {
+            "vehiculos": args.vehiculos,
+            "patrones": patrones,
+            "rate_hz": args.rate,
+            "duracion_s": args.duracion,
+            "conexiones": args.conexiones,
+        },
+        "objetivo_fixes_s": target,
+        "enviados": sent,
+        "ok": ok,
+        "rechazados": rejected,
+        "errores": errors,
+        "tasa_error": round(sum(errors.values()) / sent, 5) if sent else None,
+        "throughput_fixes_s": round(ok / elapsed, 1) if elapsed > 0 else None,
+        "entregados_ws": sum(v.delivered for v in vehicles),
+        "latencia_ms": latency_summary(all_lat),
+        "por_vehiculo": [
+            {
+                "machine": v.name,
+                "patron": v.patron,
+                "puntos_vuelta": len(v.path),
+                "enviados": v.sent,
+                "ok": v.ok,
+                "rechazados": v.rejected,
+                "errores": v.errors,
+                "latencia_ms": latency_summary(v.latencies),
+            }
+            for v in vehicles
+        ],
+    }
+    lat = report["latencia_ms"]
+    print(f"\nenviados={sent} ok={ok} rechazados={rejected or 0} errores={errors or 0} throughput={report['throughput_fixes_s']} fixes/s "
+          f"(objetivo {target:g}) entregados_ws={report['entregados_ws']}")
+    if lat["n"]:
+        print(f"latencia de ingesta: p50={lat['p50']:.1f}ms p90={lat['p90']:.1f}ms p99={lat['p99']:.1f}ms max={lat['max']:.1f}ms")
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"reporte: {args.json}")
+    return report
+
+
+def main():
+    p = argparse.ArgumentParser(description="AgroPost carga: flota simulada hacia /api/pos")
+    p.add_argument("--host", default="127.0.0.1", help="host del backend (IP en la LAN)")
+    p.add_argument("--port", type=int, default=8000, help="puerto del backend")
+    p.add_argument("--vehiculos", type=int, default=10, help="cantidad de maquinas simuladas")
+    p.add_argument("--patron", default="lawnmower", help="patrones separados por coma, asignados en rueda: " + ",".join(PATRONES))
+    p.add_argument("--geojson", help="recorrido (archivo o URL, p.ej. el plan de un campo) para el patron geojson")
+    p.add_argument("--rate", type=float, default=5.0, help="puntos por segundo por vehiculo")
+    p.add_argument("--duracion", type=float, default=30.0, help="segundos de prueba")
+    p.add_argument("--conexiones", type=int, default=64, help="conexiones HTTP reutilizadas (pool)")
+    p.add_argument("--timeout", type=float, default=5.0, help="timeout por request (s)")
+    p.add_argument("--lat", type=float, default=-34.6037, help="latitud del primer vehiculo")
+    p.add_argument("--lon", type=float, default=-58.3816, help="longitud del primer vehiculo")
+    p.add_argument("--separacion", type=float, default=150.0, help="metros hacia el Este entre vehiculos")
+    p.add_argument("--radius", type=float, default=50.0, help="radio (m) de circle/lawnmower")
+    p.add_argument("--width", type=float, default=8.0, help="ancho de labor (m) para lawnmower")
+    p.add_argument("--step", type=float, default=2.0, help="separacion entre puntos (m)")
+    p.add_argument("--prefijo", default="sim", help="prefijo del nombre de cada maquina")
+    p.add_argument("--fix", type=int, default=4, help="fix_quality")
+    p.add_argument("--pdop", type=float, default=None, help="PDOP opcional")
+    p.add_argument("--sats", type=int, default=None, help="satelites opcional")
+    p.add_argument("--json", help="guardar el reporte en este archivo")
+    args = p.parse_args()
+    if args.rate <= 0 or args.vehiculos <= 0:
+        p.error("--rate y --vehiculos deben ser positivos")
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        print("bye")
+
+
+if __name__ == "__main__":
+    main()
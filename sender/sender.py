@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
-import argparse, json, math, time
+import argparse, codecs, json, math, re, time
 from datetime import datetime, timezone
-from pathlib import Path
+from itertools import islice
 import requests
 
 
@@ -53,11 +53,28 @@ def cmd_simulate(args):
             time.sleep(1.0)
 
 
+# Elipsoide WGS84 (mismas constantes que backend/agropost/geodesia.py)
+WGS84_A = 6378137.0
+WGS84_E2 = (1 / 298.257223563) * (2 - 1 / 298.257223563)
+
+
+def radii(at_lat: float):
+    """Metros por grado de latitud y de longitud a la latitud dada (radios de curvatura)."""
+    s = math.sin(math.radians(at_lat))
+    w = 1.0 - WGS84_E2 * s * s
+    m = WGS84_A * (1 - WGS84_E2) / w ** 1.5
+    n = WGS84_A / math.sqrt(w)
+    return math.radians(m), math.radians(n) * max(0.01, math.cos(math.radians(at_lat)))
+
+
+def meters_to_deg_xy(x_m: float, y_m: float, at_lat: float):
+    # x_m hacia el Este, y_m hacia el Norte
+    ky, kx = radii(at_lat)
+    return y_m / ky, x_m / kx
+
+
 def meters_to_deg(meters: float, at_lat: float):
-    # aproximación: 1° lat ~ 111_320 m, lon ~ 111_320 * cos(lat)
-    dlat = meters / 111_320.0
-    dlon = meters / (111_320.0 * max(0.1, math.cos(math.radians(at_lat))))
-    return dlat, dlon
+    return meters_to_deg_xy(meters, meters, at_lat)
 
 
 def cmd_geojson(args):
@@ -66,60 +83,20 @@ def cmd_geojson(args):
     wait = 1.0 / rate if rate > 0 else 0
     step_m = float(getattr(args, "step", 0.3))  # metros entre puntos interpolados
 
-    path = Path(args.file)
-    # Admitir archivos con BOM (guardados como UTF-8 con BOM)
-    data = json.loads(path.read_text(encoding="utf-8-sig"))
-    base = list(extract_coords(data))
-    if not base:
-        raise SystemExit("GeoJSON sin coordenadas (LineString/MultiLineString/Points)")
-
-    def dist_m(p0, p1) -> float:
-        lat0, lon0 = p0
-        lat1, lon1 = p1
-        dlat = (lat1 - lat0) * 111_320.0
-        # usar lat media para escalado en lon
-        latm = 0.5 * (lat0 + lat1)
-        dlon = (lon1 - lon0) * 111_320.0 * max(0.1, math.cos(math.radians(latm)))
-        return math.hypot(dlat, dlon)
-
-    def interpolate_segment(p0, p1, step: float):
-        """Genera puntos entre p0->p1 separados ~step metros (excluye p0, incluye p1)."""
-        if step <= 0:
-            yield p1
-            return
-        d = dist_m(p0, p1)
-        if d <= step:
-            yield p1
-            return
-        n = max(1, int(round(d / step)))
-        for i in range(1, n + 1):
-            t = i / n
-            lat = p0[0] + (p1[0] - p0[0]) * t
-            lon = p0[1] + (p1[1] - p0[1]) * t
-            yield (lat, lon)
-
-    def iter_once(coords):
-        if not coords:
-            return
-        prev = coords[0]
-        yield prev
-        for cur in coords[1:]:
-            for p in interpolate_segment(prev, cur, step_m):
-                yield p
-            prev = cur
-
-    print(
-        f"Reproduciendo GeoJSON desde {path} hacia {host}:{port} (loop={args.loop}, step={step_m}m, base_points={len(base)})"
-    )
+    path = args.file
+    print(f"Reproduciendo GeoJSON desde {path} hacia {host}:{port} (loop={args.loop}, step={step_m}m)")
     sent = 0
     try:
         while True:
-            for (lat, lon) in iter_once(base):
+            # se relee en cada vuelta: memoria constante aunque el recorrido sea de varios dias
+            for (lat, lon) in iter_once(iter_coords(path), step_m):
                 resp = post_pos(host, port, lat, lon, fix=args.fix, pdop=args.pdop, sats=args.sats)
                 sent += 1
                 print(f"[{sent}] ->", lat, lon, resp.get("delivered"))
                 if wait:
                     time.sleep(wait)
+            if not sent:
+                raise SystemExit(NO_COORDS)
             if not args.loop:
                 break
     except KeyboardInterrupt:
@@ -130,27 +107,217 @@ def cmd_geojson(args):
         time.sleep(1.0)
 
 
-def extract_coords(geo):
-    t = geo.get("type")
-    if t == "FeatureCollection":
-        for f in geo.get("features", []):
-            yield from extract_coords(f)
-    elif t == "Feature":
-        g = geo.get("geometry") or {}
-        yield from extract_coords(g)
+def dist_m(p0, p1) -> float:
+    lat0, lon0 = p0
+    lat1, lon1 = p1
+    # escalas a la lat media: alcanza para los tramos de un recorrido
+    ky, kx = radii(0.5 * (lat0 + lat1))
+    return math.hypot((lat1 - lat0) * ky, (lon1 - lon0) * kx)
+
+
+def interpolate_chunk(prev, chunk, step: float):
+    """Puntos entre prev -> chunk[0] -> ... -> chunk[-1] separados ~step metros (excluye prev).
+
+    Las escalas m/grado se calculan una vez por bloque a la latitud de `prev`.
+    """
+    if step <= 0:
+        yield from chunk
+        return
+    ky, kx = radii(prev[0])
+    lat0, lon0 = prev
+    for lat1, lon1 in chunk:
+        dlat, dlon = lat1 - lat0, lon1 - lon0
+        d = math.hypot(dlat * ky, dlon * kx)
+        if d <= step:
+            yield lat1, lon1
+        else:
+            n = max(1, int(round(d / step)))
+            for i in range(1, n + 1):
+                t = i / n
+                yield lat0 + dlat * t, lon0 + dlon * t
+        lat0, lon0 = lat1, lon1
+
+
+def iter_once(coords, step_m: float):
+    """Recorrido interpolado cada step_m metros; `coords` puede ser una lista o un iterador perezoso."""
+    it = iter(coords)
+    prev = next(it, None)
+    if prev is None:
+        return
+    yield prev
+    while True:
+        chunk = list(islice(it, CHUNK_POINTS))
+        if not chunk:
+            return
+        yield from interpolate_chunk(prev, chunk, step_m)
+        prev = chunk[-1]
+
+
+# Lectura incremental de GeoJSON: se tokeniza el archivo (o la respuesta HTTP) por bloques
+# y solo se extraen las posiciones de LineString/MultiLineString/Point/MultiPoint, con
+# memoria constante. Si "type" viene despues de "coordinates" (p.ej. ConvertTo-Json) las
+# posiciones de un nivel salen igual (solo pueden ser LineString/MultiPoint) y las mas
+# profundas (MultiLineString o Polygon) se guardan hasta conocer el tipo.
+CHUNK_BYTES = 1 << 16
+CHUNK_POINTS = 4096
+LOOKAHEAD = 256          # caracteres minimos en el buffer antes de tokenizar (una posicion entera)
+ROUTE_TYPES = ("LineString", "MultiLineString", "Point", "MultiPoint")
+NO_COORDS = "GeoJSON sin coordenadas (LineString/MultiLineString/Points)"
+_NUM = r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?"
+_TOKEN = re.compile(
+    r"\s*(?:(\[\s*(%s)\s*,\s*(%s)(?:\s*,\s*%s)*\s*\])"   # 1: posicion [lon, lat, ...]
+    r'|([{}\[\]:,])|"((?:[^"\\]|\\.)*)"|(%s)|(true|false|null))' % (_NUM, _NUM, _NUM, _NUM)
+)
+
+
+def _read_chunks(src: str):
+    if src.startswith(("http://", "https://")):
+        # p.ej. el plan de pasadas del backend: /api/campos/<id>/plan?machine=...
+        with requests.get(src, timeout=30, stream=True) as r:
+            r.raise_for_status()
+            yield from r.iter_content(CHUNK_BYTES)
     else:
-        if t == "LineString":
-            for lon, lat, *_ in geo.get("coordinates", []):
-                yield lat, lon
-        elif t == "MultiLineString":
-            for line in geo.get("coordinates", []):
-                for lon, lat, *_ in line:
-                    yield lat, lon
-        elif t == "Point":
-            lon, lat, *_ = geo.get("coordinates", [None, None])
-            if lon is not None and lat is not None:
-                yield lat, lon
-        # Polígonos se ignoran para recorrido
+        with open(src, "rb") as f:
+            while True:
+                data = f.read(CHUNK_BYTES)
+                if not data:
+                    return
+                yield data
+
+
+def _decode(chunks):
+    # Admitir BOM: UTF-8 con BOM (Notepad) o UTF-16 (PowerShell)
+    decoder = None
+    for data in chunks:
+        if decoder is None:
+            utf16 = data[:2] in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)
+            decoder = codecs.getincrementaldecoder("utf-16" if utf16 else "utf-8-sig")()
+        yield decoder.decode(data)
+    if decoder is not None:
+        yield decoder.decode(b"", final=True)
+
+
+def _tokens(texts):
+    """(tipo, valor): '{', '}', '[', ']', ':', ',', 'str', 'num', 'lit' y 'pos' = (lat, lon)."""
+    buf, pos, eof, depth = "", 0, False, 0
+    while True:
+        while not eof and len(buf) - pos < LOOKAHEAD:
+            text = next(texts, None)
+            if text is None:
+                eof = True
+            else:
+                buf, pos = buf[pos:] + text, 0
+        m = _TOKEN.match(buf, pos)
+        if m is None:
+            if eof:
+                if buf[pos:].strip():
+                    raise ValueError(f"GeoJSON invalido cerca de: {buf[pos:pos + 40]!r}")
+                if depth:
+                    raise ValueError("GeoJSON incompleto")
+                return
+            text = next(texts, None)   # token mas largo que el buffer (string larga)
+            if text is None:
+                eof = True
+            else:
+                buf, pos = buf[pos:] + text, 0
+            continue
+        pos = m.end()
+        group = m.lastindex
+        if group == 1:
+            yield "pos", (float(m.group(3)), float(m.group(2)))
+        elif group == 4:
+            punct = m.group(4)
+            if punct in "{[":
+                depth += 1
+            elif punct in "}]":
+                depth -= 1
+            yield punct, None
+        elif group == 5:
+            raw = m.group(5)
+            yield "str", json.loads(f'"{raw}"') if "\\" in raw else raw
+        elif group == 6:
+            yield "num", float(m.group(6))
+        else:
+            yield "lit", m.group(7)
+
+
+def _positions(tokens):
+    """(nivel, (lat, lon)) de un arreglo "coordinates" ya abierto: 0 = Point, 1 = LineString, ..."""
+    depth, nums = 1, []
+    for kind, value in tokens:
+        if kind == "pos":
+            yield depth, value
+        elif kind == "num":
+            nums.append(value)
+        elif kind == "[":
+            depth += 1
+            nums = []
+        elif kind == "]":
+            if len(nums) >= 2:
+                yield depth - 1, (nums[1], nums[0])
+            nums = []
+            depth -= 1
+            if depth == 0:
+                return
+
+
+def _object(tokens, geom=True):
+    """Posiciones de un objeto; `geom` = puede ser una geometria (raiz, "geometry" o "geometries")."""
+    gtype, pending = None, []
+    for kind, key in tokens:
+        if kind == "}":
+            break
+        if kind != "str":
+            continue
+        next(tokens)   # ':'
+        kind, value = next(tokens)
+        if key == "type" and kind == "str":
+            gtype = value
+        elif key == "coordinates" and kind in ("[", "pos"):
+            coords = [(0, value)] if kind == "pos" else _positions(tokens)
+            if not geom:   # p.ej. "coordinates" dentro de properties: se consume sin usar
+                for _ in coords:
+                    pass
+                continue
+            for level, p in coords:
+                if gtype is None and level > 1:
+                    pending.append(p)
+                elif gtype is None or gtype in ROUTE_TYPES:   # Polígonos se ignoran para recorrido
+                    yield p
+        elif kind == "{":
+            yield from _object(tokens, key == "geometry")
+        elif kind == "[":
+            yield from _array(tokens, key == "geometries")
+    if pending and gtype in ROUTE_TYPES:
+        yield from pending
+
+
+def _array(tokens, geom=False):
+    for kind, _ in tokens:
+        if kind == "]":
+            return
+        if kind == "{":
+            yield from _object(tokens, geom)
+        elif kind == "[":
+            yield from _array(tokens, geom)
+
+
+def iter_coords(path):
+    """(lat, lon) de un GeoJSON (archivo o URL), leidos a medida que se consumen."""
+    tokens = _tokens(_decode(_read_chunks(str(path))))
+    kind, _ = next(tokens, (None, None))
+    if kind == "{":
+        yield from _object(tokens)
+    elif kind == "[":
+        yield from _array(tokens, True)
+
+
+def load_coords(path):
+    """Lista (lat, lon) de un GeoJSON (archivo o URL); sale con error si no tiene recorrido."""
+    base = list(iter_coords(path))
+    if not base:
+        raise SystemExit(NO_COORDS)
+    return base
 
 
 def main():
@@ -174,7 +341,7 @@ def main():
     p_sim.set_defaults(func=cmd_simulate)
 
     p_gj = sub.add_parser("geojson", help="Reproducir GeoJSON")
-    p_gj.add_argument("file", help="ruta a GeoJSON con LineString/Points")
+    p_gj.add_argument("file", help="ruta o URL de un GeoJSON con LineString/Points (p.ej. /api/campos/<id>/plan)")
     p_gj.add_argument("--rate", type=float, default=2.0, help="puntos por segundo")
     p_gj.add_argument("--step", type=float, default=0.3, help="interpolar cada N metros (0=desactivado)")
     p_gj.add_argument("--loop", action="store_true")
@@ -10,6 +10,8 @@ from datetime import datetime, timezone
 
 import requests
 
+from sender import meters_to_deg
+
 
 def post_pos(host: str, port: int, lat: float, lon: float, fix: int | None = 4, pdop: float | None = None, sats: int | None = None):
   url = f"http://{host}:{port}/api/pos"
@@ -26,11 +28,14 @@ def post_pos(host: str, port: int, lat: float, lon: float, fix: int | None = 4,
   return r.json()
 
 
-def meters_to_deg(radius_m: float, at_lat: float):
-  # Aproximacion: 1 deg lat ~ 111,320 m; lon escala con cos(lat)
-  dlat = radius_m / 111_320.0
-  dlon = radius_m / (111_320.0 * max(0.1, math.cos(math.radians(at_lat))))
-  return dlat, dlon
+def circle_points(center_lat: float, center_lon: float, radius_m: float, points: int):
+  """Puntos (lat, lon) de una vuelta completa al circulo."""
+  dlat_deg, dlon_deg = meters_to_deg(radius_m, center_lat)
+  out = []
+  for i in range(points):
+    angle = 2.0 * math.pi * i / points
+    out.append((center_lat + dlat_deg * math.cos(angle), center_lon + dlon_deg * math.sin(angle)))
+  return out
 
 
 def cmd_circle(args):
@@ -42,16 +47,12 @@ def cmd_circle(args):
   wait = 1.0 / rate if rate > 0 else 0
 
   points = max(8, int(round(duration * rate)))
-  dlat_deg, dlon_deg = meters_to_deg(radius_m, center_lat)
 
   print(f"Enviando circulo r={radius_m}m en ~{duration}s ({points} puntos) hacia {host}:{port}")
   sent = 0
   try:
     while True:
-      for i in range(points):
-        angle = 2.0 * math.pi * i / points
-        lat = center_lat + dlat_deg * math.cos(angle)
-        lon = center_lon + dlon_deg * math.sin(angle)
+      for lat, lon in circle_points(center_lat, center_lon, radius_m, points):
         resp = post_pos(host, port, lat, lon, fix=args.fix, pdop=args.pdop, sats=args.sats)
         sent += 1
         print(f"[{sent}] -> {lat:.7f}, {lon:.7f} delivered={resp.get('delivered')}")
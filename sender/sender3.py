@@ -2,6 +2,8 @@
 """
 Sender3: recorre en pasadas paralelas un círculo de radio configurable (por defecto 50 m)
 para cubrirlo con ancho de labor dado (por defecto 8 m) y postea a /api/pos.
+Con --campo recorre en cambio el plan de pasadas que el backend calcula sobre el límite
+real del campo (GET /api/campos/<id>/plan).
 """
 import argparse
 import math
@@ -9,6 +11,9 @@ import time
 from datetime import datetime, timezone
 
 import requests
+from urllib.parse import quote, urlencode
+
+from sender import iter_once, load_coords, meters_to_deg_xy
 
 
 def post_pos(host: str, port: int, lat: float, lon: float, fix: int | None = 4, pdop: float | None = None, sats: int | None = None):
@@ -26,13 +31,6 @@ def post_pos(host: str, port: int, lat: float, lon: float, fix: int | None = 4,
   return r.json()
 
 
-def meters_to_deg_xy(x_m: float, y_m: float, at_lat: float):
-  # x_m hacia el Este, y_m hacia el Norte
-  dlat = y_m / 111_320.0
-  dlon = x_m / (111_320.0 * max(0.1, math.cos(math.radians(at_lat))))
-  return dlat, dlon
-
-
 def build_lawnmower_points(center_lat: float, center_lon: float, radius_m: float, width_m: float, step_m: float):
   """Genera puntos en pasadas E-O dentro del círculo."""
   if width_m <= 0:
@@ -84,6 +82,12 @@ def frange(start: float, stop: float, step: float):
   return vals
 
 
+def plan_url(args) -> str:
+  params = {k: v for k, v in (("machine", args.machine), ("angle", args.angle)) if v is not None}
+  url = f"http://{args.host}:{args.port}/api/campos/{quote(args.campo, safe='')}/plan"
+  return f"{url}?{urlencode(params)}" if params else url
+
+
 def cmd_lawn(args):
   host, port = args.host, args.port
   center_lat, center_lon = float(args.lat), float(args.lon)
@@ -93,8 +97,12 @@ def cmd_lawn(args):
   rate = float(args.rate)
   wait = 1.0 / rate if rate > 0 else 0
 
-  path = build_lawnmower_points(center_lat, center_lon, radius, width, step)
-  print(f"Recorriendo círculo r={radius}m con pasadas de {width}m, puntos={len(path)}, host={host}:{port}")
+  if args.campo:
+    path = list(iter_once(load_coords(plan_url(args)), step))
+    print(f"Recorriendo plan del campo {args.campo}, puntos={len(path)}, host={host}:{port}")
+  else:
+    path = build_lawnmower_points(center_lat, center_lon, radius, width, step)
+    print(f"Recorriendo círculo r={radius}m con pasadas de {width}m, puntos={len(path)}, host={host}:{port}")
   sent = 0
   try:
     while True:
@@ -127,6 +135,9 @@ def main():
   p.add_argument("--pdop", type=float, default=None, help="PDOP opcional")
   p.add_argument("--sats", type=int, default=None, help="satelites opcional")
   p.add_argument("--loop", action="store_true", help="repetir el recorrido")
+  p.add_argument("--campo", default=None, help="recorrer el plan de pasadas de este campo en lugar del círculo")
+  p.add_argument("--machine", default=None, help="maquinaria (ancho) para el plan; por defecto la actual del campo")
+  p.add_argument("--angle", type=float, default=None, help="rumbo de las pasadas del plan (por defecto el óptimo)")
   p.set_defaults(func=cmd_lawn)
 
   args = p.parse_args()